@@ -1,21 +1,241 @@
-import sqlite3 
+import sqlite3
 import functools
+import os
+import sys
+import tempfile
+import threading
+import time
 
-def with_db_connection(func):
-    """handles opening and closing database connections""" 
-    def wrapper(user_id):
-        conn = sqlite3.connect('users.db')
-        users = func(conn, user_id)
-        conn.close()
-        return users
+# Applied once to every new connection. WAL lets readers run while another
+# connection writes; NORMAL sync is safe with WAL; cache_size < 0 is in KiB.
+DEFAULT_PRAGMAS = {"journal_mode": "wal", "synchronous": "normal", "cache_size": -8000}
+
+
+def apply_pragmas(conn, pragmas):
+    """runs `PRAGMA name = value` for each of `pragmas` on a new connection"""
+    for name, value in pragmas.items():
+        # Switching the journal mode needs an exclusive lock, so it is only
+        # done when the database is not in that mode yet.
+        if name == "journal_mode" and \
+                conn.execute("PRAGMA journal_mode").fetchone()[0] == str(value).lower():
+            continue
+        conn.execute(f"PRAGMA {name} = {value}")
+
+
+class ConnectionPool:
+    """
+    A bounded, thread-safe pool of sqlite3 connections to one database.
+
+    - At most `size` connections are open; a checkout waits up to `timeout`
+      seconds for one to be returned, then raises sqlite3.OperationalError.
+    - A thread holds one connection at a time: nested checkouts on the same
+      thread (a decorated function calling another) get the same connection.
+    - `pragmas` are applied once, when a connection is opened.
+    - On checkout a connection is checked with `SELECT 1` and replaced if it
+      fails or is older than `max_lifetime` seconds.
+    - On return, a transaction left open is rolled back.
+    """
+
+    def __init__(self, database='users.db', size=5, pragmas=None, max_lifetime=3600.0,
+                 timeout=30.0):
+        if size <= 0:
+            raise ValueError("size must be a positive integer")
+        self.database = database
+        self.size = size
+        self.pragmas = DEFAULT_PRAGMAS if pragmas is None else pragmas
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+        self.opened = 0  # connections opened over the pool's lifetime
+        self._idle = []  # (connection, opened_at), most recently used last
+        self._open = 0
+        self._closed = False
+        self._available = threading.Condition()
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, check_same_thread=False)
+        try:
+            apply_pragmas(conn, self.pragmas)
+        except sqlite3.Error:
+            conn.close()
+            raise
+        return conn, time.monotonic()
+
+    def _healthy(self, conn, opened_at):
+        if self.max_lifetime is not None and time.monotonic() - opened_at > self.max_lifetime:
+            return False
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._available:
+            self._open -= 1
+            self._available.notify()
+
+    def _acquire(self):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while True:
+            with self._available:
+                while not self._idle and self._open >= self.size:
+                    if self._closed:
+                        raise sqlite3.OperationalError("connection pool is closed")
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise sqlite3.OperationalError(
+                            f"no connection available after {self.timeout}s")
+                    self._available.wait(remaining)
+                if self._closed:
+                    raise sqlite3.OperationalError("connection pool is closed")
+                if self._idle:
+                    entry = self._idle.pop()
+                else:
+                    self._open += 1
+                    entry = None
+            if entry is None:
+                try:
+                    entry = self._connect()
+                except BaseException:
+                    with self._available:
+                        self._open -= 1
+                        self._available.notify()
+                    raise
+                self.opened += 1
+                return entry
+            if self._healthy(*entry):
+                return entry
+            self._discard(entry[0])
+
+    def _release(self, entry):
+        conn = entry[0]
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        with self._available:
+            if self._closed:
+                self._open -= 1
+                conn.close()
+            else:
+                self._idle.append(entry)
+            self._available.notify()
+
+    def connection(self):
+        """Context manager checking a connection out for the current thread."""
+        return _Checkout(self)
+
+    def close(self):
+        """Closes the idle connections; busy ones are closed when returned."""
+        with self._available:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._available.notify_all()
+        for conn, _ in idle:
+            conn.close()
+
+
+class _Checkout:
+    """One `with pool.connection() as conn:` block."""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def __enter__(self):
+        local = self.pool._local
+        if getattr(local, "depth", 0) == 0:
+            local.entry = self.pool._acquire()
+        local.depth = getattr(local, "depth", 0) + 1
+        return local.entry[0]
+
+    def __exit__(self, *exc_info):
+        local = self.pool._local
+        local.depth -= 1
+        if local.depth == 0:
+            entry, local.entry = local.entry, None
+            self.pool._release(entry)
+
+
+default_pool = ConnectionPool('users.db')
+
+
+def with_db_connection(func=None, *, pool=None):
+    """handles opening and closing database connections
+
+    Passes a connection checked out of `pool` (`default_pool`, of
+    'users.db' connections, by default) as the first argument and returns
+    it to the pool afterwards. Use as `@with_db_connection` or
+    `@with_db_connection(pool=ConnectionPool(...))`.
+    """
+    if func is None:
+        return functools.partial(with_db_connection, pool=pool)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with (pool or default_pool).connection() as conn:
+            return func(conn, *args, **kwargs)
     return wrapper
 
-@with_db_connection 
-def get_user_by_id(conn, user_id): 
-    cursor = conn.cursor() 
-    cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,)) 
-    return cursor.fetchone() 
-    #### Fetch user by ID with automatic connection handling 
 
-user = get_user_by_id(user_id=1)
-print(user)
\ No newline at end of file
+def benchmark(calls=5000, threads=(1, 4), rows=1000):
+    """compares calls per second of a per-call connect with the pool"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        database = os.path.join(tmpdir, 'users.db')
+        conn = sqlite3.connect(database)
+        conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT, email TEXT)")
+        conn.executemany("INSERT INTO users VALUES (?, ?, ?)",
+                         ((i, f"User {i}", f"user{i}@example.com") for i in range(rows)))
+        conn.commit()
+        conn.close()
+
+        def lookup(conn, user_id):
+            return conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+
+        def per_call(user_id):
+            conn = sqlite3.connect(database)
+            try:
+                return lookup(conn, user_id)
+            finally:
+                conn.close()
+
+        print(f"{'connections':>12} {'threads':>8} {'calls/s':>10}")
+        for workers in threads:
+            bench_pool = ConnectionPool(database, size=workers)
+            pooled = with_db_connection(lookup, pool=bench_pool)
+            for label, call in (("per call", per_call), ("pooled", pooled)):
+                def run(count):
+                    for i in range(count):
+                        call(i % rows)
+                started = time.perf_counter()
+                runners = [threading.Thread(target=run, args=(calls // workers,))
+                           for _ in range(workers)]
+                for runner in runners:
+                    runner.start()
+                for runner in runners:
+                    runner.join()
+                elapsed = time.perf_counter() - started
+                print(f"{label:>12} {workers:>8} {calls // workers * workers / elapsed:>10,.0f}")
+            bench_pool.close()
+
+
+@with_db_connection
+def get_user_by_id(conn, user_id):
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
+    return cursor.fetchone()
+    #### Fetch user by ID with automatic connection handling
+
+if __name__ == "__main__":
+    if "--benchmark" in sys.argv:
+        benchmark()
+    else:
+        user = get_user_by_id(user_id=1)
+        print(user)
@@ -1,30 +1,361 @@
-import sqlite3 
+import sqlite3
 import functools
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
 
-def with_db_connection(func):
-    """handles opening and closing database connections"""
-    def wrapper(user_id, new_email):
-        conn = sqlite3.connect('users.db')
-        func(conn, user_id, new_email)
-        conn.close()
+_pooling = __import__('1-with_db_connection')
+with_db_connection = _pooling.with_db_connection
 
-    return wrapper
+# Authorizer actions that change a table, and the argument naming it.
+WRITE_ACTIONS = {sqlite3.SQLITE_INSERT: 0, sqlite3.SQLITE_UPDATE: 0,
+                 sqlite3.SQLITE_DELETE: 0, sqlite3.SQLITE_DROP_TABLE: 0,
+                 sqlite3.SQLITE_ALTER_TABLE: 1}
+
+# Called with the set of tables written by every committed transaction.
+commit_listeners = []
+
+
+def on_commit(listener):
+    """registers `listener(tables)`, called after each commit (e.g. a cache's invalidate)"""
+    commit_listeners.append(listener)
+    return listener
+
+
+def _track_writes(tables):
+    """returns a sqlite3 authorizer that adds every table written to `tables`"""
+    def authorizer(action, arg1, arg2, db_name, trigger):
+        index = WRITE_ACTIONS.get(action)
+        if index is not None:
+            table = (arg1, arg2)[index]
+            if table and not table.startswith("sqlite_"):
+                tables.add(table.lower())
+        return sqlite3.SQLITE_OK
+    return authorizer
+
+
+def _notify(written):
+    if written:
+        for listener in commit_listeners:
+            try:
+                listener(written)
+            except Exception as e:
+                # The transaction is committed; a failing listener must not
+                # make the write look failed or keep the others from running.
+                print(f"Commit listener failed: {e}")
+
+
+class _Write:
+    """one decorated call waiting for its group commit"""
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.written = set()
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class GroupCommitter:
+    """
+    Commits the writes of many concurrent callers together.
+
+    A writer thread owns one connection to `database`. It takes the calls
+    queued while the previous batch was committing, plus those submitted
+    within `window` seconds (at most `max_batch`), and runs them in one
+    transaction, each inside its own savepoint. A call that raises has
+    only its savepoint rolled back; the others are committed together, so
+    a batch costs one commit (and one fsync) instead of one per call.
+    `submit` blocks until the call's batch has been committed. If the
+    writer thread fails (e.g. it cannot open the database), the calls
+    waiting for it raise its error and the next `submit` starts a new one.
+    """
+
+    _STOP = object()
+
+    def __init__(self, database='users.db', max_batch=256, window=0.0, pragmas=None):
+        self.database = database
+        self.max_batch = max_batch
+        self.window = window
+        self.pragmas = _pooling.DEFAULT_PRAGMAS if pragmas is None else pragmas
+        self.batches = 0
+        self.calls = 0
+        self._queue = None
+        self._lock = threading.Lock()
+        self._thread = None
+        # The connection and the write tracker of the writer running on the
+        # current thread; a writer finishing after `close` keeps its own.
+        self._writer = threading.local()
+
+    def _start(self):
+        if self._thread is None:
+            # Each writer has its own queue, so one still finishing after
+            # `close` never takes the calls of the next one.
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run, args=(self._queue,),
+                                            name="group-commit", daemon=True)
+            self._thread.start()
+
+    def submit(self, func, args=(), kwargs=None):
+        """runs `func(conn, *args, **kwargs)` in the next group commit and returns its outcome"""
+        write = _Write(func, args, kwargs or {})
+        conn = getattr(self._writer, "conn", None)
+        if conn is not None:
+            # A grouped call made by another one joins its transaction.
+            self._execute(conn, write, nested=True)
+        else:
+            with self._lock:
+                # Queued under the lock, so a failing writer either fails
+                # this call or is already replaced by a new one.
+                self._start()
+                self._queue.put(write)
+            write.done.wait()
+        if write.error is not None:
+            raise write.error
+        return write.result
+
+    def close(self):
+        """commits the calls already submitted and stops the writer thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is not None:
+                # After every call queued for this writer; a later `submit`
+                # starts a new writer with a new queue.
+                self._queue.put(self._STOP)
+        if thread is not None:
+            thread.join()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, isolation_level=None, check_same_thread=False)
+        try:
+            _pooling.apply_pragmas(conn, self.pragmas)
+        except sqlite3.Error:
+            conn.close()
+            raise
+        return conn
 
-def transactional(func):
-    """ handels the transaction """
-    def wrapper(conn, user_id, new_email):
+    def _run(self, calls):
+        batch = []
         try:
-            func(conn, user_id, new_email)
+            conn = self._writer.conn = self._connect()
+            try:
+                while True:
+                    batch = self._next_batch(calls)
+                    if batch is None:
+                        return
+                    self._commit(conn, batch)
+            finally:
+                self._writer.conn = None
+                conn.close()
+        except BaseException as err:
+            self._abandon(calls, batch, err)
+
+    def _abandon(self, calls, batch, err):
+        """fails the calls of a dying writer thread so none waits for it forever"""
+        print(f"Group commit writer failed: {err}")
+        with self._lock:
+            waiting = [write for write in batch if not write.done.is_set()]
+            # Unless `close` already let it go, later calls start a new writer.
+            if self._thread is threading.current_thread():
+                self._thread = None
+            while True:
+                try:
+                    write = calls.get_nowait()
+                except queue.Empty:
+                    break
+                if write is not self._STOP:
+                    waiting.append(write)
+        for write in waiting:
+            write.result = None
+            write.error = err
+            write.done.set()
+
+    def _next_batch(self, calls):
+        """the calls of the next batch, or None once the committer is closed"""
+        first = calls.get()
+        if first is self._STOP:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    write = calls.get(timeout=remaining)
+                else:
+                    write = calls.get_nowait()
+            except queue.Empty:
+                break
+            if write is self._STOP:
+                calls.put(write)
+                break
+            batch.append(write)
+        return batch
+
+    def _authorize(self, action, arg1, arg2, db_name, trigger):
+        track = getattr(self._writer, "track", None)
+        if track is None:  # BEGIN / COMMIT, outside any call
+            return sqlite3.SQLITE_OK
+        return track(action, arg1, arg2, db_name, trigger)
+
+    def _execute(self, conn, write, nested=False):
+        # Savepoints stack, so nested calls can reuse the name; a constant
+        # name keeps the statements in the connection's statement cache.
+        name = "grouped_call"
+        conn.execute(f"SAVEPOINT {name}")
+        if not nested:
+            # Nested calls record into the writes of the call that made them.
+            self._writer.track = _track_writes(write.written)
+        try:
+            write.result = write.func(conn, *write.args, **write.kwargs)
+            conn.execute(f"RELEASE {name}")
+        except BaseException as err:
+            conn.execute(f"ROLLBACK TO {name}")
+            conn.execute(f"RELEASE {name}")
+            write.written.clear()
+            if not isinstance(err, sqlite3.Error):
+                write.error = err
+
+    def _commit(self, conn, batch):
+        # One authorizer for the whole batch: setting it expires prepared
+        # statements, so it is not swapped per call.
+        conn.set_authorizer(self._authorize)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for write in batch:
+                self._execute(conn, write)
+            self._writer.track = None
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            # The whole batch is lost: every call fails as if it had raised.
+            if conn.in_transaction:
+                conn.rollback()
+            for write in batch:
+                write.result = None
+                write.written.clear()
+        finally:
+            self._writer.track = None
+            conn.set_authorizer(None)
+        written = set()
+        for write in batch:
+            written |= write.written
+        self.batches += 1
+        self.calls += len(batch)
+        try:
+            _notify(written)
+        finally:
+            for write in batch:
+                write.done.set()
+
+
+def transactional(func=None, *, group=None):
+    """ handels the transaction
+
+    Commits when `func` returns and rolls back if it raises a
+    sqlite3.Error (the call then returns None). The tables written by a
+    committed transaction are passed to every `commit_listeners` entry.
+
+    With `group=GroupCommitter(...)` the call is instead run by the
+    committer on its own connection, inside a savepoint of a transaction
+    shared with other concurrent calls, and the decorated function is
+    called without a connection: `update(user_id=1, ...)`. A sqlite3.Error
+    rolls back only that call's savepoint; the outcome per call is the
+    same as without `group`.
+    """
+    if func is None:
+        return functools.partial(transactional, group=group)
+
+    if group is not None:
+        @functools.wraps(func)
+        def grouped(*args, **kwargs):
+            return group.submit(func, args, kwargs)
+        return grouped
+
+    @functools.wraps(func)
+    def wrapper(conn, *args, **kwargs):
+        written = set()
+        # Setting an authorizer expires prepared statements, so statements
+        # from the connection's cache are re-checked as well.
+        conn.set_authorizer(_track_writes(written))
+        try:
+            result = func(conn, *args, **kwargs)
             conn.commit()
         except sqlite3.Error:
             conn.rollback()
+            return None
+        finally:
+            conn.set_authorizer(None)
+        _notify(written)
+        return result
     return wrapper
 
-@with_db_connection 
-@transactional 
-def update_user_email(conn, user_id, new_email): 
-    cursor = conn.cursor() 
-    cursor.execute("UPDATE users SET email = ? WHERE id = ?", (new_email, user_id)) 
+
+def benchmark(threads=16, calls=200,
+              settings=(("wal", "normal"), ("wal", "full"), ("delete", "full"))):
+    """compares updates per second of per-call commits with group commit"""
+    # Next to this file rather than in the temp directory, which may be
+    # memory-backed and make every fsync free.
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(__file__))) as tmpdir:
+        database = os.path.join(tmpdir, 'users.db')
+        conn = sqlite3.connect(database)
+        conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT, email TEXT)")
+        conn.executemany("INSERT INTO users VALUES (?, ?, ?)",
+                         ((i, f"User {i}", f"user{i}@example.com") for i in range(1000)))
+        conn.commit()
+        conn.close()
+
+        def update(conn, user_id, new_email):
+            conn.execute("UPDATE users SET email = ? WHERE id = ?", (new_email, user_id))
+            return True
+
+        print(f"{'journal':>8} {'synchronous':>12} {'mode':>10} {'updates/s':>10} "
+              f"{'commits':>8} {'failed':>7}")
+        for journal, sync in settings:
+            pragmas = dict(_pooling.DEFAULT_PRAGMAS, journal_mode=journal, synchronous=sync)
+            conn = sqlite3.connect(database)
+            conn.execute(f"PRAGMA journal_mode = {journal}")
+            conn.close()
+            pool = _pooling.ConnectionPool(database, size=threads, pragmas=pragmas)
+            group = GroupCommitter(database, pragmas=pragmas)
+            modes = (("per call", with_db_connection(transactional(update), pool=pool)),
+                     ("group", transactional(update, group=group)))
+            for label, call in modes:
+                failed = []
+
+                def run(worker):
+                    for i in range(calls):
+                        if not call(user_id=(worker * calls + i) % 1000,
+                                    new_email=f"{i}@example.com"):
+                            failed.append(i)
+                started = time.perf_counter()
+                runners = [threading.Thread(target=run, args=(n,)) for n in range(threads)]
+                for runner in runners:
+                    runner.start()
+                for runner in runners:
+                    runner.join()
+                elapsed = time.perf_counter() - started
+                done = threads * calls - len(failed)
+                commits = group.batches if label == "group" else done
+                print(f"{journal:>8} {sync:>12} {label:>10} "
+                      f"{done / elapsed:>10,.0f} {commits:>8} {len(failed):>7}")
+            group.close()
+            pool.close()
+
+
+@with_db_connection
+@transactional
+def update_user_email(conn, user_id, new_email):
+    cursor = conn.cursor()
+    cursor.execute("UPDATE users SET email = ? WHERE id = ?", (new_email, user_id))
     #### Update user's email with automatic transaction handling
 
-update_user_email(user_id=1, new_email='Crawford_Cartwright@hotmail.com')
\ No newline at end of file
+if __name__ == "__main__":
+    if "--benchmark" in sys.argv:
+        benchmark()
+    else:
+        update_user_email(user_id=1, new_email='Crawford_Cartwright@hotmail.com')
@@ -1,21 +1,191 @@
 import time
 import sqlite3
+import asyncio
 import functools
+import inspect
+import random
+import threading
 
-def retry_on_failure(retries=3, delay=2):
-    """Decorator to retry database operations on failure."""
+with_db_connection = __import__('1-with_db_connection').with_db_connection
+
+# sqlite3 errors worth retrying: another connection holds a lock.
+RETRYABLE_CODES = {5, 6}  # SQLITE_BUSY, SQLITE_LOCKED
+RETRYABLE_MESSAGES = ("database is locked", "database table is locked", "database is busy")
+
+
+def is_retryable(err):
+    """True for transient errors: sqlite busy/locked, timeouts and dropped connections"""
+    if isinstance(err, sqlite3.OperationalError):
+        code = getattr(err, "sqlite_errorcode", None)
+        if code is not None:
+            return code & 0xff in RETRYABLE_CODES
+        return any(message in str(err) for message in RETRYABLE_MESSAGES)
+    return isinstance(err, (TimeoutError, ConnectionError))
+
+
+class RetryError(Exception):
+    """Raised when a call gives up; the last error is its `__cause__`."""
+
+
+class RetryBudget:
+    """
+    A token bucket limiting the retries sent to one target: each retry
+    takes a token, and tokens refill at `rate` per second up to `burst`.
+    When it is empty, calls fail instead of retrying, so a failing target
+    sees at most `rate` extra calls per second however many clients retry.
+    """
+
+    def __init__(self, rate=10.0, burst=20.0):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        """takes a token if one is left; returns whether it did"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class RetryMetrics:
+    """Counters of one target's calls, attempts, retries and give-ups."""
+
+    FIELDS = ("calls", "attempts", "retries", "successes", "non_retryable",
+              "exhausted", "budget_exhausted")
+
+    def __init__(self):
+        for field in self.FIELDS:
+            setattr(self, field, 0)
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for field, count in counts.items():
+                setattr(self, field, getattr(self, field) + count)
+
+    @property
+    def give_ups(self):
+        """calls that ran out of attempts or of retry budget"""
+        return self.exhausted + self.budget_exhausted
+
+    def as_dict(self):
+        with self._lock:
+            values = {field: getattr(self, field) for field in self.FIELDS}
+        values["give_ups"] = values["exhausted"] + values["budget_exhausted"]
+        return values
+
+
+_budgets = {}
+_metrics = {}
+_registry_lock = threading.Lock()
+
+
+def budget_for(target, rate=10.0, burst=20.0):
+    """the RetryBudget shared by every call to `target` (created on first use)"""
+    with _registry_lock:
+        if target not in _budgets:
+            _budgets[target] = RetryBudget(rate, burst)
+        return _budgets[target]
+
+
+def metrics_for(target):
+    """the RetryMetrics of `target` (created on first use)"""
+    with _registry_lock:
+        if target not in _metrics:
+            _metrics[target] = RetryMetrics()
+        return _metrics[target]
+
+
+def metrics():
+    """every target's counters, as `{target: RetryMetrics.as_dict()}`"""
+    with _registry_lock:
+        targets = dict(_metrics)
+    return {target: values.as_dict() for target, values in targets.items()}
+
+
+def backoff(delay, max_delay, previous=None, rng=random):
+    """the next pause with decorrelated jitter: uniform(delay, 3 * previous), capped"""
+    previous = delay if previous is None else previous
+    return min(max_delay, rng.uniform(delay, previous * 3))
+
+
+def retry_on_failure(retries=3, delay=2, max_delay=30, retry_on=is_retryable, target=None,
+                     budget=None):
+    """Decorator to retry database operations on failure.
+
+    Makes up to `retries` attempts. Only errors for which `retry_on(err)`
+    is true are retried (by default transient sqlite busy/locked errors,
+    timeouts and dropped connections); others are raised at once. Pauses
+    grow exponentially from `delay` seconds with decorrelated jitter,
+    capped at `max_delay`, so clients failing together do not retry
+    together. Every retry takes a token from the RetryBudget of `target`
+    (the function's name by default), shared by all functions using that
+    target. Coroutine functions await the pauses instead of sleeping the
+    thread. Counters per target are available from `metrics()`.
+
+    Raises:
+        RetryError: after the last attempt or when the budget is empty,
+                    with the last error as its cause.
+    """
     def decorator(func):
+        name = target or f"{func.__module__}.{func.__qualname__}"
+        bucket = budget or budget_for(name)
+        counters = metrics_for(name)
+
+        def next_pause(attempt, err, previous):
+            """returns the pause before the next attempt, or raises to give up"""
+            if not retry_on(err):
+                counters.add(non_retryable=1)
+                raise err
+            if attempt >= retries:
+                counters.add(exhausted=1)
+                raise RetryError("Operation failed after retries") from err
+            if not bucket.try_acquire():
+                counters.add(budget_exhausted=1)
+                raise RetryError(f"Retry budget of {name} exhausted") from err
+            counters.add(retries=1)
+            pause = backoff(delay, max_delay, previous)
+            print(f"Retry {attempt}/{retries} failed. Retrying in {pause:.2f}s...")
+            return pause
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                counters.add(calls=1)
+                pause = None
+                for attempt in range(1, retries + 1):
+                    counters.add(attempts=1)
+                    try:
+                        result = await func(*args, **kwargs)
+                    except Exception as e:
+                        pause = next_pause(attempt, e, pause)
+                        await asyncio.sleep(pause)
+                        continue
+                    counters.add(successes=1)
+                    return result
+            return async_wrapper
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            attempt = 0
-            while attempt < retries:
+            counters.add(calls=1)
+            pause = None
+            for attempt in range(1, retries + 1):
+                counters.add(attempts=1)
                 try:
-                    return func(*args, **kwargs)
+                    result = func(*args, **kwargs)
                 except Exception as e:
-                    attempt += 1
-                    print(f"Retry {attempt}/{retries} failed. Retrying in {delay}s...")
-                    time.sleep(delay)
-            raise Exception("Operation failed after retries")
+                    pause = next_pause(attempt, e, pause)
+                    time.sleep(pause)
+                    continue
+                counters.add(successes=1)
+                return result
         return wrapper
     return decorator
 
@@ -26,6 +196,7 @@ def fetch_users_with_retry(conn):
     cursor.execute("SELECT * FROM users")
     return cursor.fetchall()
 
-# Attempt to fetch users with automatic retry on failure
-users = fetch_users_with_retry()
-print(users)
\ No newline at end of file
+if __name__ == "__main__":
+    # Attempt to fetch users with automatic retry on failure
+    users = fetch_users_with_retry()
+    print(users)
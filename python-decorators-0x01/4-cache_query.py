@@ -1,20 +1,402 @@
+import asyncio
 import functools
+import inspect
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
 
-query_cache = {}
+with_db_connection = __import__('1-with_db_connection').with_db_connection
+_transactional = __import__('2-transactional')
 
-def cache_query(func):
-    """Decorator to cache query results."""
-    @functools.wraps(func)
-    def wrapper(*args, **kwargs):
+# Quoted strings and identifiers are kept as written; everything else is
+# case- and whitespace-normalized.
+_QUOTED = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])""")
+_SPACE = re.compile(r"\s+")
+_WRITE = re.compile(r"^\s*(?:insert|update|delete|replace|drop|alter|create)\b", re.IGNORECASE)
+# Tokens of `tables_in`: a string, a (possibly qualified and quoted) name,
+# or one other character.
+_NAME_PART = r"""(?:"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\]|[\w$]+)"""
+_TOKEN = re.compile(rf"""\s*(?:('(?:[^']|'')*')|({_NAME_PART}(?:\s*\.\s*{_NAME_PART})*)|(\S))""")
+_LAST_PART = re.compile(rf"""{_NAME_PART}\s*$""")
+# Keywords followed by a table name, and those that end a FROM list.
+_TABLE_BEFORE = {"from", "join", "into", "update", "table"}
+_FROM_END = {"where", "group", "order", "having", "limit", "window", "union", "except",
+             "intersect", "returning", "set", "values", "select"}
+_SKIPPED = {"if", "not", "exists", "or", "replace", "ignore", "abort", "fail", "rollback",
+            "only", "lateral"}
+# Tags an entry whose tables could not all be named; any invalidation drops it.
+ANY_TABLE = "*"
+
+
+def normalize_sql(query):
+    """collapses whitespace and case outside quotes, and drops a trailing ';'"""
+    parts = _QUOTED.split(query.strip().rstrip(";").strip())
+    return "".join(part if i % 2 else _SPACE.sub(" ", part).lower()
+                   for i, part in enumerate(parts))
+
+
+def _unquote(name):
+    part = _LAST_PART.search(name).group()
+    if part[0] in "\"`[":
+        return part[1:-1].replace('""', '"').lower()
+    return part.lower()
+
+
+def tables_in(query):
+    """the (lower-cased) tables a statement reads from or writes to
+
+    Whole FROM lists (`FROM users u, orders o`), joins, subqueries and CTE
+    bodies are scanned; a CTE's own name is reported as well, which is
+    harmless. A source that cannot be named (e.g. a table-valued function)
+    adds ANY_TABLE. Views are reported by their name, not their tables.
+    """
+    tables = set()
+    in_from = [False]  # per parenthesis depth: inside a FROM list
+    expect = None  # the keyword whose table name comes next
+    source = False  # the last token named a FROM or JOIN source
+    for string, name, char in _TOKEN.findall(query):
+        word = name.lower()
+        if expect is not None:
+            if word in _SKIPPED:
+                continue
+            if name and word not in _FROM_END:
+                tables.add(_unquote(name))
+                source = expect in ("from", "join")
+                expect = None
+                continue
+            if string or char not in ("", "("):
+                tables.add(ANY_TABLE)  # e.g. a string used as a table name
+            expect = None
+        if char == "(" and source:
+            tables.add(ANY_TABLE)  # a table-valued function
+        source = False
+        if char == "(":
+            in_from.append(False)
+        elif char == ")":
+            if len(in_from) > 1:
+                in_from.pop()
+        elif char == "," and in_from[-1]:
+            expect = "from"
+        elif word in _TABLE_BEFORE:
+            expect = word
+            if word == "from":
+                in_from[-1] = True
+        elif word in _FROM_END:
+            in_from[-1] = False
+    return tables
+
+
+def approx_size(value):
+    """approximate bytes held by a query result (rows of tuples, dicts, strings)"""
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple, set)):
+        size += sum(approx_size(item) for item in value)
+    elif isinstance(value, dict):
+        size += sum(approx_size(k) + approx_size(v) for k, v in value.items())
+    return size
+
+
+class _Flight:
+    """one in-flight call: its result or error, set once the leader finishes"""
+
+    def __init__(self, owner):
+        self.owner = owner
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key: the first caller (the
+    leader) runs the function, later callers wait and get its result or
+    its exception. `coalesced` counts the callers that waited.
+
+    `run` is for threads; `run_async` is for coroutines, which coalesce
+    with the other tasks of the same event loop. If a leader task is
+    cancelled, its waiters are not: one of them runs the function instead.
+    """
+
+    _RETRY = object()  # the result seen by waiters when their leader was cancelled
+
+    def __init__(self):
+        self.coalesced = 0
+        self._calls = {}  # key -> _Flight
+        self._futures = {}  # (loop, key) -> asyncio.Future
+        self._lock = threading.Lock()
+
+    def run(self, key, func):
+        """returns `func()`, run once for all the threads asking for `key`"""
+        me = threading.get_ident()
+        with self._lock:
+            flight = self._calls.get(key)
+            # A leader calling itself again for the same key runs it itself
+            # rather than waiting for its own result forever.
+            if flight is not None and flight.owner != me:
+                self.coalesced += 1
+            else:
+                flight = None
+                own = _Flight(me)
+                self._calls.setdefault(key, own)
+        if flight is not None:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            own.result = func()
+            return own.result
+        except BaseException as err:
+            own.error = err
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is own:
+                    del self._calls[key]
+            own.done.set()
+
+    async def run_async(self, key, func):
+        """returns `await func()`, awaited once for all the tasks asking for `key`"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            future = self._futures.get((loop, key))
+            leader = future is None
+            if leader:
+                future = self._futures[(loop, key)] = loop.create_future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            # shield: a waiter being cancelled must not cancel the leader's call.
+            result = await asyncio.shield(future)
+            if result is self._RETRY:
+                # The key is free again: the first waiter back leads.
+                return await self.run_async(key, func)
+            return result
+        try:
+            result = await func()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.set_result(self._RETRY)
+            raise
+        except BaseException as err:
+            future.set_exception(err)
+            future.exception()  # retrieved here, so no "never retrieved" warning
+            raise
+        finally:
+            with self._lock:
+                del self._futures[(loop, key)]
+
+
+class QueryCache:
+    """
+    A thread-safe LRU cache of query results.
+
+    - Entries are evicted least recently used first once there are more
+      than `max_entries` or their approximate size exceeds `max_bytes`.
+    - Each entry expires `ttl` seconds after it was stored (None: never).
+    - `invalidate(tables)` drops every entry reading one of the tables
+      and bumps `generation`; a result read before that is not stored.
+      Entries tagged ANY_TABLE are dropped by every invalidation, and
+      invalidating ANY_TABLE drops every entry.
+    - `flight` coalesces concurrent misses of one key (see SingleFlight).
+    - `hits`, `misses`, `evictions`, `expirations`, `invalidations` and
+      `flight.coalesced` count what happened; `stats()` returns them.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=16 * 2 ** 20, ttl=300.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self.generation = 0
+        self.hits = self.misses = self.evictions = 0
+        self.expirations = self.invalidations = 0
+        self._entries = OrderedDict()  # key -> (result, size, expires_at, tables)
+        self._by_table = {}  # table -> keys of the entries reading it
+        self.flight = SingleFlight()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key, default=None):
+        """returns the cached result for `key`, or `default` on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, result, tables=(), ttl=None, generation=None):
+        """stores `result` under `key`, evicting older entries to stay in bounds
+
+        With `generation` (read before running the query), the result is
+        dropped if an invalidation happened while it was being read.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        size = approx_size(result)
+        if size > self.max_bytes:
+            return
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        tables = frozenset(tables)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (result, size, expires_at, tables)
+            self.bytes += size
+            for table in tables:
+                self._by_table.setdefault(table, set()).add(key)
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, tables):
+        """drops every entry that reads one of `tables`; returns how many"""
+        with self._lock:
+            self.generation += 1
+            tables = {table.lower() for table in tables}
+            if ANY_TABLE in tables:
+                keys = set(self._entries)
+            else:
+                keys = set(self._by_table.get(ANY_TABLE, ())) if tables else set()
+            for table in tables:
+                keys |= self._by_table.get(table, set())
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def clear(self):
+        """drops every entry (the counters are kept)"""
+        with self._lock:
+            self._entries.clear()
+            self._by_table.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """the counters, entry count and approximate bytes, as a dict"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "expirations": self.expirations, "invalidations": self.invalidations,
+                    "coalesced": self.flight.coalesced, "entries": len(self._entries),
+                    "bytes": self.bytes}
+
+    def _remove(self, key):
+        _, size, _, tables = self._entries.pop(key)
+        self.bytes -= size
+        for table in tables:
+            keys = self._by_table.get(table)
+            keys.discard(key)
+            if not keys:
+                del self._by_table[table]
+
+
+query_cache = QueryCache()
+
+# Writes committed through `transactional` invalidate the tables they touched.
+_transactional.on_commit(query_cache.invalidate)
+
+
+def cache_query(func=None, *, cache=None, ttl=None):
+    """Decorator to cache query results.
+
+    The key is the normalized SQL plus its bound parameters (the `query`
+    and `params` arguments, by keyword or position after the connection).
+    On a miss only one caller per key runs the query; concurrent callers
+    wait for its result or error (single flight). Coroutine functions are
+    cached and coalesced the same way. Statements that write are run
+    uncached and invalidate the tables they name. Use as `@cache_query`
+    or `@cache_query(cache=..., ttl=...)`.
+    """
+    if func is None:
+        return functools.partial(cache_query, cache=cache, ttl=ttl)
+
+    def plan(args, kwargs):
+        """returns (store, query, key); key is None when the call is not cached"""
+        store = cache if cache is not None else query_cache
         query = kwargs.get("query", args[1] if len(args) > 1 else None)
-        if query in query_cache:
+        params = kwargs.get("params", args[2] if len(args) > 2 else ())
+        if not isinstance(query, str):
+            return store, None, None
+        if _WRITE.match(query):
+            return store, query, None
+        return store, query, (normalize_sql(query), _freeze(params))
+
+    def cached(store, key):
+        result = store.get(key, _MISSING)
+        if result is not _MISSING:
             print("Using cached result for query.")
-            return query_cache[query]
-        result = func(*args, **kwargs)
-        query_cache[query] = result
         return result
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            store, query, key = plan(args, kwargs)
+            if key is None:
+                result = await func(*args, **kwargs)
+                if query is not None:
+                    store.invalidate(tables_in(query))
+                return result
+            result = cached(store, key)
+            if result is not _MISSING:
+                return result
+
+            async def load():
+                generation = store.generation
+                result = await func(*args, **kwargs)
+                store.put(key, result, tables_in(query), ttl, generation)
+                return result
+            return await store.flight.run_async(key, load)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        store, query, key = plan(args, kwargs)
+        if key is None:
+            result = func(*args, **kwargs)
+            if query is not None:
+                store.invalidate(tables_in(query))
+            return result
+        result = cached(store, key)
+        if result is not _MISSING:
+            return result
+
+        def load():
+            generation = store.generation
+            result = func(*args, **kwargs)
+            store.put(key, result, tables_in(query), ttl, generation)
+            return result
+        return store.flight.run(key, load)
     return wrapper
 
+
+_MISSING = object()
+
+
+def _freeze(params):
+    """makes bound parameters hashable for use in a cache key"""
+    if isinstance(params, dict):
+        return tuple(sorted(params.items()))
+    if isinstance(params, (list, tuple)):
+        return tuple(params)
+    return params
+
 @with_db_connection
 @cache_query
 def fetch_users_with_cache(conn, query):
@@ -22,8 +404,9 @@ def fetch_users_with_cache(conn, query):
     cursor.execute(query)
     return cursor.fetchall()
 
-# First call will cache the result
-users = fetch_users_with_cache(query="SELECT * FROM users")
+if __name__ == "__main__":
+    # First call will cache the result
+    users = fetch_users_with_cache(query="SELECT * FROM users")
 
-# Second call will use the cached result
-users_again = fetch_users_with_cache(query="SELECT * FROM users")
\ No newline at end of file
+    # Second call will use the cached result
+    users_again = fetch_users_with_cache(query="SELECT * FROM users")
@@ -0,0 +1,246 @@
+import time
+import sqlite3
+import functools
+import inspect
+import threading
+from collections import deque
+
+with_db_connection = __import__('1-with_db_connection').with_db_connection
+_retry = __import__('3-retry_on_failure')
+retry_on_failure = _retry.retry_on_failure
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+STATES = (CLOSED, OPEN, HALF_OPEN)
+
+# sqlite3 errors meaning the database cannot be used, unlike e.g. a missing
+# table or a syntax error, which are OperationalErrors as well.
+OUTAGE_CODES = {5, 6, 10, 14}  # SQLITE_BUSY, SQLITE_LOCKED, SQLITE_IOERR, SQLITE_CANTOPEN
+OUTAGE_MESSAGES = _retry.RETRYABLE_MESSAGES + ("disk I/O error", "unable to open database file")
+
+
+def is_outage(err):
+    """True for errors that mean the database is unavailable (not a bad query)"""
+    if isinstance(err, sqlite3.OperationalError):
+        code = getattr(err, "sqlite_errorcode", None)
+        if code is not None:
+            return code & 0xff in OUTAGE_CODES
+        return any(message in str(err) for message in OUTAGE_MESSAGES)
+    return isinstance(err, (_retry.RetryError, sqlite3.InterfaceError, TimeoutError,
+                            ConnectionError))
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the function while the circuit is open."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"Circuit {name} is open; retry in {retry_after:.1f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast while the database is failing.
+
+    - closed: calls run; their outcomes are counted over the last
+      `window` seconds (in `buckets` slices). Once at least
+      `minimum_calls` were made and `failure_rate` of them failed, the
+      circuit opens.
+    - open: calls raise CircuitOpenError at once, for `open_for` seconds.
+    - half_open: up to `probes` calls at a time are let through as
+      probes; the others are rejected. `probes` successes in a row close
+      the circuit, a failure opens it again.
+
+    Only errors for which `is_failure(err)` is true count as failures;
+    others (e.g. an IntegrityError) count as successes of the database.
+    All state is behind one lock that is never held while the function
+    runs, so one breaker can be shared by threads and by coroutines.
+    """
+
+    def __init__(self, name, failure_rate=0.5, minimum_calls=10, window=30.0, buckets=10,
+                 open_for=15.0, probes=1, is_failure=is_outage):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.minimum_calls = minimum_calls
+        self.window = window
+        self.bucket_width = window / buckets
+        self.open_for = open_for
+        self.probes = probes
+        self.is_failure = is_failure
+        self.state = CLOSED
+        self.calls = self.successes = self.failures = self.rejected = 0
+        self.times_opened = 0
+        self._buckets = deque()  # [start, successes, failures], oldest first
+        self._opened_at = 0.0
+        self._probing = 0  # probes running
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+
+    def _window_counts(self, now):
+        while self._buckets and self._buckets[0][0] <= now - self.window:
+            self._buckets.popleft()
+        successes = sum(bucket[1] for bucket in self._buckets)
+        failures = sum(bucket[2] for bucket in self._buckets)
+        return successes, failures
+
+    def _count(self, now, failed):
+        if not self._buckets or self._buckets[-1][0] <= now - self.bucket_width:
+            self._buckets.append([now, 0, 0])
+        self._buckets[-1][2 if failed else 1] += 1
+
+    def _move(self, state, now):
+        print(f"Circuit {self.name}: {self.state} -> {state}")
+        self.state = state
+        if state == OPEN:
+            self._opened_at = now
+            self.times_opened += 1
+        self._buckets.clear()
+        self._probe_successes = 0
+
+    def before(self):
+        """
+        Asks to make a call. Returns True if it is a half-open probe and
+        raises CircuitOpenError if the call must not be made.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN and now - self._opened_at >= self.open_for:
+                self._move(HALF_OPEN, now)
+            if self.state == CLOSED:
+                self.calls += 1
+                return False
+            if self.state == HALF_OPEN and self._probing < self.probes:
+                self._probing += 1
+                self.calls += 1
+                return True
+            self.rejected += 1
+            retry_after = max(self._opened_at + self.open_for - now, 0.0)
+            raise CircuitOpenError(self.name, retry_after)
+
+    def after(self, probe, err=None):
+        """records the outcome of a call allowed by `before`"""
+        failed = err is not None and self.is_failure(err)
+        with self._lock:
+            now = time.monotonic()
+            if failed:
+                self.failures += 1
+            else:
+                self.successes += 1
+            if probe:
+                self._probing -= 1
+                if self.state != HALF_OPEN:
+                    return
+                if failed:
+                    self._move(OPEN, now)
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.probes:
+                        self._move(CLOSED, now)
+                return
+            if self.state != CLOSED:
+                return
+            self._count(now, failed)
+            successes, failures = self._window_counts(now)
+            total = successes + failures
+            if failed and total >= self.minimum_calls and failures / total >= self.failure_rate:
+                self._move(OPEN, now)
+
+    def cancel(self, probe):
+        """gives back a probe permit for a call that was cancelled"""
+        if probe:
+            with self._lock:
+                self._probing -= 1
+
+    def stats(self):
+        """state and counters, as a dict"""
+        with self._lock:
+            now = time.monotonic()
+            successes, failures = self._window_counts(now)
+            total = successes + failures
+            return {"state": self.state, "calls": self.calls, "successes": self.successes,
+                    "failures": self.failures, "rejected": self.rejected,
+                    "times_opened": self.times_opened, "window_calls": total,
+                    "window_failure_rate": failures / total if total else 0.0}
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(name, **options):
+    """the CircuitBreaker named `name`, created with `options` on first use"""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name, **options)
+        return _breakers[name]
+
+
+def breakers():
+    """every breaker's stats, as `{name: CircuitBreaker.stats()}`"""
+    with _breakers_lock:
+        named = dict(_breakers)
+    return {name: breaker.stats() for name, breaker in named.items()}
+
+
+def circuit_breaker(func=None, *, name=None, breaker=None, **options):
+    """Decorator failing calls fast while the database is failing.
+
+    Calls go through `breaker`, or the breaker registered under `name`
+    (the function's name by default) created with `options` (see
+    CircuitBreaker). Put it outside `with_db_connection` and
+    `retry_on_failure`, so an open circuit neither checks out a
+    connection nor sleeps between retries, and a retried call counts
+    once. Coroutine functions are supported.
+    """
+    if func is None:
+        return functools.partial(circuit_breaker, name=name, breaker=breaker, **options)
+    guard = breaker or breaker_for(name or f"{func.__module__}.{func.__qualname__}", **options)
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            probe = guard.before()
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                guard.after(probe, e)
+                raise
+            except BaseException:  # cancelled: says nothing about the database
+                guard.cancel(probe)
+                raise
+            guard.after(probe)
+            return result
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        probe = guard.before()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            guard.after(probe, e)
+            raise
+        except BaseException:
+            guard.cancel(probe)
+            raise
+        guard.after(probe)
+        return result
+    return wrapper
+
+@circuit_breaker(minimum_calls=5, open_for=10.0)
+@with_db_connection
+@retry_on_failure(retries=3, delay=1)
+def fetch_users_with_breaker(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM users")
+    return cursor.fetchall()
+
+if __name__ == "__main__":
+    try:
+        users = fetch_users_with_breaker()
+        print(users)
+    except (CircuitOpenError, sqlite3.Error, _retry.RetryError) as e:
+        print(f"Failed to fetch users: {e}")
+    print(breakers())
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""Tests for the query cache behind cache_query."""
+import asyncio
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+caching = __import__('4-cache_query')
+
+
+class TestTablesIn(unittest.TestCase):
+    """Tests the tables a statement is tagged with."""
+
+    def test_from_lists_joins_and_subqueries(self) -> None:
+        """Tests that every source of a read is found."""
+        cases = {
+            "SELECT * FROM users": {"users"},
+            "SELECT * FROM users u, orders AS o WHERE u.id = o.user_id": {"users", "orders"},
+            "SELECT * FROM Users u JOIN \"Order Items\" i ON i.uid = u.id, main.payments p":
+                {"users", "order items", "payments"},
+            "SELECT * FROM t1 LEFT JOIN t2 USING (id), t3 ORDER BY 1": {"t1", "t2", "t3"},
+            "SELECT * FROM (SELECT id FROM users) s, orders WHERE id IN (SELECT id FROM bans)":
+                {"users", "orders", "bans"},
+            "SELECT name FROM users WHERE name = 'from, logs'": {"users"},
+            "SELECT 1": set(),
+        }
+        for query, tables in cases.items():
+            self.assertEqual(caching.tables_in(query), tables, query)
+
+    def test_ctes_and_writes(self) -> None:
+        """Tests CTE bodies and the target of write statements."""
+        tables = caching.tables_in(
+            "WITH recent AS (SELECT * FROM orders) SELECT * FROM users, recent")
+        self.assertLessEqual({"orders", "users"}, tables)
+        self.assertEqual(caching.tables_in("UPDATE OR REPLACE users SET name = 'x'"),
+                         {"users"})
+        self.assertEqual(caching.tables_in(
+            "INSERT INTO users (id) SELECT id FROM staging"), {"users", "staging"})
+        self.assertEqual(caching.tables_in("DELETE FROM [users] WHERE id = 1"), {"users"})
+
+    def test_unnamed_sources_match_any_table(self) -> None:
+        """Tests that table-valued functions tag the statement with ANY_TABLE."""
+        self.assertIn(caching.ANY_TABLE,
+                      caching.tables_in("SELECT * FROM json_each(?), users"))
+        self.assertIn(caching.ANY_TABLE,
+                      caching.tables_in("SELECT * FROM pragma_table_info('users')"))
+
+
+class TestQueryCache(unittest.TestCase):
+    """Tests keys, bounds, expiry and invalidation of QueryCache."""
+
+    def test_key_ignores_case_and_whitespace_outside_quotes(self) -> None:
+        """Tests normalize_sql."""
+        self.assertEqual(caching.normalize_sql("  SELECT *\n  FROM users ;"),
+                         "select * from users")
+        self.assertEqual(caching.normalize_sql("SELECT * FROM users WHERE name = 'Ann  B'"),
+                         "select * from users where name = 'Ann  B'")
+        self.assertNotEqual(caching.normalize_sql("SELECT 'A'"),
+                            caching.normalize_sql("SELECT 'a'"))
+
+    def test_least_recently_used_entries_are_evicted(self) -> None:
+        """Tests the entry bound and LRU order."""
+        cache = caching.QueryCache(max_entries=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)
+        self.assertNotIn("b", cache)
+        self.assertEqual((cache.get("a"), cache.get("c")), (1, 3))
+        self.assertEqual(cache.evictions, 1)
+
+    def test_byte_bound(self) -> None:
+        """Tests that the approximate size bound evicts and skips huge results."""
+        row = ("x" * 100,)
+        size = caching.approx_size([row])
+        cache = caching.QueryCache(max_bytes=size * 2)
+        for key in "abc":
+            cache.put(key, [row])
+        self.assertEqual(len(cache), 2)
+        self.assertLessEqual(cache.bytes, size * 2)
+        cache.put("huge", [row] * 10)
+        self.assertNotIn("huge", cache)
+
+    def test_entries_expire(self) -> None:
+        """Tests the ttl."""
+        cache = caching.QueryCache(ttl=0.05)
+        cache.put("a", 1)
+        cache.put("b", 2, ttl=60)
+        time.sleep(0.1)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("b"), 2)
+        self.assertEqual(cache.expirations, 1)
+
+    def test_invalidation_by_table(self) -> None:
+        """Tests that only entries reading an invalidated table are dropped."""
+        cache = caching.QueryCache()
+        cache.put("users", 1, {"users"})
+        cache.put("join", 2, {"users", "orders"})
+        cache.put("orders", 3, {"orders"})
+        self.assertEqual(cache.invalidate({"USERS"}), 2)
+        self.assertEqual([key in cache for key in ("users", "join", "orders")],
+                         [False, False, True])
+        self.assertEqual(cache.invalidate(set()), 0)
+
+    def test_any_table(self) -> None:
+        """Tests entries and invalidations whose tables are unknown."""
+        cache = caching.QueryCache()
+        cache.put("unknown", 1, {caching.ANY_TABLE, "users"})
+        cache.put("orders", 2, {"orders"})
+        self.assertEqual(cache.invalidate({"logs"}), 1)
+        self.assertNotIn("unknown", cache)
+        self.assertEqual(cache.invalidate({caching.ANY_TABLE}), 1)
+        self.assertEqual(len(cache), 0)
+
+    def test_result_read_before_an_invalidation_is_not_stored(self) -> None:
+        """Tests the generation check of put."""
+        cache = caching.QueryCache()
+        generation = cache.generation
+        cache.invalidate({"users"})
+        cache.put("a", 1, {"users"}, generation=generation)
+        self.assertNotIn("a", cache)
+
+
+class TestSingleFlight(unittest.TestCase):
+    """Tests coalescing of concurrent misses."""
+
+    def test_threads_share_one_call_and_its_error(self) -> None:
+        """Tests that waiting threads get the leader's result or exception."""
+        flight = caching.SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def load():
+            calls.append(1)
+            started.set()
+            release.wait()
+            if len(calls) > 1:
+                raise ValueError("second call")
+            return "rows"
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flight.run("k", load)))
+        leader.start()
+        started.wait()
+        waiters = [threading.Thread(target=lambda: results.append(flight.run("k", load)))
+                   for _ in range(4)]
+        for waiter in waiters:
+            waiter.start()
+        while flight.coalesced < 4:
+            time.sleep(0.01)
+        release.set()
+        for thread in [leader] + waiters:
+            thread.join()
+        self.assertEqual((results, len(calls)), (["rows"] * 5, 1))
+
+        release.clear()
+        errors = []
+
+        def failing():
+            try:
+                flight.run("k", load)
+            except ValueError as err:
+                errors.append(err)
+        threads = [threading.Thread(target=failing) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        while flight.coalesced < 6:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(len(calls), 2)
+
+    def test_tasks_share_one_call(self) -> None:
+        """Tests coalescing of coroutines on one event loop."""
+        flight = caching.SingleFlight()
+        calls = []
+
+        async def load():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "rows"
+
+        async def main():
+            return await asyncio.gather(*(flight.run_async("k", load) for _ in range(5)))
+        self.assertEqual(asyncio.run(main()), ["rows"] * 5)
+        self.assertEqual((len(calls), flight.coalesced), (1, 4))
+
+    def test_cancelled_leader_hands_over_to_a_waiter(self) -> None:
+        """Tests that waiters of a cancelled leader are not cancelled."""
+        flight = caching.SingleFlight()
+        calls = []
+
+        async def load():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return len(calls)
+
+        async def main():
+            leader = asyncio.ensure_future(flight.run_async("k", load))
+            await asyncio.sleep(0)
+            waiters = [asyncio.ensure_future(flight.run_async("k", load)) for _ in range(3)]
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await leader
+            return await asyncio.gather(*waiters)
+        self.assertEqual(asyncio.run(main()), [2, 2, 2])
+        self.assertEqual(len(calls), 2)
+
+    def test_cancelled_waiter_does_not_cancel_the_leader(self) -> None:
+        """Tests the shield around a waiter."""
+        flight = caching.SingleFlight()
+
+        async def load():
+            await asyncio.sleep(0.03)
+            return "rows"
+
+        async def main():
+            leader = asyncio.ensure_future(flight.run_async("k", load))
+            await asyncio.sleep(0)
+            waiter = asyncio.ensure_future(flight.run_async("k", load))
+            await asyncio.sleep(0.01)
+            waiter.cancel()
+            return await leader, waiter
+        result, waiter = asyncio.run(main())
+        self.assertEqual(result, "rows")
+        self.assertTrue(waiter.cancelled())
+
+
+class TestCacheQuery(unittest.TestCase):
+    """Tests the decorator against a SQLite database."""
+
+    def setUp(self) -> None:
+        """Creates a users database and a decorated query function."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.conn = sqlite3.connect(os.path.join(self.tmpdir.name, 'users.db'))
+        self.conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT)")
+        self.conn.execute("CREATE TABLE orders (id INTEGER PRIMARY KEY, user_id INTEGER)")
+        self.conn.execute("INSERT INTO users VALUES (1, 'Ann'), (2, 'Bob')")
+        self.conn.commit()
+        self.cache = caching.QueryCache()
+        self.runs = 0
+
+        @caching.cache_query(cache=self.cache)
+        def run(conn, query, params=()):
+            self.runs += 1
+            rows = conn.execute(query, params).fetchall()
+            conn.commit()
+            return rows
+        self.run = run
+
+    def tearDown(self) -> None:
+        """Closes the connection and removes the scratch directory."""
+        self.conn.close()
+        self.tmpdir.cleanup()
+
+    def test_hits_are_keyed_by_normalized_sql_and_params(self) -> None:
+        """Tests that equivalent calls hit and different parameters miss."""
+        self.run(self.conn, "SELECT name FROM users WHERE id = ?", (1,))
+        self.run(self.conn, "select name  FROM users where id = ?;", params=(1,))
+        self.assertEqual(self.runs, 1)
+        self.assertEqual(self.run(self.conn, "SELECT name FROM users WHERE id = ?", (2,)),
+                         [("Bob",)])
+        self.assertEqual(self.runs, 2)
+
+    def test_writes_invalidate_every_table_of_a_from_list(self) -> None:
+        """Tests that a write to the second table of a FROM list invalidates."""
+        query = "SELECT u.name, o.id FROM users u, orders o WHERE o.user_id = u.id"
+        self.assertEqual(self.run(self.conn, query), [])
+        self.run(self.conn, "INSERT INTO orders VALUES (?, ?)", (10, 1))
+        self.assertEqual(self.run(self.conn, query), [("Ann", 10)])
+        self.assertEqual(self.runs, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""Tests for the failure classification and states of the circuit breaker."""
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+breaking = __import__('5-circuit_breaker')
+
+
+def sqlite_error(message: str, code=None) -> sqlite3.OperationalError:
+    """Returns an OperationalError as sqlite3 raises it, with `code` if given."""
+    err = sqlite3.OperationalError(message)
+    if code is not None:
+        err.sqlite_errorcode = code
+    return err
+
+
+class TestIsOutage(unittest.TestCase):
+    """Tests which errors count against the database."""
+
+    def test_unavailable_database_is_an_outage(self) -> None:
+        """Tests busy, locked, I/O and open errors, by code and by message."""
+        for code in (5, 6, 10, 14, 10 | 3 << 8):
+            self.assertTrue(breaking.is_outage(sqlite_error("failed", code)), code)
+        self.assertTrue(breaking.is_outage(sqlite_error("database is locked")))
+        self.assertTrue(breaking.is_outage(sqlite_error("disk I/O error")))
+        self.assertTrue(breaking.is_outage(TimeoutError()))
+        self.assertTrue(breaking.is_outage(breaking._retry.RetryError("gave up")))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with self.assertRaises(sqlite3.OperationalError) as caught:
+                sqlite3.connect(os.path.join(tmpdir, "missing", "users.db"))
+        self.assertTrue(breaking.is_outage(caught.exception))
+
+    def test_bad_queries_are_not(self) -> None:
+        """Tests real 'no such table' and syntax errors."""
+        conn = sqlite3.connect(":memory:")
+        self.addCleanup(conn.close)
+        for query in ("SELECT * FROM users", "SELECT nope FROM sqlite_master", "SELEC 1"):
+            with self.assertRaises(sqlite3.OperationalError) as caught:
+                conn.execute(query)
+            self.assertFalse(breaking.is_outage(caught.exception), query)
+        self.assertFalse(breaking.is_outage(sqlite_error("no such column: x")))
+        self.assertFalse(breaking.is_outage(sqlite3.IntegrityError("UNIQUE")))
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    """Tests the closed, open and half-open states."""
+
+    def breaker(self, **options) -> breaking.CircuitBreaker:
+        """Returns a breaker that opens after 4 calls at 50% failures."""
+        settings = dict(minimum_calls=4, failure_rate=0.5, open_for=0.05, window=10.0)
+        settings.update(options)
+        return breaking.CircuitBreaker("test", **settings)
+
+    def record(self, breaker, *outcomes) -> None:
+        """Makes one call per outcome: None for a success, else the error."""
+        for err in outcomes:
+            breaker.after(breaker.before(), err)
+
+    def test_opens_at_the_failure_rate_after_minimum_calls(self) -> None:
+        """Tests the minimum call count and the failure rate."""
+        breaker = self.breaker()
+        busy = sqlite_error("busy", 5)
+        self.record(breaker, busy, busy, busy)
+        self.assertEqual(breaker.state, breaking.CLOSED)
+        self.record(breaker, None)
+        self.assertEqual(breaker.state, breaking.CLOSED)  # last call succeeded
+        self.record(breaker, busy)
+        self.assertEqual(breaker.state, breaking.OPEN)
+        with self.assertRaises(breaking.CircuitOpenError) as caught:
+            breaker.before()
+        self.assertLessEqual(caught.exception.retry_after, 0.05)
+        stats = breaker.stats()
+        self.assertEqual((stats["times_opened"], stats["rejected"]), (1, 1))
+
+    def test_bad_queries_keep_the_circuit_closed(self) -> None:
+        """Tests that non-outage errors count as successes."""
+        breaker = self.breaker()
+        self.record(breaker, *[sqlite_error("no such table: users", 1)] * 10)
+        self.assertEqual(breaker.state, breaking.CLOSED)
+        self.assertEqual(breaker.stats()["failures"], 0)
+
+    def test_old_outcomes_leave_the_window(self) -> None:
+        """Tests the rolling window."""
+        breaker = self.breaker(window=0.05, buckets=1)
+        self.record(breaker, *[TimeoutError()] * 3)
+        time.sleep(0.1)
+        self.record(breaker, None, TimeoutError())
+        self.assertEqual(breaker.state, breaking.CLOSED)
+        self.assertEqual(breaker.stats()["window_calls"], 2)
+
+    def test_half_open_limits_probes_and_closes_on_success(self) -> None:
+        """Tests the probe limit, a failing probe and closing again."""
+        breaker = self.breaker(probes=2)
+        self.record(breaker, *[TimeoutError()] * 4)
+        self.assertEqual(breaker.state, breaking.OPEN)
+        time.sleep(0.06)
+        first, second = breaker.before(), breaker.before()
+        self.assertEqual((breaker.state, first, second), (breaking.HALF_OPEN, True, True))
+        with self.assertRaises(breaking.CircuitOpenError):
+            breaker.before()
+        breaker.cancel(second)
+        third = breaker.before()  # the cancelled probe's permit is free again
+        breaker.after(first, TimeoutError())
+        self.assertEqual(breaker.state, breaking.OPEN)
+        breaker.after(third)  # a late probe of the old half-open period
+        self.assertEqual(breaker.state, breaking.OPEN)
+
+        time.sleep(0.06)
+        self.record(breaker, None)
+        self.assertEqual(breaker.state, breaking.HALF_OPEN)
+        self.record(breaker, None)
+        self.assertEqual(breaker.state, breaking.CLOSED)
+        self.assertEqual(breaker.stats()["times_opened"], 2)
+
+
+class TestCircuitBreakerDecorator(unittest.TestCase):
+    """Tests the decorator on functions and coroutines."""
+
+    def test_open_circuit_skips_the_call(self) -> None:
+        """Tests that calls stop reaching the function once it opens."""
+        breaker = breaking.CircuitBreaker("test.sync", minimum_calls=2, open_for=60)
+        calls = []
+
+        @breaking.circuit_breaker(breaker=breaker)
+        def fetch():
+            calls.append(1)
+            raise sqlite_error("database is locked", 5)
+        for _ in range(2):
+            with self.assertRaises(sqlite3.OperationalError):
+                fetch()
+        with self.assertRaises(breaking.CircuitOpenError):
+            fetch()
+        self.assertEqual(len(calls), 2)
+
+    def test_coroutines_and_cancellation(self) -> None:
+        """Tests the async wrapper and that a cancelled probe frees its permit."""
+        breaker = breaking.CircuitBreaker("test.async", minimum_calls=1, open_for=0.01)
+
+        @breaking.circuit_breaker(breaker=breaker)
+        async def fetch(fail, pause=0.0):
+            await asyncio.sleep(pause)
+            if fail:
+                raise TimeoutError()
+            return "rows"
+
+        async def main():
+            with self.assertRaises(TimeoutError):
+                await fetch(True)
+            await asyncio.sleep(0.02)
+            probe = asyncio.ensure_future(fetch(False, pause=1))
+            await asyncio.sleep(0)
+            probe.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await probe
+            return await fetch(False)
+        self.assertEqual(asyncio.run(main()), "rows")
+        self.assertEqual(breaker.state, breaking.CLOSED)
+
+    def test_breakers_are_shared_by_name(self) -> None:
+        """Tests the registry."""
+        self.assertIs(breaking.breaker_for("test.shared"),
+                      breaking.breaker_for("test.shared", minimum_calls=1))
+        self.assertIn("test.shared", breaking.breakers())
+
+
+if __name__ == "__main__":
+    unittest.main()
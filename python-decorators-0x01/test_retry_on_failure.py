@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""Tests for error classification, backoff and budgets of retry_on_failure."""
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+import unittest
+
+retrying = __import__('3-retry_on_failure')
+
+
+def sqlite_error(message: str, code=None) -> sqlite3.OperationalError:
+    """Returns an OperationalError as sqlite3 raises it, with `code` if given."""
+    err = sqlite3.OperationalError(message)
+    if code is not None:
+        err.sqlite_errorcode = code
+    return err
+
+
+class TestIsRetryable(unittest.TestCase):
+    """Tests which errors are transient."""
+
+    def test_locked_database_is_retryable(self) -> None:
+        """Tests a real SQLITE_BUSY from a second connection."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            database = os.path.join(tmpdir, 'users.db')
+            holder = sqlite3.connect(database)
+            other = sqlite3.connect(database, timeout=0)
+            try:
+                holder.execute("BEGIN EXCLUSIVE")
+                with self.assertRaises(sqlite3.OperationalError) as caught:
+                    other.execute("SELECT * FROM sqlite_master")
+                self.assertTrue(retrying.is_retryable(caught.exception))
+                holder.rollback()
+                with self.assertRaises(sqlite3.OperationalError) as caught:
+                    other.execute("SELECT * FROM users")
+                self.assertFalse(retrying.is_retryable(caught.exception))
+            finally:
+                holder.close()
+                other.close()
+
+    def test_codes_messages_and_other_errors(self) -> None:
+        """Tests extended codes, the message fallback and non-sqlite errors."""
+        self.assertTrue(retrying.is_retryable(sqlite_error("busy", 5 | 2 << 8)))
+        self.assertTrue(retrying.is_retryable(sqlite_error("locked", 6)))
+        self.assertFalse(retrying.is_retryable(sqlite_error("database is locked", 1)))
+        self.assertTrue(retrying.is_retryable(sqlite_error("database table is locked")))
+        self.assertFalse(retrying.is_retryable(sqlite_error("no such column: x")))
+        self.assertTrue(retrying.is_retryable(TimeoutError()))
+        self.assertTrue(retrying.is_retryable(ConnectionResetError()))
+        self.assertFalse(retrying.is_retryable(sqlite3.IntegrityError("UNIQUE")))
+        self.assertFalse(retrying.is_retryable(ValueError()))
+
+
+class TestRetryOnFailure(unittest.TestCase):
+    """Tests attempts, give-ups, budgets and counters."""
+
+    def flaky(self, target: str, failures: list, **options):
+        """Returns a decorated function raising each of `failures` in turn."""
+        self.calls = 0
+
+        @retrying.retry_on_failure(delay=0, max_delay=0, target=target, **options)
+        def call():
+            self.calls += 1
+            if failures:
+                raise failures.pop(0)
+            return "rows"
+        return call
+
+    def test_transient_errors_are_retried(self) -> None:
+        """Tests that busy errors are retried until the call succeeds."""
+        call = self.flaky("test.transient", [sqlite_error("busy", 5), TimeoutError()])
+        self.assertEqual(call(), "rows")
+        self.assertEqual(self.calls, 3)
+        counts = retrying.metrics()["test.transient"]
+        self.assertEqual((counts["attempts"], counts["retries"], counts["successes"]),
+                         (3, 2, 1))
+
+    def test_other_errors_are_raised_at_once(self) -> None:
+        """Tests that a bad query is not retried."""
+        call = self.flaky("test.permanent", [sqlite_error("no such table: users", 1)])
+        with self.assertRaises(sqlite3.OperationalError):
+            call()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(retrying.metrics()["test.permanent"]["non_retryable"], 1)
+
+    def test_last_attempt_gives_up_with_the_cause(self) -> None:
+        """Tests RetryError after `retries` attempts."""
+        last = TimeoutError("third")
+        call = self.flaky("test.exhausted", [TimeoutError(), TimeoutError(), last],
+                          retries=3)
+        with self.assertRaises(retrying.RetryError) as caught:
+            call()
+        self.assertIs(caught.exception.__cause__, last)
+        self.assertEqual(self.calls, 3)
+        self.assertEqual(retrying.metrics()["test.exhausted"]["give_ups"], 1)
+
+    def test_empty_budget_stops_retries(self) -> None:
+        """Tests that a shared budget caps the retries of all callers."""
+        budget = retrying.RetryBudget(rate=0, burst=2)
+        call = self.flaky("test.budget", [TimeoutError()] * 5, retries=10, budget=budget)
+        with self.assertRaisesRegex(retrying.RetryError, "budget"):
+            call()
+        self.assertEqual(self.calls, 3)
+        self.assertEqual(retrying.metrics()["test.budget"]["budget_exhausted"], 1)
+        self.assertFalse(budget.try_acquire())
+
+    def test_budget_refills_up_to_burst(self) -> None:
+        """Tests the token bucket refill."""
+        budget = retrying.RetryBudget(rate=1000, burst=3)
+        budget.tokens = 0
+        budget._updated -= 1
+        self.assertTrue(all(budget.try_acquire() for _ in range(3)))
+        self.assertLess(budget.tokens, 1)
+
+    def test_coroutines_are_retried(self) -> None:
+        """Tests the async wrapper."""
+        failures = [sqlite_error("locked", 6)]
+
+        @retrying.retry_on_failure(delay=0, max_delay=0, target="test.async")
+        async def call():
+            if failures:
+                raise failures.pop()
+            return "rows"
+        self.assertEqual(asyncio.run(call()), "rows")
+        self.assertEqual(retrying.metrics()["test.async"]["retries"], 1)
+
+
+class TestBackoff(unittest.TestCase):
+    """Tests the jittered pauses."""
+
+    def test_pauses_stay_between_delay_and_the_cap(self) -> None:
+        """Tests decorrelated jitter bounds."""
+        rng = random.Random(7)
+        previous = None
+        pauses = []
+        for _ in range(50):
+            pause = retrying.backoff(0.1, 2.0, previous, rng)
+            upper = 0.3 if previous is None else min(2.0, previous * 3)
+            self.assertTrue(0.1 <= pause <= upper)
+            pauses.append(pause)
+            previous = pause
+        self.assertIn(2.0, pauses)  # growth reaches the cap
+        self.assertGreater(len(set(pauses)), 10)  # and is jittered on the way
+
+
+if __name__ == "__main__":
+    unittest.main()
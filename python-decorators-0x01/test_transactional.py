@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""Tests for the transactional decorator and its group commit mode."""
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+transactions = __import__('2-transactional')
+
+
+def rename(conn, user_id, name):
+    """Renames one user; a module-level function so calls can be grouped."""
+    conn.execute("UPDATE users SET name = ? WHERE id = ?", (name, user_id))
+    return user_id
+
+
+def fail_in_sql(conn, user_id):
+    """Writes, then raises a sqlite3.Error."""
+    rename(conn, user_id, "lost")
+    conn.execute("INSERT INTO missing_table VALUES (1)")
+
+
+def fail_in_python(conn, user_id):
+    """Writes, then raises a non-database error."""
+    rename(conn, user_id, "lost")
+    raise ValueError("bad input")
+
+
+class TransactionTestCase(unittest.TestCase):
+    """Creates a users database and records commit notifications."""
+
+    def setUp(self) -> None:
+        """Creates the database and a recording commit listener."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.database = os.path.join(self.tmpdir.name, 'users.db')
+        conn = sqlite3.connect(self.database)
+        conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT)")
+        conn.execute("CREATE TABLE logs (message TEXT)")
+        conn.executemany("INSERT INTO users VALUES (?, ?)", ((i, f"User {i}") for i in range(10)))
+        conn.commit()
+        conn.close()
+        self.notified = []
+        self.listeners = list(transactions.commit_listeners)
+        transactions.on_commit(self.notified.append)
+
+    def tearDown(self) -> None:
+        """Restores the listeners and removes the scratch directory."""
+        transactions.commit_listeners[:] = self.listeners
+        self.tmpdir.cleanup()
+
+    def names(self) -> dict:
+        """Returns `{id: name}` as committed."""
+        conn = sqlite3.connect(self.database)
+        try:
+            return dict(conn.execute("SELECT id, name FROM users"))
+        finally:
+            conn.close()
+
+    def fail_listener(self, tables) -> None:
+        """A commit listener that always raises."""
+        raise RuntimeError("listener broke")
+
+
+class TestTransactional(TransactionTestCase):
+    """Tests commits, rollbacks and notifications of per-call transactions."""
+
+    def test_commit_rollback_and_notification(self) -> None:
+        """Tests both outcomes of a call and the tables passed to listeners."""
+        conn = sqlite3.connect(self.database)
+        self.addCleanup(conn.close)
+        self.assertEqual(transactions.transactional(rename)(conn, 1, "Ann"), 1)
+        self.assertIsNone(transactions.transactional(fail_in_sql)(conn, 2))
+        with self.assertRaises(ValueError):
+            transactions.transactional(fail_in_python)(conn, 3)
+        conn.rollback()
+        names = self.names()
+        self.assertEqual((names[1], names[2], names[3]), ("Ann", "User 2", "User 3"))
+        self.assertEqual(self.notified, [{"users"}])
+
+    def test_failing_listener_does_not_fail_a_committed_write(self) -> None:
+        """Tests that listener errors are logged, not raised to the caller."""
+        transactions.commit_listeners.insert(0, self.fail_listener)
+        conn = sqlite3.connect(self.database)
+        self.addCleanup(conn.close)
+        self.assertEqual(transactions.transactional(rename)(conn, 1, "Ann"), 1)
+        self.assertEqual(self.names()[1], "Ann")
+        self.assertEqual(self.notified, [{"users"}])
+
+
+class TestGroupCommit(TransactionTestCase):
+    """Tests savepoint isolation and the failure paths of GroupCommitter."""
+
+    def committer(self, **options) -> transactions.GroupCommitter:
+        """Returns a committer of the scratch database, closed after the test."""
+        group = transactions.GroupCommitter(self.database, **options)
+        self.addCleanup(group.close)
+        return group
+
+    def call_all(self, calls: list) -> list:
+        """Runs every `(func, args)` on its own thread; returns results or errors."""
+        outcomes = [None] * len(calls)
+
+        def run(index, func, args):
+            try:
+                outcomes[index] = func(*args)
+            except Exception as err:
+                outcomes[index] = err
+        threads = [threading.Thread(target=run, args=(i, func, args))
+                   for i, (func, args) in enumerate(calls)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=10)
+            self.assertFalse(thread.is_alive(), "a grouped call never returned")
+        return outcomes
+
+    def test_each_call_keeps_its_own_outcome(self) -> None:
+        """Tests that one batch commits the good calls and rolls back the bad ones."""
+        group = self.committer(window=0.2)
+        grouped = transactions.transactional(group=group)
+        outcomes = self.call_all([
+            (grouped(rename), (1, "Ann")),
+            (grouped(fail_in_sql), (2,)),
+            (grouped(fail_in_python), (3,)),
+            (grouped(rename), (4, "Dee")),
+        ])
+        self.assertEqual(group.batches, 1)
+        self.assertEqual(outcomes[0], 1)
+        self.assertIsNone(outcomes[1])
+        self.assertIsInstance(outcomes[2], ValueError)
+        self.assertEqual(outcomes[3], 4)
+        names = self.names()
+        self.assertEqual([names[i] for i in range(1, 5)], ["Ann", "User 2", "User 3", "Dee"])
+        self.assertEqual(self.notified, [{"users"}])
+
+    def test_nested_call_joins_the_transaction(self) -> None:
+        """Tests a grouped call made from inside another one."""
+        group = self.committer()
+
+        @transactions.transactional(group=group)
+        def log(conn, message):
+            conn.execute("INSERT INTO logs VALUES (?)", (message,))
+
+        @transactions.transactional(group=group)
+        def rename_and_log(conn, user_id, name):
+            rename(conn, user_id, name)
+            log(f"renamed {user_id}")
+            return name
+        self.assertEqual(rename_and_log(5, "Eve"), "Eve")
+        self.assertEqual(self.names()[5], "Eve")
+        self.assertEqual(self.notified, [{"users", "logs"}])
+
+    def test_failing_listener_does_not_fail_the_batch(self) -> None:
+        """Tests that listener errors neither fail the calls nor stop the writer."""
+        transactions.commit_listeners.insert(0, self.fail_listener)
+        grouped = transactions.transactional(rename, group=self.committer())
+        self.assertEqual(grouped(1, "Ann"), 1)
+        self.assertEqual(grouped(2, "Bob"), 2)
+        self.assertEqual(len(self.notified), 2)
+
+    def test_writer_that_cannot_connect_fails_its_calls(self) -> None:
+        """Tests that a connect error is raised instead of blocking forever."""
+        group = transactions.GroupCommitter(
+            os.path.join(self.tmpdir.name, "missing", "users.db"))
+        self.addCleanup(group.close)
+        grouped = transactions.transactional(rename, group=group)
+        outcomes = self.call_all([(grouped, (1, "Ann"))] * 3)
+        for outcome in outcomes:
+            self.assertIsInstance(outcome, sqlite3.OperationalError)
+        self.assertIsNone(group._thread)
+        # Later calls start a new writer.
+        group.database = self.database
+        self.assertEqual(grouped(1, "Ann"), 1)
+        self.assertEqual(self.names()[1], "Ann")
+
+    def test_writer_crash_fails_the_pending_calls(self) -> None:
+        """Tests an error escaping the commit of a batch."""
+        group = self.committer()
+
+        def crash(conn, batch):
+            raise RuntimeError("writer crashed")
+        group._commit = crash
+        grouped = transactions.transactional(rename, group=group)
+        outcomes = self.call_all([(grouped, (1, "Ann"))] * 3)
+        for outcome in outcomes:
+            self.assertIsInstance(outcome, RuntimeError)
+        del group._commit
+        self.assertEqual(grouped(2, "Bob"), 2)
+
+    def test_close_racing_submits_never_hangs(self) -> None:
+        """Tests close() while other threads keep submitting, and per-writer connections."""
+        group = self.committer()
+        used = []  # (writer thread, connection) of every call
+
+        @transactions.transactional(group=group)
+        def record(conn, user_id):
+            used.append((threading.current_thread(), conn))
+            return rename(conn, user_id, f"Writer {user_id}")
+        stop = threading.Event()
+        errors = []
+
+        def submit(user_id):
+            while not stop.is_set():
+                try:
+                    record(user_id)
+                except Exception as err:
+                    errors.append(err)
+        submitters = [threading.Thread(target=submit, args=(i,)) for i in range(4)]
+        for submitter in submitters:
+            submitter.start()
+        try:
+            for _ in range(50):
+                closer = threading.Thread(target=group.close)
+                closer.start()
+                closer.join(timeout=10)
+                self.assertFalse(closer.is_alive(), "close() never returned")
+        finally:
+            stop.set()
+            for submitter in submitters:
+                submitter.join(timeout=10)
+        self.assertEqual(errors, [])
+        connections = {}
+        for thread, conn in used:
+            self.assertIs(connections.setdefault(thread, conn), conn)
+        self.assertGreater(len(connections), 1)
+
+    def test_close_commits_submitted_calls(self) -> None:
+        """Tests close() and the pragmas of the writer's connection."""
+        group = self.committer()
+        grouped = transactions.transactional(rename, group=group)
+        self.assertEqual(grouped(1, "Ann"), 1)
+        group.close()
+        self.assertIsNone(group._thread)
+        self.assertEqual(self.names()[1], "Ann")
+        conn = sqlite3.connect(self.database)
+        self.addCleanup(conn.close)
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone(), ("wal",))
+
+
+if __name__ == "__main__":
+    unittest.main()
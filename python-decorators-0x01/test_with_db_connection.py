@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""Tests for the connection pool behind with_db_connection."""
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+pooling = __import__('1-with_db_connection')
+
+
+class TestConnectionPool(unittest.TestCase):
+    """Tests bounds, timeouts, nested checkouts, recycling and cleanup."""
+
+    def setUp(self) -> None:
+        """Creates a users database in a scratch directory."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.database = os.path.join(self.tmpdir.name, 'users.db')
+        conn = sqlite3.connect(self.database)
+        conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT)")
+        conn.executemany("INSERT INTO users VALUES (?, ?)", ((i, f"User {i}") for i in range(10)))
+        conn.commit()
+        conn.close()
+        self.pools = []
+
+    def tearDown(self) -> None:
+        """Closes the pools and removes the scratch directory."""
+        for pool in self.pools:
+            pool.close()
+        self.tmpdir.cleanup()
+
+    def pool(self, **options) -> pooling.ConnectionPool:
+        """Returns a pool of the scratch database, closed after the test."""
+        pool = pooling.ConnectionPool(self.database, **options)
+        self.pools.append(pool)
+        return pool
+
+    def test_size_bounds_open_connections_and_checkout_times_out(self) -> None:
+        """Tests that a full pool makes a checkout wait, then time out."""
+        pool = self.pool(size=2, timeout=0.2)
+        held = threading.Barrier(3)
+        release = threading.Event()
+
+        def hold() -> None:
+            with pool.connection():
+                held.wait()
+                release.wait()
+        holders = [threading.Thread(target=hold) for _ in range(2)]
+        for holder in holders:
+            holder.start()
+        held.wait()
+        started = time.monotonic()
+        with self.assertRaisesRegex(sqlite3.OperationalError, "no connection available"):
+            with pool.connection():
+                pass
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+        release.set()
+        for holder in holders:
+            holder.join()
+        self.assertEqual(pool.opened, 2)
+        with pool.connection() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM users").fetchone(), (10,))
+        self.assertEqual(pool.opened, 2)
+
+    def test_waiting_checkout_gets_the_returned_connection(self) -> None:
+        """Tests that a waiter is woken when a connection comes back."""
+        pool = self.pool(size=1, timeout=5)
+        got = []
+        with pool.connection() as conn:
+            waiter = threading.Thread(target=lambda: got.append(
+                pooling.with_db_connection(lambda c: c, pool=pool)()))
+            waiter.start()
+            time.sleep(0.05)
+            self.assertEqual(got, [])
+        waiter.join()
+        self.assertIs(got[0], conn)
+
+    def test_nested_checkouts_share_one_connection(self) -> None:
+        """Tests that a decorated call made by another one reuses its connection."""
+        pool = self.pool(size=1, timeout=0.1)
+
+        @pooling.with_db_connection(pool=pool)
+        def inner(conn):
+            return conn
+
+        @pooling.with_db_connection(pool=pool)
+        def outer(conn):
+            return conn, inner()
+        first, second = outer()
+        self.assertIs(first, second)
+        self.assertEqual(pool.opened, 1)
+
+    def test_old_and_broken_connections_are_replaced(self) -> None:
+        """Tests max_lifetime recycling and the health check on checkout."""
+        pool = self.pool(size=1, max_lifetime=0.05)
+        with pool.connection() as first:
+            pass
+        with pool.connection() as again:
+            self.assertIs(again, first)
+        time.sleep(0.1)
+        with pool.connection() as recycled:
+            self.assertIsNot(recycled, first)
+        self.assertEqual(pool.opened, 2)
+
+        pool = self.pool(size=1, max_lifetime=None)
+        with pool.connection() as conn:
+            pass
+        conn.close()
+        with pool.connection() as replaced:
+            self.assertIsNot(replaced, conn)
+            self.assertEqual(replaced.execute("SELECT 1").fetchone(), (1,))
+
+    def test_open_transaction_is_rolled_back_on_return(self) -> None:
+        """Tests that uncommitted writes do not leak into the next checkout."""
+        pool = self.pool(size=1)
+        with pool.connection() as conn:
+            conn.execute("DELETE FROM users")
+            self.assertTrue(conn.in_transaction)
+        with pool.connection() as conn:
+            self.assertFalse(conn.in_transaction)
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM users").fetchone(), (10,))
+
+    def test_pragmas_are_applied_once_per_connection(self) -> None:
+        """Tests the default pragmas and the journal mode shared by both pools."""
+        pool = self.pool(size=1)
+        with pool.connection() as conn:
+            self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone(), ("wal",))
+            self.assertEqual(conn.execute("PRAGMA cache_size").fetchone(), (-8000,))
+        # A second pool finds the database in WAL mode already.
+        with self.pool(size=1).connection() as conn:
+            self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone(), ("wal",))
+
+    def test_closed_pool_refuses_checkouts(self) -> None:
+        """Tests close() with an idle connection and a later checkout."""
+        pool = self.pool(size=1)
+        with pool.connection():
+            pass
+        pool.close()
+        with self.assertRaisesRegex(sqlite3.OperationalError, "closed"):
+            with pool.connection():
+                pass
+
+    def test_size_must_be_positive(self) -> None:
+        """Tests the size check."""
+        with self.assertRaises(ValueError):
+            pooling.ConnectionPool(self.database, size=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,15 +7,26 @@ rows from the 'user_data' table in the 'ALX_prodev' MySQL database
 one by one. It yields each row as a dictionary, making it memory-efficient
 for large datasets.
 
+With `fetch_size`, rows are read through an unbuffered (server-side)
+cursor in `fetchmany(fetch_size)` chunks, so client memory stays flat no
+matter how big 'user_data' is.
+
+With `row_format`, rows can be yielded as tuples, slotted records or
+columnar batches instead of dictionaries (see row_formats.py).
+
 It reuses the database connection functionality from the `seed` module.
 """
 
+import itertools
+
 # Import the seed module to utilize its database connection functions.
 # Ensure seed.py is in the same directory or accessible via PYTHONPATH.
 import seed
+import row_formats
+import instrumentation
 import mysql.connector
 
-def stream_users():
+def stream_users(fetch_size=None, connection=None, row_format=row_formats.DICT):
     """
     A generator function that streams rows from the 'user_data' table
     in the 'ALX_prodev' database. Each row is yielded as a dictionary.
@@ -24,43 +35,84 @@ def stream_users():
     one row at a time, making it suitable for large datasets.
     It adheres to the constraint of having no more than one loop.
 
+    By default the connection's default cursor is iterated. When
+    `fetch_size` is given, an explicitly unbuffered cursor is used instead:
+    the result set stays on the server and is pulled `fetch_size` rows at a
+    time with `fetchmany()`, so at most one chunk is held in client memory.
+    The rows are still yielded one at a time.
+
+    Args:
+        fetch_size (int | None): Rows per `fetchmany()` round trip in
+                                 streaming mode. None keeps the default cursor.
+        connection: An optional open connection to use (for example a sqlite3
+                    stand-in). When omitted a connection is opened with
+                    `seed.connect_to_prodev()` and closed at the end.
+        row_format (str): "dict" (default), "tuple", "record" or "columnar".
+                          With "columnar" one `ColumnarBatch` is yielded per
+                          `fetchmany()` chunk (of `fetch_size` rows, 1000 if
+                          not given) instead of one item per row.
+
     Yields:
         dict: A dictionary representing a single user row, with keys
-              corresponding to column names (user_id, name, email, age).
+              corresponding to column names (user_id, name, email, age),
+              or the row/batch in the requested `row_format`.
     """
-    connection = None
+    row_formats.check_format(row_format)
+    if row_format == row_formats.COLUMNAR and not fetch_size:
+        fetch_size = 1000
+    owns_connection = connection is None
     cursor = None
+    call = instrumentation.call("stream_users")
     try:
         # Establish a connection to the 'ALX_prodev' database.
         # This function is defined in seed.py.
-        connection = seed.connect_to_prodev()
+        if owns_connection:
+            connection = call.connect(seed.connect_to_prodev)
         if not connection:
             print("Failed to connect to the database. Cannot stream users.")
             return # Exit the generator if connection fails
 
-        # Create a cursor object to execute SQL queries.
-        cursor = connection.cursor(dictionary=True) # dictionary=True makes rows return as dicts
+        # Create a cursor object to execute SQL queries. Rows come back as dicts
+        # or tuples depending on the row format; in streaming mode the cursor is
+        # unbuffered so results stay server-side.
+        cursor = call.cursor(row_formats.make_cursor(connection, row_format,
+                                                     buffered=False if fetch_size else None))
 
         # Execute the query to select all data from the user_data table.
         # The cursor will fetch results lazily when iterated over.
         query = "SELECT user_id, name, email, age FROM user_data"
         cursor.execute(query)
 
-        # Iterate directly over the cursor, which acts as an iterator.
-        # This is the single loop allowed. Each iteration fetches one row.
-        for row in cursor:
-            yield row # Yield the row (which is already a dictionary)
+        # The single loop allowed. Either the cursor itself is the iterator,
+        # or `fetchmany` is called until it returns an empty chunk.
+        rows = cursor
+        if row_format == row_formats.COLUMNAR:
+            rows = map(row_formats.ColumnarBatch.from_rows,
+                       iter(lambda: cursor.fetchmany(fetch_size), []))
+        elif fetch_size:
+            rows = itertools.chain.from_iterable(
+                iter(lambda: cursor.fetchmany(fetch_size), []))
+        convert = row_formats.converter(row_format)
+        if convert:
+            rows = map(convert, rows)
+        for row in call.items(rows):
+            yield row # Yield the row, already in the requested format
 
     except mysql.connector.Error as err:
+        call.error(err)
         print(f"Database error during streaming: {err}")
     except Exception as e:
+        call.error(e)
         print(f"An unexpected error occurred: {e}")
     finally:
         # Ensure the cursor and connection are closed, regardless of success or failure.
         if cursor:
-            cursor.close()
-            # print("Cursor closed.") # For debugging
-        if connection:
+            try:
+                cursor.close()
+            except mysql.connector.Error:
+                # An unbuffered cursor abandoned mid-stream still has unread
+                # rows; closing the connection below discards them.
+                pass
+        if owns_connection and connection:
             connection.close()
-            # print("Connection closed.") # For debugging
-
+        call.finish()
@@ -8,80 +8,85 @@ to ensure memory efficiency, especially when dealing with large datasets.
 
 Functions:
 - stream_users_in_batches(batch_size): A generator that fetches rows
-  from the database in specified batch sizes using LIMIT and OFFSET.
+  from the database in specified batch sizes, using keyset pagination on
+  `user_id` (or LIMIT and OFFSET with mode="offset").
 - batch_processing(batch_size): A generator that utilizes
-  stream_users_in_batches to process each batch, filtering users
-  who are over the age of 25.
+  stream_users_in_batches to process each batch, yielding users
+  who are over the age of 25 (filtered in SQL).
+- parallel_batch_processing(process, batch_size): Runs a processing
+  function over the batches on parallel workers, with bounded queues
+  between fetching, processing and the sink (see batch_pipeline.py).
 
 The script adheres to the constraint of using no more than 3 loops in total.
 """
 
 import seed
+import pagination
+import batch_pipeline
+import row_formats
+import pipeline
+import instrumentation
 import mysql.connector
 
-def stream_users_in_batches(batch_size):
+def stream_users_in_batches(batch_size, mode=pagination.KEYSET, cursor_token=None,
+                            connection=None, row_format=row_formats.DICT, where=()):
     """
     A generator function that fetches rows from the 'user_data' table
     in the 'ALX_prodev' database in specified batch sizes.
 
-    This function connects to the database and uses SQL's LIMIT and OFFSET
-    clauses to retrieve data in chunks. This approach is highly memory-efficient
-    as it avoids loading the entire dataset into memory at once.
+    By default batches are fetched with keyset pagination, seeking on the
+    `user_id` primary key (`WHERE user_id > last_seen ORDER BY user_id`),
+    so every batch costs the same no matter how deep into the table it is.
+    The original `LIMIT ... OFFSET ...` behaviour is still available with
+    `mode="offset"`, but its cost grows with the offset. Either way only
+    one batch is held in memory at a time.
 
     Args:
         batch_size (int): The maximum number of rows to fetch in each batch.
+        mode (str): "keyset" (default) or "offset". See pagination.py.
+        cursor_token (str | None): A token from `pagination.cursor_for(batch)`
+                                   to resume a keyset scan after that batch.
+        connection: An optional open connection to use. When omitted a new
+                    connection is opened with `seed.connect_to_prodev()` and
+                    closed when the generator finishes.
+        row_format (str): "dict" (default), "tuple", "record" or "columnar".
+                          See row_formats.py.
+        where (iterable): Predicates such as `pipeline.where("age", ">", 25)`
+                          to evaluate in the SQL WHERE clause.
 
     Yields:
         list[dict]: A list of dictionaries, where each dictionary represents
                     a single user row. The list contains up to `batch_size` rows.
-                    An empty list is yielded if no more rows are found.
+                    Other row formats yield a list of tuples/records or a
+                    `ColumnarBatch`.
     """
-    connection = None
-    cursor = None
-    offset = 0 # Initialize offset for fetching data
+    owns_connection = connection is None
+    call = instrumentation.call("stream_users_in_batches")
     try:
         # Establish a connection to the 'ALX_prodev' database using the seed module.
-        connection = seed.connect_to_prodev()
+        if owns_connection:
+            connection = call.connect(seed.connect_to_prodev)
         if not connection:
             print("Failed to connect to the database. Cannot stream users in batches.")
             return # Exit the generator if connection fails
 
-        # Create a cursor object. `dictionary=True` ensures rows are returned as dictionaries.
-        cursor = connection.cursor(dictionary=True)
-
-        # Loop 1 (Primary loop for fetching batches):
-        # This loop continues to execute queries and fetch batches until no more
-        # rows are returned from the database.
-        while True:
-            # SQL query to select user data with LIMIT and OFFSET for batching.
-            # %s placeholders are used for safe parameter substitution.
-            query = "SELECT user_id, name, email, age FROM user_data LIMIT %s OFFSET %s"
-            cursor.execute(query, (batch_size, offset))
-
-            # Fetch all rows for the current batch. `fetchall()` here is fine
-            # as it only fetches `batch_size` rows, not the entire table.
-            batch = cursor.fetchall()
-
-            # If the batch is empty, it means there are no more rows in the table.
-            if not batch:
-                break # Exit the while loop
-
-            # Yield the current batch (a list of user dictionaries).
-            yield batch
-
-            # Increment the offset for the next iteration to fetch the next batch.
-            offset += batch_size
+        # Loop 1 (Primary loop for fetching batches) lives in pagination.iter_pages:
+        # it keeps querying until the table is exhausted.
+        yield from call.items(pagination.iter_pages(connection, batch_size, mode,
+                                                    cursor_token, row_format=row_format,
+                                                    where=where, call=call))
 
     except mysql.connector.Error as err:
+        call.error(err)
         print(f"Database error during batch streaming: {err}")
     except Exception as e:
+        call.error(e)
         print(f"An unexpected error occurred during batch streaming: {e}")
     finally:
-        # Ensure database resources (cursor and connection) are properly closed.
-        if cursor:
-            cursor.close()
-        if connection:
+        # Ensure the connection is properly closed if we opened it.
+        if owns_connection and connection:
             connection.close()
+        call.finish()
 
 
 def batch_processing(batch_size):
@@ -89,9 +94,11 @@ def batch_processing(batch_size):
     A generator function that processes user data in batches.
 
     It utilizes the `stream_users_in_batches` generator to receive data
-    in chunks. For each batch, it iterates through the users and filters
-    them based on the condition that their 'age' is greater than 25.
-    Each filtered user is then yielded individually.
+    in chunks and yields the users whose 'age' is greater than 25. The
+    filter is pushed down into the SQL WHERE clause, so users aged 25 or
+    less never leave the database and no per-row check runs in Python.
+    For richer filter/map/project processing over columnar batches, see
+    `pipeline.Pipeline`.
 
     Args:
         batch_size (int): The size of batches to fetch and process.
@@ -100,13 +107,43 @@ def batch_processing(batch_size):
         dict: A dictionary representing a single user row, but only if
               the user's 'age' is greater than 25.
     """
+    over_25 = pipeline.where("age", ">", 25)
     # Loop 2 (Iterating over batches):
-    # This loop iterates over the batches yielded by `stream_users_in_batches`.
-    for batch in stream_users_in_batches(batch_size):
-        # Loop 3 (Iterating over users within a batch):
-        # This nested loop processes each individual user within the current batch.
-        for user in batch:
-            # Filter condition: yield user only if age is greater than 25.
-            if user['age'] > 25:
-                yield user
+    # This loop iterates over the already filtered batches yielded by
+    # `stream_users_in_batches` and hands out their users one by one.
+    for batch in stream_users_in_batches(batch_size, where=(over_25,)):
+        yield from batch
+
 
+def parallel_batch_processing(process, batch_size, sink=None, workers=4, processes=False,
+                              queue_size=None, connection=None, row_format=row_formats.DICT,
+                              where=()):
+    """
+    Processes the users in batches on parallel workers.
+
+    One thread fetches batches with `stream_users_in_batches`, `workers`
+    threads (or processes) apply `process` to them, and `sink` receives
+    the results on the calling thread. The stages are connected by bounded
+    queues, so a slow stage holds back the others instead of letting
+    batches pile up in memory (see batch_pipeline.py).
+
+    Args:
+        process (callable): batch -> result, e.g.
+                            `batch_pipeline.map_rows(enrich_user)`.
+        batch_size (int): The number of rows per batch.
+        sink (callable | None): Called with each result, in completion order.
+        workers (int): The number of parallel workers.
+        processes (bool): Use worker processes instead of threads.
+        queue_size (int | None): The capacity of each queue, in batches.
+        connection: An optional open connection, used by the fetch thread
+                    only (sqlite3 connections need check_same_thread=False).
+        row_format (str): The row format of the batches.
+        where (iterable): Predicates to evaluate in the SQL WHERE clause.
+
+    Returns:
+        batch_pipeline.PipelineStats: Per-stage batch, row and time counters.
+    """
+    batches = stream_users_in_batches(batch_size, connection=connection,
+                                      row_format=row_format, where=where)
+    return batch_pipeline.run_pipeline(batches, process, sink, workers=workers,
+                                       processes=processes, queue_size=queue_size)
@@ -10,11 +10,17 @@ optimizing memory usage for large datasets.
 Functions:
 - paginate_users(page_size, offset): Fetches a single page of user data
   from the database.
+- paginate_users_after(page_size, after): Fetches a single page of user
+  data that follows a given `user_id` (keyset pagination).
 - lazy_pagination(page_size): A generator that yields pages of user data
-  one by one, fetching them from the database only when needed.
+  one by one over a single connection, fetching them from the database
+  only when needed.
 """
 
 import seed  # To access connect_to_prodev()
+import pagination  # Shared offset/keyset paging engine
+import row_formats
+import instrumentation
 import mysql.connector # Required for database error handling (e.g., mysql.connector.Error)
 
 def paginate_users(page_size, offset):
@@ -35,59 +41,151 @@ def paginate_users(page_size, offset):
                     if no rows are found for the given page and offset.
     """
     connection = None
-    cursor = None
     rows = []
+    call = instrumentation.call("paginate_users")
     try:
-        connection = seed.connect_to_prodev()
+        connection = call.connect(seed.connect_to_prodev)
         if not connection:
             print("Failed to connect to the database. Cannot paginate users.")
             return []
 
-        cursor = connection.cursor(dictionary=True)
-        cursor.execute(f"SELECT * FROM user_data LIMIT {page_size} OFFSET {offset}")
-        rows = cursor.fetchall()
+        rows = pagination.fetch_offset_page(connection, page_size, offset, call=call)
 
     except mysql.connector.Error as err:
+        call.error(err)
         print(f"Database error during pagination: {err}")
     except Exception as e:
+        call.error(e)
         print(f"An unexpected error occurred during pagination: {e}")
     finally:
-        if cursor:
-            cursor.close()
         if connection:
             connection.close()
+        call.finish()
     return rows
 
 
-def lazy_pagination(page_size):
+def paginate_users_after(page_size, after=None):
     """
-    Generator that yields pages of users lazily, one page at a time.
+    Fetches one page of users whose `user_id` follows `after`.
+
+    Unlike `paginate_users`, which makes the database skip `offset` rows
+    before returning anything, this seeks directly into the primary key
+    index (`WHERE user_id > after ORDER BY user_id LIMIT page_size`), so
+    the cost of a page does not depend on how deep into the table it is.
+
+    Args:
+        page_size (int): The maximum number of rows to fetch for the page.
+        after (str | None): The last `user_id` already seen, or None to
+                            start from the beginning of the table.
+
+    Returns:
+        list[dict]: The user rows of the page ordered by `user_id`, or an
+                    empty list when there are no more rows.
+    """
+    connection = None
+    rows = []
+    call = instrumentation.call("paginate_users_after")
+    try:
+        connection = call.connect(seed.connect_to_prodev)
+        if not connection:
+            print("Failed to connect to the database. Cannot paginate users.")
+            return []
+
+        rows = pagination.fetch_keyset_page(connection, page_size, after, call=call)
+
+    except mysql.connector.Error as err:
+        call.error(err)
+        print(f"Database error during pagination: {err}")
+    except Exception as e:
+        call.error(e)
+        print(f"An unexpected error occurred during pagination: {e}")
+    finally:
+        if connection:
+            connection.close()
+        call.finish()
+    return rows
+
 
-    This generator continuously calls `paginate_users` to fetch pages
-    from the database. It yields each page (a list of user dictionaries)
-    one by one, only fetching the next page when the current one has been
-    consumed. This ensures that only one page is in memory at a time,
-    making it highly memory-efficient for very large datasets.
+def lazy_pagination(page_size, mode=pagination.KEYSET, cursor_token=None,
+                    connection=None, stats=None, row_format=row_formats.DICT,
+                    prefetch=0):
+    """
+    Generator that yields pages of users lazily, one page at a time.
 
-    It adheres to the constraint of having no more than one loop.
+    This generator fetches pages from the database and yields each page
+    (a list of user dictionaries) one by one, only fetching the next page
+    when the current one has been consumed. This ensures that only one page
+    is in memory at a time, making it highly memory-efficient for very
+    large datasets.
+
+    A single connection is used for the whole iteration instead of one
+    connection (and handshake) per page. If no connection is passed in, one
+    is opened with `seed.connect_to_prodev()` on the first `next()` and
+    closed as soon as the generator is exhausted, closed with `.close()`,
+    or garbage-collected. A connection passed in by the caller (for example
+    one checked out of a `mysql.connector.pooling` pool) is left open.
+
+    With `prefetch=K`, a background thread keeps up to K upcoming pages
+    queued while the consumer processes the current one (see
+    `pagination.prefetch`), so database time and processing time overlap.
+    The connection is then opened, used and closed on that thread; a
+    sqlite3 connection passed in must be created with
+    `check_same_thread=False`.
+
+    Pages are fetched with keyset pagination by default; `mode="offset"`
+    falls back to `LIMIT ... OFFSET ...`, whose cost grows with the offset.
+    A keyset scan can be resumed from any page with
+    `lazy_pagination(page_size, cursor_token=pagination.cursor_for(page))`.
 
     Args:
         page_size (int): The number of users to include in each page.
+        mode (str): "keyset" (default) or "offset". See pagination.py.
+        cursor_token (str | None): Resume token for keyset mode.
+        connection: An optional open connection to use for every page.
+        stats (pagination.PaginationStats | None): Counters to fill in with
+            the pages, rows, connect time and query time of the scan.
+        row_format (str): "dict" (default), "tuple", "record" or "columnar".
+                          See row_formats.py.
+        prefetch (int): Number of pages to read ahead on a background
+                        thread. 0 (the default) reads pages on demand.
 
     Yields:
         list[dict]: A list of dictionaries, where each dictionary represents
-                    a user row. Each yielded list is a "page" of data.
+                    a user row. Each yielded list is a "page" of data. Other
+                    row formats yield a list of tuples/records or a
+                    `ColumnarBatch` per page.
     """
-    offset = 0
-    # Loop 1 (The single loop allowed):
-    # This loop continues to fetch and yield pages until an empty page is returned,
-    # indicating that there are no more users in the database.
-    while True:
-        page = paginate_users(page_size, offset)
-        if not page:
-            break
-        yield page
-        offset += page_size
+    if prefetch:
+        yield from pagination.prefetch(
+            lazy_pagination(page_size, mode, cursor_token, connection, stats,
+                            row_format),
+            prefetch)
+        return
+
+    if stats is None:
+        stats = pagination.PaginationStats()
+    owns_connection = connection is None
+    call = instrumentation.call("lazy_pagination")
+    try:
+        if owns_connection:
+            connection = call.connect(stats.connect, seed.connect_to_prodev)
+        if not connection:
+            print("Failed to connect to the database. Cannot paginate users.")
+            return
+
+        # Loop 1 (The single loop allowed) lives in pagination.iter_pages:
+        # it keeps fetching pages until the table is exhausted.
+        yield from call.items(pagination.iter_pages(connection, page_size, mode,
+                                                    cursor_token, stats, row_format,
+                                                    call=call))
+
+    except mysql.connector.Error as err:
+        call.error(err)
+        print(f"Database error during pagination: {err}")
+    finally:
+        if owns_connection and connection:
+            connection.close()
+        call.finish()
 
 # Entry point for the script (for testing purposes)
 if __name__ == "__main__":
@@ -95,7 +193,8 @@ if __name__ == "__main__":
     try:
         print("--- Lazily Paginating Users (Page Size: 10) ---")
         page_num = 1
-        for page in lazy_pagination(10): # Fetch pages of 10 users
+        stats = pagination.PaginationStats()
+        for page in lazy_pagination(10, stats=stats): # Fetch pages of 10 users
             print(f"\n--- Page {page_num} ---")
             for user in page:
                 print(user)
@@ -104,6 +203,7 @@ if __name__ == "__main__":
             if page_num > 3:
                 print("\n(Stopped after 3 pages for brevity. Remove this check to print all pages.)")
                 break
+        print(f"\n{stats}")
     except BrokenPipeError:
         # Handles cases where output is piped to a command like `head`
         # and the pipe is closed early.
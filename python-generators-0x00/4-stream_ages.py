@@ -8,13 +8,27 @@ loading the entire dataset into memory.
 
 Functions:
 - stream_user_ages(): A generator that yields user ages one by one.
-- average_age(): Calculates the average age by consuming the `stream_user_ages` generator.
+- aggregate_ages(): Computes count, mean, min, max, variance and percentiles
+  of the ages, in SQL when possible and otherwise in one streaming pass.
+- parallel_age_stats(): Computes the age statistics with a parallel
+  range-partitioned scan.
+- parallel_age_summary(): Runs any set of mergeable aggregators
+  (aggregates.Aggregation) over the ages with a parallel scan.
+- average_age(): Prints the average age of users.
 """
 
+import functools
+import sqlite3
+
 import seed
+import aggregates
+import partitioned_scan
 import mysql.connector
 
-def stream_user_ages():
+# Aggregates supported by `aggregate_ages`, besides percentiles.
+AGGREGATES = ("count", "mean", "min", "max", "variance")
+
+def stream_user_ages(connection=None):
     """
     Generator that yields user ages one by one from the 'user_data' table in the database.
 
@@ -23,6 +37,11 @@ def stream_user_ages():
     making it highly memory-efficient for large datasets by avoiding
     loading all ages into memory at once.
 
+    Args:
+        connection: An optional open connection to use. When omitted a
+                    connection is opened with `seed.connect_to_prodev()`
+                    and closed when the generator finishes.
+
     Yields:
         int: The age of a single user.
 
@@ -30,11 +49,12 @@ def stream_user_ages():
         mysql.connector.Error: If a database-related error occurs during connection or query.
         Exception: For any other unexpected errors during the streaming process.
     """
-    connection = None
+    owns_connection = connection is None
     cursor = None
     try:
         # Establish a connection to the 'ALX_prodev' database.
-        connection = seed.connect_to_prodev()
+        if owns_connection:
+            connection = seed.connect_to_prodev()
         if not connection:
             print("Failed to connect to the database. Cannot stream user ages.")
             return # Exit the generator if connection fails
@@ -59,18 +79,201 @@ def stream_user_ages():
         # Ensure database resources (cursor and connection) are properly closed.
         if cursor:
             cursor.close()
-        if connection:
+        if owns_connection and connection:
             connection.close()
 
 
+def percentile_key(p):
+    """
+    Returns the result key used for percentile `p` (0-100), e.g. "p50".
+    """
+    return f"p{p:g}"
+
+
+def _aggregate_in_sql(connection, wanted, percentiles):
+    """
+    Computes the aggregates with SQL so that only a handful of rows cross
+    the network instead of one row per user.
+
+    COUNT, SUM, MIN and MAX are portable, and the variance is derived from
+    the exact integer sums SUM(age) and SUM(age * age). Each percentile is
+    one `ORDER BY age LIMIT 1 OFFSET k` query (nearest-rank, exact), since
+    MySQL has no PERCENTILE_CONT.
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            "SELECT COUNT(age), SUM(age), SUM(age * age), MIN(age), MAX(age) "
+            "FROM user_data"
+        )
+        count, total, total_sq, low, high = cursor.fetchone()
+        count = int(count)
+        results = {"count": count, "mean": None, "min": low, "max": high,
+                   "variance": None}
+        if count:
+            total, total_sq = int(total), int(total_sq)
+            results["mean"] = total / count
+            results["variance"] = (count * total_sq - total * total) / (count * count)
+
+        mark = seed.placeholder(connection)
+        for p in percentiles:
+            value = None
+            if count:
+                cursor.execute(
+                    f"SELECT age FROM user_data ORDER BY age LIMIT 1 OFFSET {mark}",
+                    (aggregates.nearest_rank(p / 100, count),),
+                )
+                value = cursor.fetchone()[0]
+            results[percentile_key(p)] = value
+    finally:
+        cursor.close()
+    return {key: value for key, value in results.items()
+            if key in wanted or key.startswith("p")}
+
+
+def _aggregate_streaming(ages, wanted, percentiles):
+    """
+    Computes the aggregates in a single pass over `ages` with constant
+    memory: Welford's algorithm for mean and variance, and one P-square
+    estimator per percentile (approximate).
+    """
+    stats = aggregates.RunningStats()
+    estimators = [aggregates.P2Quantile(p / 100) for p in percentiles]
+    for age in ages:
+        stats.add(age)
+        for estimator in estimators:
+            estimator.add(age)
+
+    results = {"count": stats.count, "mean": stats.mean if stats.count else None,
+               "min": stats.min, "max": stats.max, "variance": stats.variance}
+    results = {key: value for key, value in results.items() if key in wanted}
+    for p, estimator in zip(percentiles, estimators):
+        results[percentile_key(p)] = estimator.value
+    return results
+
+
+def aggregate_ages(wanted=AGGREGATES, percentiles=(), pushdown=True, connection=None):
+    """
+    Computes aggregates of the users' ages.
+
+    With `pushdown` (the default) the work is done by the database and only
+    the results travel over the network. If the query fails (or `pushdown`
+    is False) the ages are streamed with `stream_user_ages` and aggregated
+    in a single pass with constant memory instead.
+
+    Args:
+        wanted (iterable[str]): Any of "count", "mean", "min", "max" and
+                                "variance" (population variance).
+        percentiles (iterable[float]): Percentiles between 0 and 100. They
+                                       are exact (nearest-rank) when pushed
+                                       down and P-square estimates otherwise.
+        pushdown (bool): Try to compute the aggregates in SQL first.
+        connection: An optional open connection to use.
+
+    Returns:
+        dict: The requested aggregates, with percentiles under keys such as
+              "p50" and "p99". Values are None for an empty table.
+
+    Raises:
+        ValueError: On an unknown aggregate or a percentile out of range.
+    """
+    wanted = tuple(wanted)
+    percentiles = tuple(percentiles)
+    unknown = set(wanted) - set(AGGREGATES)
+    if unknown:
+        raise ValueError(f"Unknown aggregates: {sorted(unknown)}")
+    if any(not 0 <= p <= 100 for p in percentiles):
+        raise ValueError("Percentiles must be between 0 and 100")
+
+    owns_connection = connection is None
+    try:
+        if owns_connection:
+            connection = seed.connect_to_prodev()
+        if not connection:
+            print("Failed to connect to the database. Cannot aggregate user ages.")
+            return _aggregate_streaming((), wanted, percentiles)
+        if pushdown:
+            try:
+                return _aggregate_in_sql(connection, wanted, percentiles)
+            except (mysql.connector.Error, sqlite3.Error) as err:
+                print(f"Aggregation could not be pushed down ({err}); streaming ages.")
+        return _aggregate_streaming(stream_user_ages(connection), wanted, percentiles)
+    finally:
+        if owns_connection and connection:
+            connection.close()
+
+
+def batch_age_stats(batch):
+    """
+    Returns the RunningStats of the ages of one columnar batch (the map
+    step of `parallel_age_stats`).
+    """
+    return aggregates.RunningStats().update(batch.age)
+
+
+def parallel_age_stats(partitions=4, processes=False, connect=seed.connect_to_prodev):
+    """
+    Computes count, mean, min, max and variance of the ages by scanning
+    `partitions` ranges of 'user_data' in parallel, each over its own
+    connection, and merging the partial statistics.
+
+    Args:
+        partitions (int): The number of `user_id` ranges to scan in parallel.
+        processes (bool): Use worker processes instead of threads.
+        connect (callable): Zero-argument connection factory.
+    Returns:
+        aggregates.RunningStats: The merged statistics.
+    """
+    stats = partitioned_scan.map_reduce(partitions, batch_age_stats,
+                                        aggregates.RunningStats.merge,
+                                        processes=processes, connect=connect)
+    return stats if stats is not None else aggregates.RunningStats()
+
+
+def _summarize_batch(aggregation, batch):
+    """
+    Returns empty accumulators like those of `aggregation`, fed with one
+    columnar batch (the map step of `parallel_age_summary`).
+    """
+    return aggregation.empty().consume((batch,))
+
+
+def parallel_age_summary(aggregation, partitions=4, processes=False,
+                         connect=seed.connect_to_prodev):
+    """
+    Feeds the ages to a set of mergeable aggregators by scanning
+    `partitions` ranges of 'user_data' in parallel and merging the partial
+    states, e.g.:
+
+        parallel_age_summary(aggregates.Aggregation(
+            {"histogram": aggregates.Histogram(0, 100, 10),
+             "distinct": aggregates.HyperLogLog(),
+             "quantiles": aggregates.QuantileSketch()}, field="age")).value
+
+    Args:
+        aggregation (aggregates.Aggregation): The empty aggregators; it is
+                                              copied, not modified.
+        partitions (int): The number of `user_id` ranges to scan in parallel.
+        processes (bool): Use worker processes instead of threads.
+        connect (callable): Zero-argument connection factory.
+    Returns:
+        aggregates.Aggregation: The merged aggregators.
+    """
+    result = partitioned_scan.map_reduce(partitions,
+                                         functools.partial(_summarize_batch, aggregation),
+                                         aggregates.Aggregation.merge,
+                                         processes=processes, connect=connect)
+    return result if result is not None else aggregation.empty()
+
+
 def average_age():
     """
-    Calculates the average age of users using the stream_user_ages generator.
+    Calculates and prints the average age of users.
 
-    This function consumes ages yielded by the `stream_user_ages` generator
-    one by one, accumulating the total age and count of users without
-    storing all ages in memory. This approach is memory-efficient for
-    large datasets.
+    The average is computed by the database (`aggregate_ages`), so a single
+    row crosses the network instead of one row per user. If the aggregate
+    cannot be pushed down, the ages are consumed from the `stream_user_ages`
+    generator one by one without storing them in memory.
 
     The calculated average age is printed to the console, formatted to
     two decimal places. It handles the case where no users are found
@@ -80,18 +283,7 @@ def average_age():
         str: A string indicating the calculated average age, or a message
              if no users are found.
     """
-    total = 0
-    count = 0
-
-    # Loop 2: Iterate over the ages yielded by the generator.
-    # This loop consumes ages one by one as they are generated,
-    # preventing the entire dataset from being stored in memory.
-    for age in stream_user_ages(): #  loop 2: consume generator
-        total += age
-        count += 1
-
-    # Calculate the average age. Handle division by zero if no users are found.
-    average = total / count if count != 0 else 0
+    average = aggregate_ages(("mean",))["mean"] or 0
     print(f"Average age of users: {average:.2f}")
 
 # Entry point for the script
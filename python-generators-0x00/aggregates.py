@@ -0,0 +1,714 @@
+#!/usr/bin/python3
+"""
+aggregates.py
+
+Single-pass streaming accumulators for the 'user_data' generators.
+
+Each accumulator consumes values one at a time with `add(value)` (or a
+chunk at a time with `update(values)`) and uses a bounded amount of memory
+that does not grow with the stream, so it can be fed straight from a
+generator such as `stream_user_ages` without materializing the stream.
+
+All accumulators except P2Quantile are mergeable: `a.merge(b)` leaves `a`
+summarizing both streams, so partial states computed by a partitioned or
+parallel scan (see partitioned_scan.map_reduce) can be combined.
+
+Classes:
+- RunningStats: count, sum, mean, min, max and variance (Welford's
+  algorithm, numerically stable).
+- Histogram: counts over fixed-width bins.
+- TopK: the most frequent values (Misra-Gries summary).
+- HyperLogLog: an estimate of the number of distinct values.
+- QuantileSketch: mergeable quantile estimates (KLL sketch).
+- P2Quantile: an estimate of one quantile using the P-square algorithm
+  (Jain & Chlamtac), which keeps five markers instead of the data.
+- Aggregation: named accumulators fed with one field of the items of any
+  generator (rows, pages, columnar batches or plain values).
+"""
+
+import collections
+import hashlib
+import heapq
+import math
+import random
+from array import array
+
+import row_formats
+
+try:
+    import numpy
+except ImportError:  # NumPy is optional; fall back to pure Python.
+    numpy = None
+
+
+def _is_buffer(values):
+    """True for the numeric column types NumPy can view without copying."""
+    return isinstance(values, (array, memoryview))
+
+
+class RunningStats:
+    """
+    Count, sum, mean, min, max and population variance of a stream.
+
+    Uses Welford's online update, which avoids the catastrophic
+    cancellation of the naive sum-of-squares formula. Two partial states
+    can be combined with `merge` (Chan et al.'s parallel formula).
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.mean = 0.0
+        self.min = None
+        self.max = None
+        self._m2 = 0.0
+
+    def empty(self):
+        """Returns a new, empty accumulator with the same parameters."""
+        return RunningStats()
+
+    def add(self, value):
+        """
+        Adds one value to the running statistics.
+        """
+        self.count += 1
+        self.total += value
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def update(self, values):
+        """
+        Adds every value of an iterable (e.g. a batch's age column).
+        Numeric buffers are folded in with `from_buffer` and `merge`.
+
+        Returns:
+            RunningStats: self, to allow chaining.
+        """
+        if numpy is not None and _is_buffer(values):
+            return self.merge(RunningStats.from_buffer(values))
+        for value in values:
+            self.add(value)
+        return self
+
+    @classmethod
+    def from_buffer(cls, values):
+        """
+        Builds the statistics of a whole integer buffer at once, e.g. an
+        `array('i')` age column or a memoryview of a memory-mapped one.
+        Vectorized with NumPy when it is installed.
+
+        Returns:
+            RunningStats: The statistics of `values`.
+        """
+        if numpy is None:
+            return cls().update(values)
+        stats = cls()
+        typecode = getattr(values, "typecode", None) or values.format
+        data = numpy.frombuffer(values, dtype=numpy.dtype(typecode))
+        if not len(data):
+            return stats
+        stats.count = len(data)
+        stats.total = int(data.sum(dtype=numpy.int64))
+        stats.mean = stats.total / stats.count
+        stats._m2 = float(numpy.square(data - stats.mean).sum())
+        stats.min = int(data.min())
+        stats.max = int(data.max())
+        return stats
+
+    def merge(self, other):
+        """
+        Combines the state of another RunningStats into this one.
+
+        Returns:
+            RunningStats: self, to allow chaining.
+        """
+        if not other.count:
+            return self
+        if not self.count:
+            self.count, self.total, self.mean = other.count, other.total, other.mean
+            self.min, self.max, self._m2 = other.min, other.max, other._m2
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self._m2 += other._m2 + delta * delta * self.count * other.count / count
+        self.mean += delta * other.count / count
+        self.count = count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def variance(self):
+        """Population variance, or None for an empty stream."""
+        return self._m2 / self.count if self.count else None
+
+    @property
+    def value(self):
+        """The statistics as a dict."""
+        return {"count": self.count, "sum": self.total,
+                "mean": self.mean if self.count else None,
+                "min": self.min, "max": self.max, "variance": self.variance}
+
+
+class Histogram:
+    """
+    Counts of values in `bins` equal-width bins between `low` and `high`,
+    plus the number of values below `low` (underflow) and at or above
+    `high` (overflow).
+    """
+
+    def __init__(self, low, high, bins):
+        if not low < high or bins <= 0:
+            raise ValueError("Histogram needs low < high and a positive bin count")
+        self.low = low
+        self.high = high
+        self.bins = bins
+        self.counts = [0] * bins
+        self.underflow = 0
+        self.overflow = 0
+        self._scale = bins / (high - low)
+
+    def empty(self):
+        """Returns a new, empty accumulator with the same parameters."""
+        return Histogram(self.low, self.high, self.bins)
+
+    def add(self, value):
+        """
+        Adds one value to the histogram.
+        """
+        if value < self.low:
+            self.underflow += 1
+        elif value >= self.high:
+            self.overflow += 1
+        else:
+            self.counts[int((value - self.low) * self._scale)] += 1
+
+    def update(self, values):
+        """
+        Adds every value of an iterable; numeric buffers are binned with
+        NumPy when it is installed.
+
+        Returns:
+            Histogram: self, to allow chaining.
+        """
+        if numpy is None or not _is_buffer(values):
+            for value in values:
+                self.add(value)
+            return self
+        typecode = getattr(values, "typecode", None) or values.format
+        data = numpy.frombuffer(values, dtype=numpy.dtype(typecode))
+        inside = (data >= self.low) & (data < self.high)
+        self.underflow += int((data < self.low).sum())
+        self.overflow += int((data >= self.high).sum())
+        index = ((data[inside] - self.low) * self._scale).astype(numpy.int64)
+        for i, count in enumerate(numpy.bincount(index, minlength=self.bins).tolist()):
+            self.counts[i] += count
+        return self
+
+    def merge(self, other):
+        """
+        Adds the counts of a histogram with the same bins into this one.
+
+        Returns:
+            Histogram: self, to allow chaining.
+        """
+        if (self.low, self.high, self.bins) != (other.low, other.high, other.bins):
+            raise ValueError("Only histograms with the same bins can be merged")
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+        return self
+
+    @property
+    def count(self):
+        """The number of values added."""
+        return sum(self.counts) + self.underflow + self.overflow
+
+    def edges(self):
+        """Returns the `bins + 1` bin edges."""
+        width = (self.high - self.low) / self.bins
+        return [self.low + i * width for i in range(self.bins)] + [self.high]
+
+    def quantile(self, q):
+        """
+        Estimates the `q` quantile (0 <= q <= 1) by interpolating linearly
+        inside the bin holding it. Returns None for an empty histogram and
+        the range bound when the quantile falls in the underflow/overflow.
+        """
+        total = self.count
+        if not total:
+            return None
+        target = q * total - self.underflow
+        if target <= 0:
+            return self.low
+        edges = self.edges()
+        for i, count in enumerate(self.counts):
+            if target <= count:
+                return edges[i] + (edges[i + 1] - edges[i]) * target / count
+            target -= count
+        return self.high
+
+    @property
+    def value(self):
+        """`(low_edge, high_edge, count)` for every bin."""
+        edges = self.edges()
+        return list(zip(edges, edges[1:], self.counts))
+
+
+class TopK:
+    """
+    The `k` most frequent values of a stream (Misra-Gries summary).
+
+    At most `capacity` candidate counters are kept. When there are more,
+    the (capacity + 1)-th largest count is subtracted from every counter
+    and the counters that drop to zero are forgotten. Every value occurring
+    more than n / (capacity + 1) times in a stream of n values is kept,
+    and its count is under-estimated by at most `error`.
+    """
+
+    def __init__(self, k, capacity=None):
+        if k <= 0:
+            raise ValueError("k must be a positive integer")
+        self.k = k
+        self.capacity = max(capacity or 4 * k, k)
+        self.counters = {}
+        self.error = 0
+
+    def empty(self):
+        """Returns a new, empty accumulator with the same parameters."""
+        return TopK(self.k, self.capacity)
+
+    def add(self, value, weight=1):
+        """
+        Adds `weight` occurrences of one value.
+        """
+        self.counters[value] = self.counters.get(value, 0) + weight
+        if len(self.counters) > self.capacity:
+            self._reduce()
+
+    def update(self, values):
+        """
+        Adds every value of an iterable, counting the chunk with
+        `collections.Counter` first.
+
+        Returns:
+            TopK: self, to allow chaining.
+        """
+        counters = self.counters
+        for value, weight in collections.Counter(values).items():
+            counters[value] = counters.get(value, 0) + weight
+        if len(counters) > self.capacity:
+            self._reduce()
+        return self
+
+    def _reduce(self):
+        """Shrinks the counters back to `capacity`."""
+        threshold = heapq.nlargest(self.capacity + 1, self.counters.values())[-1]
+        self.counters = {value: count - threshold
+                         for value, count in self.counters.items() if count > threshold}
+        self.error += threshold
+
+    def merge(self, other):
+        """
+        Combines another summary into this one (Agarwal et al.'s mergeable
+        Misra-Gries): counters are added and then reduced again.
+
+        Returns:
+            TopK: self, to allow chaining.
+        """
+        for value, count in other.counters.items():
+            self.counters[value] = self.counters.get(value, 0) + count
+        self.error += other.error
+        if len(self.counters) > self.capacity:
+            self._reduce()
+        return self
+
+    @property
+    def value(self):
+        """The top `k` `(value, count)` pairs, most frequent first."""
+        return heapq.nlargest(self.k, self.counters.items(), key=lambda item: item[1])
+
+
+class HyperLogLog:
+    """
+    Estimate of the number of distinct values in a stream, using
+    2 ** precision one-byte registers (Flajolet et al., with linear
+    counting for small cardinalities). The standard error is about
+    1.04 / sqrt(2 ** precision), i.e. 1.6% with the default 4 KiB.
+
+    Values are hashed through their `str()` with BLAKE2b, so estimates are
+    reproducible across processes (unlike the salted built-in `hash`).
+    """
+
+    def __init__(self, precision=12):
+        if not 4 <= precision <= 16:
+            raise ValueError("precision must be between 4 and 16")
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+        self._shift = 64 - precision
+        self._mask = (1 << self._shift) - 1
+
+    def empty(self):
+        """Returns a new, empty accumulator with the same parameters."""
+        return HyperLogLog(self.precision)
+
+    def add(self, value):
+        """
+        Adds one value to the estimate.
+        """
+        digest = hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest()
+        hashed = int.from_bytes(digest, "big")
+        index = hashed >> self._shift
+        rank = self._shift - (hashed & self._mask).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values):
+        """
+        Adds every value of an iterable. Duplicates cannot change a
+        register, so each distinct value of the chunk is hashed once.
+
+        Returns:
+            HyperLogLog: self, to allow chaining.
+        """
+        for value in set(values):
+            self.add(value)
+        return self
+
+    def merge(self, other):
+        """
+        Combines another estimate with the same precision into this one
+        (the register-wise maximum).
+
+        Returns:
+            HyperLogLog: self, to allow chaining.
+        """
+        if self.precision != other.precision:
+            raise ValueError("Only HyperLogLogs with the same precision can be merged")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    @property
+    def value(self):
+        """The estimated number of distinct values."""
+        m = len(self.registers)
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        estimate = alpha * m * m / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile estimates (the KLL sketch of Karnin, Lang and
+    Liberty).
+
+    Values are kept in levels of buffers; an item at level h stands for
+    2 ** h values. When a level is full it is sorted and every other item
+    (starting at a random one of the first two) is promoted to the next
+    level. Level capacities shrink geometrically below the top level, so
+    the sketch holds about 3 * k items however long the stream is, and a
+    rank is off by roughly 1.7 / k of the count.
+
+    Attributes:
+        quantiles (tuple): The quantiles reported by `value`.
+    """
+
+    def __init__(self, k=200, quantiles=(0.5, 0.9, 0.99)):
+        if k < 8:
+            raise ValueError("k must be at least 8")
+        self.k = k
+        self.quantiles = tuple(quantiles)
+        self.count = 0
+        self._levels = [[]]
+
+    def empty(self):
+        """Returns a new, empty accumulator with the same parameters."""
+        return QuantileSketch(self.k, self.quantiles)
+
+    def _capacity(self, level):
+        depth = len(self._levels) - level - 1
+        return max(2, int(math.ceil(self.k * (2 / 3) ** depth)))
+
+    def add(self, value):
+        """
+        Adds one value to the sketch.
+        """
+        self._levels[0].append(value)
+        self.count += 1
+        if len(self._levels[0]) >= self._capacity(0):
+            self._compress()
+
+    def update(self, values):
+        """
+        Adds every value of an iterable. The chunk is appended to the
+        bottom level and compacted once, rather than once per value.
+
+        Returns:
+            QuantileSketch: self, to allow chaining.
+        """
+        bottom = self._levels[0]
+        size = len(bottom)
+        bottom.extend(values)
+        self.count += len(bottom) - size
+        if len(bottom) >= self._capacity(0):
+            self._compress()
+        return self
+
+    def _compress(self):
+        """Compacts every level that is at or over its capacity."""
+        level = 0
+        while level < len(self._levels):
+            items = self._levels[level]
+            if len(items) >= self._capacity(level):
+                if level + 1 == len(self._levels):
+                    self._levels.append([])
+                items.sort()
+                keep = [items.pop()] if len(items) % 2 else []
+                self._levels[level + 1].extend(items[random.getrandbits(1)::2])
+                self._levels[level] = keep
+            level += 1
+
+    def merge(self, other):
+        """
+        Combines another sketch into this one.
+
+        Returns:
+            QuantileSketch: self, to allow chaining.
+        """
+        while len(self._levels) < len(other._levels):
+            self._levels.append([])
+        for level, items in enumerate(other._levels):
+            self._levels[level].extend(items)
+        self.count += other.count
+        self._compress()
+        return self
+
+    def quantile(self, q):
+        """
+        Estimates the `q` quantile (0 <= q <= 1), or None for an empty sketch.
+        """
+        if not self.count:
+            return None
+        weighted = sorted((item, 1 << level) for level, items in enumerate(self._levels)
+                          for item in items)
+        target = q * self.count
+        seen = 0
+        for item, weight in weighted:
+            seen += weight
+            if seen >= target:
+                return item
+        return weighted[-1][0]
+
+    @property
+    def size(self):
+        """The number of items currently held."""
+        return sum(len(items) for items in self._levels)
+
+    @property
+    def value(self):
+        """`{q: estimate}` for each of `quantiles`."""
+        return {q: self.quantile(q) for q in self.quantiles}
+
+
+class P2Quantile:
+    """
+    Streaming estimate of the `p` quantile (0 <= p <= 1) in O(1) memory.
+
+    The first five values are kept exactly; from then on five markers track
+    the minimum, the p/2, p and (1+p)/2 quantiles and the maximum, and are
+    adjusted with piecewise-parabolic interpolation as values arrive.
+    """
+
+    def __init__(self, p):
+        if not 0 <= p <= 1:
+            raise ValueError("p must be between 0 and 1")
+        self.p = p
+        self.count = 0
+        self._initial = []
+        self._heights = None
+        self._positions = None
+        self._desired = None
+        self._increments = (0, p / 2, p, (1 + p) / 2, 1)
+
+    def empty(self):
+        """Returns a new, empty accumulator with the same parameters."""
+        return P2Quantile(self.p)
+
+    def add(self, value):
+        """
+        Adds one value to the estimate.
+        """
+        self.count += 1
+        if self._heights is None:
+            self._initial.append(value)
+            if len(self._initial) == 5:
+                self._heights = sorted(self._initial)
+                self._positions = [0, 1, 2, 3, 4]
+                p = self.p
+                self._desired = [0, 2 * p, 4 * p, 2 + 2 * p, 4]
+            return
+
+        q, n = self._heights, self._positions
+        if value < q[0]:
+            q[0] = value
+            k = 0
+        elif value >= q[4]:
+            q[4] = value
+            k = 3
+        else:
+            k = next(i for i in range(1, 5) if value < q[i]) - 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self._desired[i] += self._increments[i]
+
+        for i in (1, 2, 3):
+            d = self._desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self._parabolic(i, d)
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def _parabolic(self, i, d):
+        """Piecewise-parabolic prediction of marker `i` moved by `d`."""
+        q, n = self._heights, self._positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    @property
+    def value(self):
+        """The current estimate, or None for an empty stream."""
+        if self._heights is not None:
+            return self._heights[2]
+        if not self._initial:
+            return None
+        ordered = sorted(self._initial)
+        return ordered[nearest_rank(self.p, len(ordered))]
+
+
+def nearest_rank(p, count):
+    """
+    Returns the zero-based index of the `p` quantile (0 <= p <= 1) of
+    `count` sorted values using the nearest-rank method.
+    """
+    rank = -(-p * count // 1)  # ceil(p * count)
+    return min(max(int(rank) - 1, 0), count - 1)
+
+
+def _field_values(item, field):
+    """
+    Returns the values of `field` in one item yielded by a generator: a
+    columnar batch (its column), a page or batch of rows, or a single
+    row. Returns None when the item itself is the value: with `field=None`
+    or for a plain value such as one yielded by `stream_user_ages`.
+    """
+    if field is None:
+        return None
+    if isinstance(item, row_formats.ColumnarBatch):
+        return getattr(item, field)
+    if isinstance(item, list):
+        if item and isinstance(item[0], dict):
+            return [row[field] for row in item]
+        index = row_formats.FIELDS.index(field)
+        return [row[index] for row in item]
+    if isinstance(item, dict):
+        return (item[field],)
+    if isinstance(item, (tuple, row_formats.UserRecord)):
+        return (item[row_formats.FIELDS.index(field)],)
+    return None
+
+
+class Aggregation:
+    """
+    A set of named accumulators fed with one field of every item of a
+    generator, and merged as a whole:
+
+        ages = Aggregation({"stats": RunningStats(), "p": QuantileSketch(),
+                            "distinct": HyperLogLog()}, field="age")
+        ages.consume(stream_users_in_batches(1000)).value
+
+    Items may be rows in any row format, pages or batches of rows, columnar
+    batches, or plain values (with `field=None`, e.g. `stream_user_ages`).
+    Single values are buffered into chunks of `chunk_size` so that every
+    accumulator works on a chunk at a time.
+    """
+
+    def __init__(self, aggregators, field=None, chunk_size=1024):
+        if field is not None and field not in row_formats.FIELDS:
+            raise ValueError(f"Unknown field: {field!r}")
+        self.aggregators = dict(aggregators)
+        self.field = field
+        self.chunk_size = chunk_size
+
+    def _feed(self, values):
+        for aggregator in self.aggregators.values():
+            aggregator.update(values)
+
+    def consume(self, source):
+        """
+        Feeds every item of `source` to the accumulators.
+
+        Returns:
+            Aggregation: self, to allow chaining.
+        """
+        pending = []
+        for item in source:
+            values = _field_values(item, self.field)
+            if values is None or len(values) == 1:
+                pending.append(item if values is None else values[0])
+                if len(pending) >= self.chunk_size:
+                    self._feed(pending)
+                    pending = []
+                continue
+            if pending:
+                self._feed(pending)
+                pending = []
+            self._feed(values)
+        if pending:
+            self._feed(pending)
+        return self
+
+    def merge(self, other):
+        """
+        Merges the accumulators of another Aggregation with the same names.
+
+        Returns:
+            Aggregation: self, to allow chaining.
+        """
+        if self.aggregators.keys() != other.aggregators.keys():
+            raise ValueError("Only aggregations with the same accumulators can be merged")
+        for name, aggregator in self.aggregators.items():
+            aggregator.merge(other.aggregators[name])
+        return self
+
+    def empty(self):
+        """
+        Returns an Aggregation with the same names, field and parameters
+        but empty accumulators, e.g. as a fresh partial. The accumulated
+        state of this one is not copied.
+        """
+        return Aggregation({name: aggregator.empty()
+                            for name, aggregator in self.aggregators.items()},
+                           self.field, self.chunk_size)
+
+    def __getitem__(self, name):
+        return self.aggregators[name]
+
+    @property
+    def value(self):
+        """`{name: accumulator.value}`."""
+        return {name: aggregator.value for name, aggregator in self.aggregators.items()}
@@ -0,0 +1,292 @@
+#!/usr/bin/python3
+"""
+async_streams.py
+
+`async for` versions of the 'user_data' generators for asyncio workers.
+
+The functions mirror the blocking generators and keep their row formats
+(row_formats.py) and pagination semantics (pagination.py):
+
+- stream_users_async(): rows one at a time, like `stream_users`.
+- stream_users_in_batches_async(batch_size): batches, like
+  `stream_users_in_batches`.
+- lazy_pagination_async(page_size): pages, like `lazy_pagination`.
+- stream_user_ages_async(): ages one at a time, like `stream_user_ages`.
+
+They run on aiomysql against the 'ALX_prodev' database, or on any
+aiosqlite connection passed in (used as a local stand-in). Each function
+takes an optional `limiter` (an `asyncio.Semaphore`) held for the whole
+scan, and `gather_bounded` runs many scans on one event loop with bounded
+concurrency.
+"""
+
+import asyncio
+import sqlite3
+
+import seed
+import pagination
+import row_formats
+
+try:
+    import aiomysql
+except ImportError:  # Only needed when no connection is passed in.
+    aiomysql = None
+
+try:
+    import aiosqlite
+except ImportError:
+    aiosqlite = None
+
+DB_ERRORS = (sqlite3.Error,) + ((aiomysql.Error,) if aiomysql else ())
+
+
+async def connect_to_prodev_async():
+    """
+    Connects to the 'ALX_prodev' database with aiomysql, using the same
+    credentials as `seed.connect_to_prodev`.
+
+    Returns:
+        aiomysql.Connection: The connection object if successful, None otherwise.
+    """
+    if aiomysql is None:
+        print("aiomysql is not installed. Cannot connect asynchronously.")
+        return None
+    try:
+        return await aiomysql.connect(host=seed.DB_HOST, user=seed.DB_USER,
+                                      password=seed.DB_PASSWORD, db='ALX_prodev')
+    except aiomysql.Error as err:
+        print(f"Error connecting to 'ALX_prodev' database: {err}")
+        return None
+
+
+def placeholder(connection):
+    """
+    Returns the parameter marker for an aiomysql or aiosqlite connection.
+    """
+    if aiosqlite is not None and isinstance(connection, aiosqlite.Connection):
+        return "?"
+    return "%s"
+
+
+async def _open_cursor(connection, unbuffered=False):
+    """
+    Opens a tuple cursor; with `unbuffered`, an aiomysql server-side cursor.
+    """
+    if unbuffered and aiomysql is not None and isinstance(connection, aiomysql.Connection):
+        return await connection.cursor(aiomysql.SSCursor)
+    return await connection.cursor()
+
+
+async def _fetch(connection, query, params):
+    """
+    Runs a query and returns all of its rows as tuples.
+    """
+    cursor = await _open_cursor(connection)
+    try:
+        await cursor.execute(query, params)
+        return await cursor.fetchall()
+    finally:
+        await cursor.close()
+
+
+class _Scan:
+    """
+    Async context manager holding the limiter and the connection of a scan.
+    It opens (and later closes) a connection only if none was passed in.
+    """
+
+    def __init__(self, connection, limiter):
+        self.connection = connection
+        self.limiter = limiter
+        self.owns_connection = connection is None
+
+    async def __aenter__(self):
+        if self.limiter is not None:
+            await self.limiter.acquire()
+        if self.owns_connection:
+            try:
+                self.connection = await connect_to_prodev_async()
+            except BaseException:
+                # __aexit__ does not run when __aenter__ fails or is cancelled.
+                if self.limiter is not None:
+                    self.limiter.release()
+                raise
+        return self.connection
+
+    async def __aexit__(self, exc_type, exc_value, exc_traceback):
+        try:
+            if self.owns_connection and self.connection:
+                self.connection.close()
+        finally:
+            if self.limiter is not None:
+                self.limiter.release()
+
+
+async def iter_pages_async(connection, page_size, mode=pagination.KEYSET,
+                           cursor_token=None, row_format=row_formats.DICT, where=(),
+                           stats=None):
+    """
+    Async generator equivalent of `pagination.iter_pages`.
+
+    Yields:
+        Non-empty pages of user rows in `row_format`.
+    """
+    pagination.check_scan(page_size, mode, cursor_token, row_format)
+    mark = placeholder(connection)
+    where = tuple(where)
+    after = pagination.decode_cursor(cursor_token)
+    offset = 0
+    while True:
+        if mode == pagination.KEYSET:
+            query, params = pagination.keyset_query(mark, page_size, after, where)
+        else:
+            query, params = pagination.offset_query(mark, page_size, offset, where)
+        rows = await _fetch(connection, query, params)
+        if not rows:
+            break
+        page = row_formats.from_tuples(rows, row_format)
+        if stats is not None:
+            stats.pages += 1
+            stats.rows += len(page)
+        yield page
+        if len(page) < page_size:
+            break
+        after = row_formats.last_user_id(page)
+        offset += page_size
+
+
+async def stream_users_async(fetch_size=1000, connection=None, row_format=row_formats.DICT,
+                             limiter=None):
+    """
+    Async generator streaming the rows of 'user_data' one at a time.
+
+    Rows are pulled `fetch_size` at a time through a server-side cursor
+    (aiomysql's SSCursor), so client memory stays flat.
+
+    Args:
+        fetch_size (int): Rows per `fetchmany()` round trip.
+        connection: An optional aiomysql or aiosqlite connection. When
+                    omitted one is opened and closed by the generator.
+        row_format (str): "dict" (default), "tuple", "record" or "columnar".
+                          With "columnar" one batch is yielded per chunk.
+        limiter (asyncio.Semaphore | None): Held for the whole scan.
+
+    Yields:
+        dict: A user row (or a row/batch in `row_format`).
+    """
+    row_formats.check_format(row_format)
+    async with _Scan(connection, limiter) as connection:
+        if not connection:
+            print("Failed to connect to the database. Cannot stream users.")
+            return
+        cursor = None
+        try:
+            cursor = await _open_cursor(connection, unbuffered=True)
+            await cursor.execute(f"SELECT {pagination.COLUMNS} FROM user_data")
+            while True:
+                rows = await cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                if row_format == row_formats.COLUMNAR:
+                    yield row_formats.ColumnarBatch.from_rows(rows)
+                    continue
+                for row in row_formats.from_tuples(rows, row_format):
+                    yield row
+        except DB_ERRORS as err:
+            print(f"Database error during streaming: {err}")
+        finally:
+            if cursor is not None:
+                await cursor.close()
+
+
+async def stream_users_in_batches_async(batch_size, mode=pagination.KEYSET,
+                                        cursor_token=None, connection=None,
+                                        row_format=row_formats.DICT, where=(),
+                                        limiter=None):
+    """
+    Async generator yielding 'user_data' in batches of `batch_size` rows,
+    with the same arguments and semantics as `stream_users_in_batches`.
+
+    Yields:
+        list[dict]: Up to `batch_size` user rows (or a batch in `row_format`).
+    """
+    async with _Scan(connection, limiter) as connection:
+        if not connection:
+            print("Failed to connect to the database. Cannot stream users in batches.")
+            return
+        try:
+            async for batch in iter_pages_async(connection, batch_size, mode, cursor_token,
+                                                row_format, where):
+                yield batch
+        except DB_ERRORS as err:
+            print(f"Database error during batch streaming: {err}")
+
+
+async def lazy_pagination_async(page_size, mode=pagination.KEYSET, cursor_token=None,
+                                connection=None, stats=None, row_format=row_formats.DICT,
+                                limiter=None):
+    """
+    Async generator yielding pages of `page_size` users over one
+    connection, with the same arguments and semantics as `lazy_pagination`.
+
+    Yields:
+        list[dict]: A page of user rows (or a page in `row_format`).
+    """
+    async with _Scan(connection, limiter) as connection:
+        if not connection:
+            print("Failed to connect to the database. Cannot paginate users.")
+            return
+        try:
+            async for page in iter_pages_async(connection, page_size, mode, cursor_token,
+                                               row_format, stats=stats):
+                yield page
+        except DB_ERRORS as err:
+            print(f"Database error during pagination: {err}")
+
+
+async def stream_user_ages_async(fetch_size=1000, connection=None, limiter=None):
+    """
+    Async generator yielding the age of every user one at a time.
+
+    Yields:
+        int: The age of a single user.
+    """
+    async with _Scan(connection, limiter) as connection:
+        if not connection:
+            print("Failed to connect to the database. Cannot stream user ages.")
+            return
+        cursor = None
+        try:
+            cursor = await _open_cursor(connection, unbuffered=True)
+            await cursor.execute("SELECT age FROM user_data")
+            while True:
+                rows = await cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                for (age,) in rows:
+                    yield age
+        except DB_ERRORS as err:
+            print(f"Database error during age streaming: {err}")
+        finally:
+            if cursor is not None:
+                await cursor.close()
+
+
+async def gather_bounded(awaitables, limit):
+    """
+    Runs awaitables concurrently with at most `limit` in flight at once.
+
+    Args:
+        awaitables (iterable): Coroutines to run, e.g. scans consuming the
+                               async generators above.
+        limit (int): The maximum number running at the same time.
+    Returns:
+        list: Their results, in the order given.
+    """
+    limiter = asyncio.Semaphore(limit)
+
+    async def run(awaitable):
+        async with limiter:
+            return await awaitable
+
+    return await asyncio.gather(*(run(awaitable) for awaitable in awaitables))
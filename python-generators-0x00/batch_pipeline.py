@@ -0,0 +1,290 @@
+#!/usr/bin/python3
+"""
+batch_pipeline.py
+
+A producer/consumer pipeline that processes batches of users in parallel
+with bounded memory:
+
+    fetch  --(work queue)-->  N workers  --(results queue)-->  sink
+
+- The fetch stage iterates a batch source (e.g. `stream_users_in_batches`)
+  on its own thread, so its database connection lives on that thread.
+- N workers apply the processing function to each batch, on threads (for
+  I/O-bound work such as calls to an enrichment service) or, with
+  `processes=True`, each feeding one process of a process pool (for
+  CPU-bound work).
+- The sink runs on the caller's thread and receives every result.
+
+Both queues are bounded. When the workers fall behind, the fetch stage
+waits for room in the work queue; when the sink falls behind, the workers
+wait for room in the results queue. At most
+`2 * queue_size + workers + 2` batches are therefore in flight,
+however large the table. Results reach the sink in completion order, not
+in fetch order.
+
+Each stage keeps StageStats counters (batches, rows, seconds busy and
+seconds waiting on a neighbour), returned as PipelineStats, so a slow
+stage shows up as busy while its neighbours wait.
+"""
+
+import concurrent.futures
+import functools
+import queue
+import threading
+import time
+
+# End-of-stream marker passed from the fetch stage to the workers and from
+# the workers to the sink.
+_DONE = object()
+
+# Returned by `_get` when the pipeline was stopped.
+_STOPPED = object()
+
+# Seconds between checks of the stop flag while waiting on a queue.
+POLL_INTERVAL = 0.05
+
+
+class StageStats:
+    """
+    Counters of one pipeline stage.
+
+    Attributes:
+        name (str): The stage name.
+        batches (int): Batches handled by the stage.
+        rows (int): Rows in those batches.
+        busy_time (float): Seconds spent doing the stage's work (fetching,
+                           processing or sinking), summed over its threads.
+        wait_time (float): Seconds spent waiting for input or for room in
+                           the next queue, summed over its threads.
+        elapsed (float): Wall-clock seconds of the whole pipeline run.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.batches = 0
+        self.rows = 0
+        self.busy_time = 0.0
+        self.wait_time = 0.0
+        self.elapsed = 0.0
+
+    def merge(self, other):
+        """
+        Adds the counters of another thread of the same stage.
+
+        Returns:
+            StageStats: self, to allow chaining.
+        """
+        self.batches += other.batches
+        self.rows += other.rows
+        self.busy_time += other.busy_time
+        self.wait_time += other.wait_time
+        return self
+
+    @property
+    def rows_per_second(self):
+        """Rows handled per second of wall-clock time."""
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def __repr__(self):
+        return (f"StageStats({self.name}: batches={self.batches}, rows={self.rows}, "
+                f"busy={self.busy_time:.2f}s, wait={self.wait_time:.2f}s, "
+                f"{self.rows_per_second:.0f} rows/s)")
+
+
+class PipelineStats:
+    """
+    The counters of a pipeline run.
+
+    Attributes:
+        fetch (StageStats): The fetch stage.
+        workers (StageStats): All workers together.
+        sink (StageStats): The sink.
+        elapsed (float): Wall-clock seconds of the run.
+    """
+
+    def __init__(self):
+        self.fetch = StageStats("fetch")
+        self.workers = StageStats("workers")
+        self.sink = StageStats("sink")
+        self.elapsed = 0.0
+
+    @property
+    def stages(self):
+        """The stage counters, in pipeline order."""
+        return (self.fetch, self.workers, self.sink)
+
+    def finish(self, elapsed):
+        """Records the wall-clock time of the run on every stage."""
+        self.elapsed = elapsed
+        for stage in self.stages:
+            stage.elapsed = elapsed
+
+    def __repr__(self):
+        return "PipelineStats(\n" + "".join(f"  {stage!r}\n" for stage in self.stages) + ")"
+
+
+def _map_rows(function, batch):
+    return [function(row) for row in batch]
+
+
+def map_rows(function):
+    """
+    Turns a per-user function into a per-batch processing function that
+    returns the list of its results. The result is picklable whenever
+    `function` is (a module-level function), so it works with processes.
+    """
+    return functools.partial(_map_rows, function)
+
+
+def _put(items, item, stop):
+    """Puts `item` into a bounded queue unless the pipeline is stopped."""
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=POLL_INTERVAL)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(items, stop):
+    """Takes the next item of a queue, or _STOPPED once the pipeline stops."""
+    while not stop.is_set():
+        try:
+            return items.get(timeout=POLL_INTERVAL)
+        except queue.Empty:
+            continue
+    return _STOPPED
+
+
+def _fetch(source, work, stop, stats, failures, workers):
+    """Fetch stage: iterates `source` into the work queue."""
+    iterator = iter(source)
+    try:
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                break
+            ready = time.perf_counter()
+            stats.busy_time += ready - start
+            if not _put(work, batch, stop):
+                break
+            stats.wait_time += time.perf_counter() - ready
+            stats.batches += 1
+            stats.rows += len(batch)
+    except BaseException as err:  # Re-raised by the sink.
+        failures.append(err)
+        stop.set()
+    finally:
+        close = getattr(iterator, "close", None)
+        if close:
+            close()
+        for _ in range(workers):
+            _put(work, _DONE, stop)
+
+
+def _work(call, work, results, stop, stats, failures):
+    """Worker: applies `call` to batches from the work queue."""
+    try:
+        while True:
+            start = time.perf_counter()
+            batch = _get(work, stop)
+            if batch is _DONE or batch is _STOPPED:
+                return
+            ready = time.perf_counter()
+            result = call(batch)
+            done = time.perf_counter()
+            if not _put(results, result, stop):
+                return
+            stats.wait_time += (ready - start) + (time.perf_counter() - done)
+            stats.busy_time += done - ready
+            stats.batches += 1
+            stats.rows += len(batch)
+    except BaseException as err:  # Re-raised by the sink.
+        failures.append(err)
+        stop.set()
+    finally:
+        _put(results, _DONE, stop)
+
+
+def run_pipeline(source, process, sink=None, workers=4, processes=False,
+                 queue_size=None, stats=None):
+    """
+    Runs `process` over every batch of `source` on `workers` parallel
+    workers and hands the results to `sink`.
+
+    Args:
+        source (iterable): The batches to process, e.g.
+                           `stream_users_in_batches(1000)`. It is iterated
+                           (and closed) on the fetch thread.
+        process (callable): batch -> result. Use `map_rows` to apply a
+                            per-user function. With `processes=True` it
+                            must be picklable (a module-level function).
+        sink (callable | None): Called with each result on the caller's
+                                thread. None only counts the results.
+        workers (int): The number of parallel workers.
+        processes (bool): Run `process` in a process pool instead of on
+                          the worker threads.
+        queue_size (int | None): The capacity of each queue, in batches.
+                                 Defaults to `workers`.
+        stats (PipelineStats | None): Counters to fill in. A new one is
+                                      created when omitted.
+    Returns:
+        PipelineStats: The per-stage counters.
+    Raises:
+        The first exception raised by the source, `process` or `sink`,
+        after every stage has been stopped.
+    """
+    if workers <= 0:
+        raise ValueError("workers must be a positive integer")
+    stats = stats if stats is not None else PipelineStats()
+    queue_size = queue_size or workers
+    work = queue.Queue(maxsize=queue_size)
+    results = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    failures = []
+    worker_stats = [StageStats("workers") for _ in range(workers)]
+    executor = concurrent.futures.ProcessPoolExecutor(workers) if processes else None
+    call = process
+    if executor is not None:
+        call = lambda batch: executor.submit(process, batch).result()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=_fetch, name="pipeline-fetch", daemon=True,
+                                args=(source, work, stop, stats.fetch, failures, workers))]
+    threads += [threading.Thread(target=_work, name=f"pipeline-worker-{i}", daemon=True,
+                                 args=(call, work, results, stop, worker_stats[i], failures))
+                for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    try:
+        running = workers
+        while running:
+            start = time.perf_counter()
+            result = _get(results, stop)
+            if result is _STOPPED:
+                break
+            if result is _DONE:
+                running -= 1
+                continue
+            ready = time.perf_counter()
+            if sink is not None:
+                sink(result)
+            stats.sink.wait_time += ready - start
+            stats.sink.busy_time += time.perf_counter() - ready
+            stats.sink.batches += 1
+            stats.sink.rows += len(result) if hasattr(result, "__len__") else 1
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        for worker in worker_stats:
+            stats.workers.merge(worker)
+        stats.finish(time.perf_counter() - started)
+    if failures:
+        raise failures[0]
+    return stats
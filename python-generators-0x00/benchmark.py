@@ -0,0 +1,731 @@
+#!/usr/bin/python3
+"""
+benchmark.py
+
+Benchmarks for the 'user_data' generators.
+
+The benchmarks run against a synthetic copy of the 'user_data' table built
+with the schema from `seed.create_table`. By default the table lives in a
+local SQLite file (one per size, reused between runs), so no MySQL server
+is needed; `--backend mysql` runs against the existing 'ALX_prodev'
+database instead (the table is used as-is and `--sizes` is ignored).
+
+Usage:
+    $ python3 benchmark.py pagination --sizes 10000 1000000 10000000
+    $ python3 benchmark.py insert --rows 100000 --batch-size 5000 --workers 2 4
+    $ python3 benchmark.py formats --rows 1000000 --batch-size 10000
+    $ python3 benchmark.py prefetch --rows 100000 --page-size 1000 --consumer-ms 2
+    $ python3 benchmark.py cache --rows 1000000 --batch-size 10000
+    $ python3 benchmark.py instrumentation --rows 200000 --page-size 100
+    $ python3 benchmark.py suite --sizes 10000 100000 1000000 --json before.json
+    $ python3 benchmark.py suite --sizes 10000 100000 1000000 --compare before.json
+"""
+
+import argparse
+import csv
+import functools
+import gc
+import importlib
+import itertools
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+import seed
+import pagination
+import row_formats
+import aggregates
+import column_cache
+import instrumentation
+
+DEFAULT_DB_DIR = os.path.join(tempfile.gettempdir(), "alx_prodev_bench")
+
+
+def synthesize(path, rows, chunk_size=50000):
+    """
+    Creates (or reuses) a SQLite database at `path` holding `rows` synthetic
+    users in a 'user_data' table with the seed schema.
+
+    Args:
+        path (str): The SQLite database file.
+        rows (int): The number of rows the table should contain.
+        chunk_size (int): Rows inserted per transaction while generating.
+    Returns:
+        sqlite3.Connection: An open connection to the database.
+    """
+    connection = sqlite3.connect(path)
+    seed.create_table(connection)
+    seed.enable_change_tracking(connection)
+    existing = connection.execute("SELECT COUNT(*) FROM user_data").fetchone()[0]
+    if existing == rows:
+        return connection
+
+    connection.execute("DELETE FROM user_data")
+    users = synthetic_users(rows, rows)
+    while True:
+        batch = [user for _, user in zip(range(chunk_size), users)]
+        if not batch:
+            break
+        connection.executemany(
+            "INSERT INTO user_data (user_id, name, email, age) VALUES (?, ?, ?, ?)",
+            batch,
+        )
+        connection.commit()
+    return connection
+
+
+def synthetic_users(rows, seed_value=0):
+    """
+    Generator of `rows` deterministic synthetic `(user_id, name, email, age)`
+    tuples.
+    """
+    rng = random.Random(seed_value)
+    for i in range(rows):
+        user_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        yield (user_id, f"User {i}", f"user{i}@example.com", rng.randint(18, 90))
+
+
+def write_csv(path, rows, duplicate_ratio=0.0):
+    """
+    Writes a seed-style CSV file with `rows` data rows, of which roughly
+    `duplicate_ratio` repeat an earlier `user_id`.
+    """
+    rng = random.Random(rows)
+    seen = []
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(["user_id", "name", "email", "age"])
+        for user in synthetic_users(rows, rows):
+            if seen and rng.random() < duplicate_ratio:
+                writer.writerow(rng.choice(seen))
+                continue
+            writer.writerow(user)
+            if len(seen) < 10000:
+                seen.append(user)
+
+
+def open_backend(args, rows):
+    """
+    Opens the connection a benchmark should run against.
+
+    Args:
+        args (argparse.Namespace): The parsed command line.
+        rows (int): The table size to synthesize (SQLite only).
+    Returns:
+        A mysql.connector or sqlite3 connection.
+    """
+    if args.backend == "mysql":
+        return seed.connect_to_prodev()
+    os.makedirs(args.db_dir, exist_ok=True)
+    return synthesize(os.path.join(args.db_dir, f"user_data_{rows}.db"), rows)
+
+
+def timed(func, *args, **kwargs):
+    """
+    Calls `func` and returns `(result, elapsed_seconds)`.
+    """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def drain(pages):
+    """
+    Consumes an iterator of pages and returns the number of rows seen.
+    """
+    return sum(len(page) for page in pages)
+
+
+def bench_pagination(args):
+    """
+    Compares OFFSET and keyset pagination.
+
+    For every size it reports the latency of a single page fetched at the
+    start, the middle and the end of the table, and the time of a full scan.
+    Full OFFSET scans are quadratic, so they are skipped above
+    `--full-scan-limit` rows.
+    """
+    batches = importlib.import_module("1-batch_processing")
+    print(f"{'rows':>10} {'mode':>7} {'page@0':>10} {'page@50%':>10} "
+          f"{'page@end':>10} {'full scan':>11} {'rows/s':>12}")
+    for size in args.sizes:
+        connection = open_backend(args, size)
+        if not connection:
+            return
+        try:
+            total = connection.cursor()
+            total.execute("SELECT COUNT(*) FROM user_data")
+            rows = total.fetchone()[0]
+            total.close()
+
+            depths = [0, rows // 2, max(rows - args.page_size, 0)]
+            for mode in pagination.MODES:
+                latencies = []
+                for depth in depths:
+                    if mode == pagination.OFFSET:
+                        _, elapsed = timed(pagination.fetch_offset_page,
+                                           connection, args.page_size, depth)
+                    else:
+                        after = None
+                        if depth:
+                            # Look up the key to seek from (not timed).
+                            after = pagination.fetch_offset_page(
+                                connection, 1, depth - 1)[0]["user_id"]
+                        _, elapsed = timed(pagination.fetch_keyset_page,
+                                           connection, args.page_size, after)
+                    latencies.append(f"{elapsed * 1000:.2f}ms")
+
+                if mode == pagination.OFFSET and rows > args.full_scan_limit:
+                    scan, rate = "skipped", "-"
+                else:
+                    seen, elapsed = timed(drain, batches.stream_users_in_batches(
+                        args.page_size, mode=mode, connection=connection))
+                    scan, rate = f"{elapsed:.2f}s", f"{seen / elapsed:,.0f}"
+                print(f"{rows:>10} {mode:>7} {latencies[0]:>10} {latencies[1]:>10} "
+                      f"{latencies[2]:>10} {scan:>11} {rate:>12}")
+        finally:
+            connection.close()
+
+
+def bench_insert(args):
+    """
+    Compares the per-row `seed.insert_data` loop with `seed.bulk_insert_data`
+    loading the same CSV into an empty table, next to the time spent only
+    parsing the CSV (`seed.mmap_csv_batches`).
+
+    Only the SQLite backend is supported: the loaders write into
+    'user_data', which must not be the production table. SQLite runs
+    in-process, so it shows the parsing and statement overhead but not the
+    per-row network round trip that dominates the per-row loop on MySQL.
+    """
+    if args.backend != "sqlite":
+        print("The insert benchmark only runs against the SQLite backend.")
+        return
+    os.makedirs(args.db_dir, exist_ok=True)
+    data_file = os.path.join(args.db_dir, f"users_{args.rows}.csv")
+    write_csv(data_file, args.rows, args.duplicates)
+
+    path = os.path.join(args.db_dir, "insert_bench.db")
+    loaders = [
+        ("per-row", lambda conn: seed.insert_data(conn, data_file)),
+        (f"bulk/{args.batch_size}",
+         lambda conn: seed.bulk_insert_data(conn, data_file, args.batch_size)),
+    ]
+    for workers in args.workers:
+        connect = functools.partial(sqlite3.connect, path, timeout=60)
+        loaders.append((f"parallel/{workers}", functools.partial(
+            lambda workers, conn: seed.parallel_insert_data(
+                data_file, workers, args.batch_size, connect=connect), workers)))
+
+    print(f"{'loader':>12} {'seconds':>9} {'rows/s':>12}")
+    failed = False
+    _, elapsed = timed(drain, seed.mmap_csv_batches(data_file, args.batch_size,
+                                                    seed.LoadResult()))
+    print(f"{'parse only':>12} {elapsed:>9.2f} {args.rows / elapsed:>12,.0f}")
+    for name, load in loaders:
+        if os.path.exists(path):
+            os.remove(path)
+        connection = sqlite3.connect(path)
+        # Pausing the cyclic collector spares it rescanning the row tuples
+        # created by the parser; worker processes inherit the setting.
+        if args.no_gc:
+            gc.disable()
+        try:
+            seed.create_table(connection)
+            result, elapsed = timed(load, connection)
+        finally:
+            gc.enable()
+            connection.close()
+        if isinstance(result, seed.LoadResult) and not result.ok:
+            failed = True
+            print(f"{name:>12} FAILED: {result.error}")
+            continue
+        print(f"{name:>12} {elapsed:>9.2f} {args.rows / elapsed:>12,.0f}")
+    return 1 if failed else 0
+
+
+def batch_memory(connection, batch_size, row_format):
+    """
+    Returns the bytes allocated to hold one batch of `batch_size` rows in
+    `row_format`, measured with tracemalloc.
+    """
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        batch = pagination.fetch_keyset_page(connection, batch_size, None, row_format)
+        size = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del batch
+    return size
+
+
+def bench_formats(args):
+    """
+    Compares the row formats of row_formats.py: full-scan throughput of
+    `stream_users_in_batches` and the memory needed to hold one batch.
+    """
+    batches = importlib.import_module("1-batch_processing")
+    connection = open_backend(args, args.rows)
+    if not connection:
+        return
+    try:
+        print(f"{'format':>9} {'seconds':>9} {'rows/s':>12} {'bytes/row':>10}")
+        for row_format in row_formats.FORMATS:
+            seen, elapsed = timed(drain, batches.stream_users_in_batches(
+                args.batch_size, connection=connection, row_format=row_format))
+            size = batch_memory(connection, args.batch_size, row_format)
+            per_row = size / min(args.batch_size, seen) if seen else 0
+            print(f"{row_format:>9} {elapsed:>9.2f} {seen / elapsed:>12,.0f} "
+                  f"{per_row:>10,.0f}")
+    finally:
+        connection.close()
+
+
+def bench_prefetch(args):
+    """
+    Compares on-demand and read-ahead `lazy_pagination` with a consumer
+    that spends `--consumer-ms` per page (simulated with sleep, like an
+    enrichment call), next to the database-only and consumer-only times.
+    """
+    paging = importlib.import_module("2-lazy_paginate")
+    if args.backend == "mysql":
+        factory = seed.connect_to_prodev
+    else:
+        open_backend(args, args.rows).close()
+        path = os.path.join(args.db_dir, f"user_data_{args.rows}.db")
+        factory = functools.partial(sqlite3.connect, path, check_same_thread=False)
+
+    def consume(pages, work):
+        count = 0
+        for page in pages:
+            count += 1
+            if work:
+                time.sleep(args.consumer_ms / 1000)
+        return count
+
+    connection = factory()
+    if not connection:
+        return
+    try:
+        pages, db_only = timed(consume, paging.lazy_pagination(
+            args.page_size, connection=connection), False)
+        print(f"{'database only':>18} {db_only:>8.2f}s")
+        print(f"{'consumer only':>18} {pages * args.consumer_ms / 1000:>8.2f}s")
+        for depth in [0] + args.depths:
+            _, elapsed = timed(consume, paging.lazy_pagination(
+                args.page_size, connection=connection, prefetch=depth), True)
+            label = f"prefetch={depth}" if depth else "on demand"
+            print(f"{label:>18} {elapsed:>8.2f}s")
+    finally:
+        connection.close()
+
+
+def touch_rows(batches):
+    """
+    Reads every value of every columnar batch (decoding the strings of
+    memory-mapped batches) and returns the number of rows seen.
+    """
+    count = 0
+    for batch in batches:
+        for _ in batch.rows():
+            count += 1
+    return count
+
+
+def bench_cache(args):
+    """
+    Compares a scan and an age aggregation served by the database with the
+    same work served from a memory-mapped column_cache file: the cost of
+    the export, of re-validating a fresh cache, and of the warm scans.
+    """
+    ages = importlib.import_module("4-stream_ages")
+    connection = open_backend(args, args.rows)
+    if not connection:
+        return
+    path = os.path.join(args.db_dir, f"user_data_{args.rows}.cache")
+    try:
+        if os.path.exists(path):
+            os.remove(path)
+        print(f"{'step':>22} {'seconds':>9} {'rows/s':>12}")
+
+        def report(label, rows, elapsed):
+            rate = f"{rows / elapsed:>12,.0f}" if rows is not None else ""
+            print(f"{label:>22} {elapsed:>9.3f} {rate}")
+
+        rows, elapsed = timed(touch_rows, pagination.iter_pages(
+            connection, args.batch_size, row_format=row_formats.COLUMNAR))
+        report("database scan", rows, elapsed)
+        stats, elapsed = timed(lambda: aggregates.RunningStats().update(
+            ages.stream_user_ages(connection)))
+        report("database age stats", stats.count, elapsed)
+
+        rows, elapsed = timed(column_cache.export_cache, path, connection, args.batch_size)
+        report("export", rows, elapsed)
+        cache, elapsed = timed(column_cache.open_cache, path, connection)
+        report("open + validate", None, elapsed)
+        with cache:
+            rows, elapsed = timed(touch_rows, cache.batches(args.batch_size))
+            report("mmap scan", rows, elapsed)
+            stats, elapsed = timed(cache.age_stats)
+            report("mmap age stats", stats.count, elapsed)
+        print(f"cache file: {os.path.getsize(path):,} bytes")
+    finally:
+        connection.close()
+
+
+def best_of(repeats, func, *args):
+    """
+    Calls `func(*args)` `repeats` times and returns the fastest run's
+    `(result, elapsed_seconds)`.
+    """
+    return min((timed(func, *args) for _ in range(repeats)), key=lambda run: run[1])
+
+
+def raw_scan(connection):
+    """
+    Iterates `SELECT ... FROM user_data` on a plain dict cursor, the work
+    `stream_users` does without any instrumentation call at all.
+    """
+    cursor = row_formats.make_cursor(connection, row_formats.DICT)
+    try:
+        cursor.execute(f"SELECT {pagination.COLUMNS} FROM user_data")
+        return sum(1 for _ in cursor)
+    finally:
+        cursor.close()
+
+
+def null_call_cost(calls=200000):
+    """
+    Returns the seconds one disabled instrumentation call costs: creating
+    it and routing a connection, a cursor and an iterator through it.
+    """
+    connect = lambda: None
+    start = time.perf_counter()
+    for _ in range(calls):
+        call = instrumentation.call("noop")
+        call.connect(connect)
+        call.items(call.cursor(()))
+        call.finish()
+    return (time.perf_counter() - start) / calls
+
+
+def bench_instrumentation(args):
+    """
+    Measures the overhead of instrumentation.py: a full `stream_users` scan
+    and a `lazy_pagination` walk with instrumentation disabled and enabled,
+    against an uninstrumented cursor loop, plus the cost of one disabled
+    call.
+    """
+    streaming = importlib.import_module("0-stream_users")
+    paging = importlib.import_module("2-lazy_paginate")
+    connection = open_backend(args, args.rows)
+    if not connection:
+        return
+    was_enabled = instrumentation.is_enabled()
+    try:
+        print(f"{'run':>28} {'seconds':>9} {'rows/s':>12} {'overhead':>9}")
+        rows, baseline = best_of(args.repeats, raw_scan, connection)
+        print(f"{'raw cursor loop':>28} {baseline:>9.3f} {rows / baseline:>12,.0f}")
+        for label, work in (
+                ("stream_users", lambda: sum(1 for _ in streaming.stream_users(
+                    connection=connection))),
+                ("lazy_pagination", lambda: drain(paging.lazy_pagination(
+                    args.page_size, connection=connection)))):
+            reference = None
+            for enabled in (False, True):
+                instrumentation.enable() if enabled else instrumentation.disable()
+                rows, elapsed = best_of(args.repeats, work)
+                reference = reference or (baseline if label == "stream_users" else elapsed)
+                state = "enabled" if enabled else "disabled"
+                print(f"{label + ' (' + state + ')':>28} {elapsed:>9.3f} "
+                      f"{rows / elapsed:>12,.0f} {elapsed / reference - 1:>+9.1%}")
+        instrumentation.disable()
+        cost = null_call_cost()
+        _, page = best_of(args.repeats, pagination.fetch_keyset_page,
+                          connection, args.page_size)
+        print(f"disabled call: {cost * 1e6:.2f}us, "
+              f"{cost / page:.3%} of one {args.page_size}-row page query")
+        instrumentation.reset()
+        instrumentation.enable()
+        drain(paging.lazy_pagination(args.page_size, connection=connection))
+        print()
+        print(instrumentation.prometheus_text(), end="")
+    finally:
+        instrumentation.reset()
+        instrumentation.enable() if was_enabled else instrumentation.disable()
+        connection.close()
+
+
+def percentile(ordered, q):
+    """
+    Returns the nearest-rank `q`-th percentile (0-100) of a sorted list.
+    """
+    if not ordered:
+        return 0.0
+    return ordered[max(0, min(len(ordered) - 1, -(-len(ordered) * q // 100) - 1))]
+
+
+def pages_of(rows, page_size):
+    """
+    Groups an iterator of rows into lists of `page_size` rows, so that a
+    row-at-a-time generator can be timed per page like the paged ones.
+    """
+    rows = iter(rows)
+    while True:
+        page = list(itertools.islice(rows, page_size))
+        if not page:
+            return
+        yield page
+
+
+def measure(pages):
+    """
+    Consumes an iterator of pages, timing every `next()`.
+
+    Returns:
+        tuple: `(rows, elapsed_seconds, latencies)`, with one latency in
+               seconds per page.
+    """
+    latencies = []
+    rows = 0
+    pages = iter(pages)
+    started = time.perf_counter()
+    while True:
+        start = time.perf_counter()
+        try:
+            page = next(pages)
+        except StopIteration:
+            break
+        latencies.append(time.perf_counter() - start)
+        rows += len(page)
+    return rows, time.perf_counter() - started, latencies
+
+
+def suite_workloads(connection, page_size):
+    """
+    Returns the `(name, make_pages)` workloads of the suite. Each
+    `make_pages()` returns an iterator of pages over `connection`;
+    `average_age` yields one single-row "page" per call of the aggregate.
+    """
+    streaming = importlib.import_module("0-stream_users")
+    batches = importlib.import_module("1-batch_processing")
+    paging = importlib.import_module("2-lazy_paginate")
+    ages = importlib.import_module("4-stream_ages")
+
+    def average_age(pushdown):
+        mean = ages.aggregate_ages(("mean",), pushdown=pushdown, connection=connection)
+        yield [mean["mean"]]
+
+    return [
+        ("stream_users", lambda: pages_of(
+            streaming.stream_users(connection=connection), page_size)),
+        ("stream_users_in_batches", lambda: batches.stream_users_in_batches(
+            page_size, connection=connection)),
+        ("lazy_pagination", lambda: paging.lazy_pagination(
+            page_size, connection=connection)),
+        ("average_age", lambda: average_age(True)),
+        ("average_age (streamed)", lambda: average_age(False)),
+    ]
+
+
+def run_workload(make_pages, rows_in_table, repeats):
+    """
+    Runs one suite workload: `repeats` timed runs, of which the fastest
+    gives the throughput and all of them the page latencies, then one run
+    under tracemalloc for the peak memory (kept apart because tracing
+    slows allocation down).
+
+    Returns:
+        dict: The JSON-ready result.
+    """
+    latencies = []
+    best = None
+    for _ in range(repeats):
+        rows, elapsed, run = measure(make_pages())
+        latencies += run
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    try:
+        measure(make_pages())
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    latencies.sort()
+    return {
+        "table_rows": rows_in_table,
+        "rows": rows,
+        "pages": len(latencies) // repeats,
+        "seconds": round(best, 6),
+        "rows_per_second": round(rows_in_table / best, 1) if best else 0.0,
+        "peak_memory_bytes": peak,
+        "page_latency_ms": {"p50": round(percentile(latencies, 50) * 1000, 4),
+                            "p99": round(percentile(latencies, 99) * 1000, 4)},
+    }
+
+
+def suite_metadata(args):
+    """
+    Describes the run, so that two result files can be told apart.
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                                capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))
+                                ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "backend": args.backend, "page_size": args.page_size,
+            "repeats": args.repeats, "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version, "machine": platform.machine(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z")}
+
+
+def compare_results(baseline, results, threshold):
+    """
+    Prints the throughput change of every workload against a baseline
+    result file and returns the keys that got slower by more than
+    `threshold` (a fraction).
+    """
+    before = {(r["workload"], r["table_rows"]): r for r in baseline["results"]}
+    regressions = []
+    print(f"\nagainst {baseline['meta'].get('commit') or 'baseline'}:")
+    for result in results:
+        key = (result["workload"], result["table_rows"])
+        if key not in before or not before[key]["rows_per_second"]:
+            continue
+        change = result["rows_per_second"] / before[key]["rows_per_second"] - 1
+        flag = ""
+        if change < -threshold:
+            regressions.append(key)
+            flag = "  REGRESSION"
+        print(f"{key[0]:>26} {key[1]:>10} {change:>+9.1%}{flag}")
+    return regressions
+
+
+def bench_suite(args):
+    """
+    Runs `stream_users`, `stream_users_in_batches`, `lazy_pagination` and
+    `average_age` (pushed down and streamed) against every table size and
+    reports rows/s, peak traced memory and p50/p99 latency per page
+    (`--page-size` rows; one call for `average_age`).
+
+    With `--json PATH` the results are written as JSON, and with
+    `--compare PATH` they are checked against an earlier file; the exit
+    status is then 1 when a workload lost more than `--threshold` of its
+    throughput.
+    """
+    results = []
+    print(f"{'workload':>26} {'rows':>10} {'rows/s':>12} {'peak MB':>9} "
+          f"{'p50 ms':>9} {'p99 ms':>9}")
+    for size in args.sizes:
+        connection = open_backend(args, size)
+        if not connection:
+            return 1
+        try:
+            total = connection.cursor()
+            total.execute("SELECT COUNT(*) FROM user_data")
+            rows = total.fetchone()[0]
+            total.close()
+            for name, make_pages in suite_workloads(connection, args.page_size):
+                result = dict(workload=name, **run_workload(make_pages, rows, args.repeats))
+                results.append(result)
+                latency = result["page_latency_ms"]
+                print(f"{name:>26} {rows:>10} {result['rows_per_second']:>12,.0f} "
+                      f"{result['peak_memory_bytes'] / 2 ** 20:>9.2f} "
+                      f"{latency['p50']:>9.3f} {latency['p99']:>9.3f}")
+        finally:
+            connection.close()
+
+    report = {"meta": suite_metadata(args), "results": results}
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+            file.write("\n")
+        print(f"results written to {args.json}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+        if compare_results(baseline, results, args.threshold):
+            return 1
+    return 0
+
+
+def parse_args(argv=None):
+    """
+    Parses the benchmark command line.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--backend", choices=("sqlite", "mysql"), default="sqlite")
+    parser.add_argument("--db-dir", default=DEFAULT_DB_DIR,
+                        help="Directory for the synthetic SQLite databases.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    pages = commands.add_parser("pagination", help="OFFSET vs keyset pagination")
+    pages.add_argument("--sizes", type=int, nargs="+",
+                       default=[10000, 1000000, 10000000])
+    pages.add_argument("--page-size", type=int, default=1000)
+    pages.add_argument("--full-scan-limit", type=int, default=100000)
+    pages.set_defaults(run=bench_pagination)
+
+    insert = commands.add_parser("insert", help="per-row vs batched CSV loading")
+    insert.add_argument("--rows", type=int, default=100000)
+    insert.add_argument("--batch-size", type=int, default=5000)
+    insert.add_argument("--duplicates", type=float, default=0.3,
+                        help="Fraction of CSV rows repeating an earlier user_id.")
+    insert.add_argument("--workers", type=int, nargs="*", default=[],
+                        help="Also run parallel_insert_data with these worker counts.")
+    insert.add_argument("--no-gc", action="store_true",
+                        help="Pause the cyclic garbage collector during each load.")
+    insert.set_defaults(run=bench_insert)
+
+    formats = commands.add_parser("formats", help="dict vs tuple vs record vs columnar rows")
+    formats.add_argument("--rows", type=int, default=1000000)
+    formats.add_argument("--batch-size", type=int, default=10000)
+    formats.set_defaults(run=bench_formats)
+
+    ahead = commands.add_parser("prefetch", help="on-demand vs read-ahead pagination")
+    ahead.add_argument("--rows", type=int, default=100000)
+    ahead.add_argument("--page-size", type=int, default=1000)
+    ahead.add_argument("--consumer-ms", type=float, default=2.0,
+                       help="Simulated processing time per page.")
+    ahead.add_argument("--depths", type=int, nargs="+", default=[1, 4])
+    ahead.set_defaults(run=bench_prefetch)
+
+    cache = commands.add_parser("cache", help="database scans vs memory-mapped column cache")
+    cache.add_argument("--rows", type=int, default=1000000)
+    cache.add_argument("--batch-size", type=int, default=10000)
+    cache.set_defaults(run=bench_cache)
+
+    probes = commands.add_parser("instrumentation",
+                                 help="overhead of instrumentation.py, disabled and enabled")
+    probes.add_argument("--rows", type=int, default=200000)
+    probes.add_argument("--page-size", type=int, default=100)
+    probes.add_argument("--repeats", type=int, default=3)
+    probes.set_defaults(run=bench_instrumentation)
+
+    suite = commands.add_parser("suite", help="throughput, memory and page latency of "
+                                              "the generators, as JSON")
+    suite.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    suite.add_argument("--page-size", type=int, default=1000)
+    suite.add_argument("--repeats", type=int, default=3)
+    suite.add_argument("--json", metavar="PATH", help="Write the results to PATH.")
+    suite.add_argument("--compare", metavar="PATH",
+                       help="Compare against results written earlier with --json.")
+    suite.add_argument("--threshold", type=float, default=0.2,
+                       help="Throughput loss reported as a regression (default 20%%).")
+    suite.set_defaults(run=bench_suite)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    sys.exit(arguments.run(arguments))
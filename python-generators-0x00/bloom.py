@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+"""
+bloom.py
+
+A Bloom filter: a fixed-size set of keys answering "definitely not added"
+or "probably added".
+
+A filter sized for `capacity` keys with a target false-positive rate `p`
+uses m = -capacity * ln(p) / ln(2) ** 2 bits and k = m / capacity * ln(2)
+bit positions per key, e.g. about 1.2 MB and 7 positions for a million
+keys at 1%. Memory is fixed when the filter is created; adding more than
+`capacity` keys still works but raises the false-positive rate (see
+`false_positive_rate`).
+
+The k positions are derived from one 128-bit BLAKE2b digest of the key by
+double hashing (Kirsch & Mitzenmacher): position i is
+((h1 + i * h2) mod 2 ** 64) mod m. The filter therefore gives the same
+answers in every process, unlike the salted built-in `hash`, and
+`add_many` can compute the positions of a whole batch with NumPy.
+"""
+
+import hashlib
+import itertools
+import math
+
+try:
+    import numpy
+except ImportError:  # NumPy is optional; fall back to pure Python.
+    numpy = None
+
+MASK64 = (1 << 64) - 1
+
+
+class BloomFilter:
+    """
+    A Bloom filter of string keys.
+
+    Attributes:
+        capacity (int): The number of keys the filter was sized for.
+        error_rate (float): The target false-positive rate at `capacity`.
+        size (int): The number of bits.
+        hashes (int): The number of bit positions per key.
+        count (int): The number of keys added that were not (probably)
+                     present already.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate must be between 0 and 1")
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        self.size = max(8, int(math.ceil(-self.capacity * math.log(error_rate)
+                                         / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / self.capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = int.from_bytes(
+            hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest(), "little")
+        first = digest & MASK64
+        step = (digest >> 64) | 1
+        size = self.size
+        return [((first + i * step) & MASK64) % size for i in range(self.hashes)]
+
+    def __contains__(self, key):
+        bits = self.bits
+        for p in self._positions(key):
+            if not bits[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+    def add(self, key):
+        """
+        Adds a key to the filter.
+
+        Returns:
+            bool: True if the key was probably present already (every one
+                  of its bits was set), False if it was definitely new.
+        """
+        bits = self.bits
+        present = True
+        for p in self._positions(key):
+            mask = 1 << (p & 7)
+            if not bits[p >> 3] & mask:
+                bits[p >> 3] |= mask
+                present = False
+        if not present:
+            self.count += 1
+        return present
+
+    def add_many(self, keys):
+        """
+        Adds a batch of keys, with NumPy when it is installed.
+
+        Each key is checked against the filter as it was before the batch,
+        so a key repeated within the batch is reported as new every time.
+        `count` grows as if the keys were added one by one with `add`: by
+        the number of keys that set at least one bit.
+
+        Args:
+            keys (list[str]): The keys to add.
+        Returns:
+            list[bool]: For each key, whether it was probably present.
+        """
+        if numpy is None:
+            before = bytes(self.bits)
+            present = [self._present_in(before, key) for key in keys]
+            for key in keys:
+                self.add(key)
+            return present
+        if not keys:
+            return []
+        digests = numpy.frombuffer(b"".join(
+            hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest() for key in keys),
+            dtype="<u8").reshape(-1, 2)
+        steps = digests[:, 1:] | numpy.uint64(1)
+        positions = (digests[:, :1] + numpy.arange(self.hashes, dtype=numpy.uint64) * steps)
+        positions %= numpy.uint64(self.size)
+        index = (positions >> numpy.uint64(3)).astype(numpy.intp)
+        masks = numpy.left_shift(1, positions & numpy.uint64(7)).astype(numpy.uint8)
+        bits = numpy.frombuffer(self.bits, dtype=numpy.uint8)
+        was_set = (bits[index] & masks).astype(bool)
+        numpy.bitwise_or.at(bits, index.ravel(), masks.ravel())
+        # A key sets a bit if it is the first key of the batch holding one
+        # of the positions that were clear before the batch.
+        clear = ~was_set.ravel()
+        rows = numpy.repeat(numpy.arange(len(keys)), self.hashes)[clear]
+        _, first = numpy.unique(positions.ravel()[clear], return_index=True)
+        self.count += int(numpy.unique(rows[first]).size)
+        return was_set.all(axis=1).tolist()
+
+    def _present_in(self, bits, key):
+        for p in self._positions(key):
+            if not bits[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+    def update(self, keys):
+        """
+        Adds every key of an iterable, a chunk at a time.
+
+        Returns:
+            BloomFilter: self, to allow chaining.
+        """
+        keys = iter(keys)
+        while True:
+            chunk = list(itertools.islice(keys, 10000))
+            if not chunk:
+                return self
+            self.add_many(chunk)
+
+    @property
+    def false_positive_rate(self):
+        """The expected false-positive rate with `count` keys added."""
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+    def __repr__(self):
+        return (f"BloomFilter(capacity={self.capacity}, error_rate={self.error_rate}, "
+                f"count={self.count}, size={len(self.bits)} bytes)")
@@ -0,0 +1,357 @@
+#!/usr/bin/python3
+"""
+column_cache.py
+
+Columnar on-disk cache of the 'user_data' table.
+
+Jobs that scan the table again and again can export it once to a compact
+columnar file and serve later scans and aggregations from a memory map of
+that file, without a database round trip or a copy of the data:
+
+    with open_cache("user_data.cache") as cache:
+        stats = cache.age_stats()
+        for batch in cache.batches(10000):
+            ...
+
+File layout (native byte order, every section aligned to 8 bytes):
+
+    MAGIC
+    age             n C ints
+    <field>.offsets n + 1 int64 end offsets, for user_id, name and email
+    <field>.data    the UTF-8 strings of the column, back to back
+    metadata        JSON: row count, section positions, table fingerprint
+    trailer         int64 metadata offset, int64 metadata length, MAGIC
+
+Invalidation: the export records the table's fingerprint, its row count
+and largest `updated_at` (see incremental.py), taken before the export
+starts. Any insert or update raises `MAX(updated_at)` and any delete
+lowers the count, so `open_cache` re-exports whenever the fingerprint of
+the live table no longer matches. `MAX(updated_at)` is one lookup on the
+`updated_at` index, but InnoDB keeps no exact row count: `COUNT(*)` scans
+the smallest index, which is still far cheaper than re-exporting the
+table but grows with it.
+"""
+
+import json
+import mmap
+import os
+import shutil
+import sqlite3
+import struct
+import sys
+import tempfile
+from array import array
+
+import seed
+import pagination
+import row_formats
+import aggregates
+import mysql.connector
+
+MAGIC = b"UDCACHE1"
+TRAILER = struct.Struct("<qq8s")
+STRING_FIELDS = ("user_id", "name", "email")
+ALIGNMENT = 8
+
+
+class StringColumn:
+    """
+    A read-only column of strings stored as end offsets into a UTF-8 blob.
+
+    Both buffers are memoryviews of the cache's memory map; slicing returns
+    another StringColumn over the same buffers, and strings are only
+    decoded when they are read.
+    """
+
+    __slots__ = ("_offsets", "_data")
+
+    def __init__(self, offsets, data):
+        self._offsets = offsets
+        self._data = data
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError("StringColumn slices do not support a step")
+            return StringColumn(self._offsets[start:max(start, stop) + 1], self._data)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("StringColumn index out of range")
+        return str(self._data[self._offsets[index]:self._offsets[index + 1]], "utf-8")
+
+    def __iter__(self):
+        data = self._data
+        offsets = self._offsets
+        for start, end in zip(offsets, offsets[1:]):
+            yield str(data[start:end], "utf-8")
+
+    def __eq__(self, other):
+        try:
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        except TypeError:
+            return NotImplemented
+
+    def __repr__(self):
+        return f"StringColumn(rows={len(self)})"
+
+
+class ColumnCache:
+    """
+    A memory-mapped cache file written by `export_cache`.
+
+    Attributes:
+        path (str): The cache file.
+        rows (int): The number of rows.
+        fingerprint (dict): The table fingerprint taken at export time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = self._mmap
+        if len(buffer) < len(MAGIC) + TRAILER.size or buffer[:len(MAGIC)] != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"Not a user_data cache file: {path!r}")
+        offset, length, magic = TRAILER.unpack_from(buffer, len(buffer) - TRAILER.size)
+        if magic != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"Truncated user_data cache file: {path!r}")
+        view = sections = None
+        try:
+            metadata = json.loads(buffer[offset:offset + length])
+            if metadata["byteorder"] != sys.byteorder:
+                raise ValueError(f"written on a {metadata['byteorder']}-endian machine")
+            self.rows = metadata["rows"]
+            if not isinstance(self.rows, int) or self.rows < 0:
+                raise ValueError(f"bad row count {self.rows!r}")
+            self.fingerprint = metadata["fingerprint"]
+            view = memoryview(self._mmap)
+            sections = {name: view[start:start + size]
+                        for name, (start, size) in metadata["sections"].items()}
+            self._columns = {"age": sections["age"].cast(metadata["age_typecode"])}
+            for field in STRING_FIELDS:
+                self._columns[field] = StringColumn(sections[f"{field}.offsets"].cast("q"),
+                                                    sections[f"{field}.data"])
+        except (AttributeError, KeyError, TypeError, ValueError) as err:
+            # Drop every view of the map first, or it cannot be closed.
+            self._columns = view = sections = None
+            self._mmap.close()
+            raise ValueError(f"Unreadable user_data cache file {path!r}: {err!r}") from err
+
+    def column(self, field):
+        """
+        Returns a whole column without copying it: a memoryview of C ints
+        for "age", a StringColumn for the others.
+        """
+        if field not in row_formats.FIELDS:
+            raise ValueError(f"Unknown column: {field!r}")
+        return self._columns[field]
+
+    def batches(self, batch_size, columns=row_formats.FIELDS):
+        """
+        Generator yielding the cached rows as ColumnarBatch objects whose
+        columns are zero-copy slices of the memory map.
+
+        Args:
+            batch_size (int): Rows per batch.
+            columns (tuple): The columns to include; the others are None,
+                             as after a pipeline projection.
+        Yields:
+            ColumnarBatch: Up to `batch_size` rows.
+        """
+        if not isinstance(batch_size, int) or batch_size <= 0:
+            raise ValueError("batch_size must be a positive integer")
+        wanted = {field: self.column(field) for field in columns}
+        for start in range(0, self.rows, batch_size):
+            yield row_formats.ColumnarBatch.from_columns(
+                {field: column[start:start + batch_size] for field, column in wanted.items()})
+
+    def age_stats(self):
+        """
+        Returns the aggregates.RunningStats of the whole age column,
+        computed straight from the memory map.
+        """
+        return aggregates.RunningStats.from_buffer(self._columns["age"])
+
+    def is_fresh(self, connection):
+        """
+        Returns True if the table still has the fingerprint of the export.
+        """
+        return table_fingerprint(connection) == self.fingerprint
+
+    def close(self):
+        """
+        Unmaps the file. If batches or columns are still referenced the
+        mapping stays alive until they are garbage-collected.
+        """
+        self._columns = {}
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def __repr__(self):
+        return f"ColumnCache(path={self.path!r}, rows={self.rows})"
+
+
+def table_fingerprint(connection):
+    """
+    Returns the row count and largest `updated_at` of 'user_data', which
+    change whenever rows are inserted, updated or deleted. The count is an
+    index scan on InnoDB (see the module docstring).
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT COUNT(*), MAX(updated_at) FROM user_data")
+        count, updated_at = cursor.fetchone()
+    finally:
+        cursor.close()
+    return {"rows": count, "updated_at": None if updated_at is None else str(updated_at)}
+
+
+def _copy_section(source, target, sections, name):
+    """
+    Pads `target` to the section alignment, appends the spilled section
+    `source` and records its position.
+    """
+    target.write(b"\0" * (-target.tell() % ALIGNMENT))
+    start = target.tell()
+    source.seek(0)
+    shutil.copyfileobj(source, target)
+    sections[name] = [start, target.tell() - start]
+
+
+def export_cache(path, connection=None, batch_size=10000):
+    """
+    Writes the whole 'user_data' table to a columnar cache file.
+
+    The table is read with keyset pagination in columnar batches; each
+    column is spilled to its own temporary file as it arrives, so memory
+    use is bounded by one batch, and the sections are then assembled into
+    `path` atomically (via a temporary file and a rename).
+
+    Args:
+        path (str): The cache file to write.
+        connection: An optional open mysql.connector (or sqlite3)
+                    connection. When omitted one is opened with
+                    `seed.connect_to_prodev()` and closed when done.
+        batch_size (int): Rows fetched per query.
+    Returns:
+        int: The number of rows exported, or None if the export failed.
+    """
+    owns_connection = connection is None
+    spills = {}
+    temporary = f"{path}.tmp"
+    try:
+        if owns_connection:
+            connection = seed.connect_to_prodev()
+        if not connection:
+            print("Failed to connect to the database. Cannot export the cache.")
+            return None
+        fingerprint = table_fingerprint(connection)
+        spills = {name: tempfile.TemporaryFile() for name in ["age"] + [
+            f"{field}.{part}" for field in STRING_FIELDS for part in ("offsets", "data")]}
+        ends = dict.fromkeys(STRING_FIELDS, 0)
+        for field in STRING_FIELDS:
+            spills[f"{field}.offsets"].write(array("q", [0]).tobytes())
+        rows = 0
+        age_typecode = "i"
+        for batch in pagination.iter_pages(connection, batch_size,
+                                           row_format=row_formats.COLUMNAR):
+            age_typecode = batch.age.typecode
+            spills["age"].write(batch.age.tobytes())
+            for field in STRING_FIELDS:
+                encoded = [value.encode("utf-8") for value in getattr(batch, field)]
+                offsets = array("q")
+                end = ends[field]
+                for value in encoded:
+                    end += len(value)
+                    offsets.append(end)
+                ends[field] = end
+                spills[f"{field}.offsets"].write(offsets.tobytes())
+                spills[f"{field}.data"].write(b"".join(encoded))
+            rows += len(batch)
+
+        sections = {}
+        with open(temporary, "wb") as target:
+            target.write(MAGIC)
+            for name, spill in spills.items():
+                _copy_section(spill, target, sections, name)
+            metadata = json.dumps({
+                "rows": rows,
+                "fingerprint": fingerprint,
+                "byteorder": sys.byteorder,
+                "age_typecode": age_typecode,
+                "sections": sections,
+            }).encode("utf-8")
+            offset = target.tell()
+            target.write(metadata)
+            target.write(TRAILER.pack(offset, len(metadata), MAGIC))
+        os.replace(temporary, path)
+        return rows
+    except (mysql.connector.Error, sqlite3.Error) as err:
+        print(f"Database error while exporting the cache: {err}")
+        return None
+    except OSError as err:
+        print(f"Error writing the cache file '{path}': {err}")
+        return None
+    finally:
+        for spill in spills.values():
+            spill.close()
+        # Only left behind if the export failed before the rename.
+        if os.path.exists(temporary):
+            os.unlink(temporary)
+        if owns_connection and connection:
+            connection.close()
+
+
+def open_cache(path, connection=None, batch_size=10000):
+    """
+    Opens the cache at `path`, first (re-)exporting it if it is missing,
+    unreadable, or no longer matches the table's fingerprint.
+
+    Args:
+        path (str): The cache file.
+        connection: An optional open mysql.connector (or sqlite3)
+                    connection. When omitted one is opened with
+                    `seed.connect_to_prodev()` and closed when done.
+        batch_size (int): Rows fetched per query when exporting.
+    Returns:
+        ColumnCache: The open, fresh cache, or None if it could not be built.
+    """
+    owns_connection = connection is None
+    try:
+        if owns_connection:
+            connection = seed.connect_to_prodev()
+        if not connection:
+            print("Failed to connect to the database. Cannot validate the cache.")
+            return None
+        try:
+            cache = ColumnCache(path)
+        except (OSError, ValueError):
+            cache = None
+        if cache is not None:
+            if cache.is_fresh(connection):
+                return cache
+            cache.close()
+        if export_cache(path, connection, batch_size) is None:
+            return None
+        return ColumnCache(path)
+    except (mysql.connector.Error, sqlite3.Error) as err:
+        print(f"Database error while validating the cache: {err}")
+        return None
+    finally:
+        if owns_connection and connection:
+            connection.close()
@@ -0,0 +1,445 @@
+#!/usr/bin/python3
+"""
+index_advisor.py
+
+Schema and index advisor for the 'user_data' table.
+
+`seed.create_table` only indexes `user_id` (and `updated_at`), while the
+generators and the other projects of this repository also filter on
+`age`, read the age column on its own and look users up by `email`. The
+advisor:
+
+1. replays those query shapes (SHAPES) and records their plan (EXPLAIN)
+   and latency,
+2. proposes a secondary index for every shape whose plan scans the whole
+   table or sorts, extended into a covering index when the shape only
+   reads a column or two,
+3. applies the proposals as migrations (`seed.migrate`), replays the
+   shapes again and reverts every index that did not speed any of them up
+   by at least `min_speedup`,
+4. reports the before/after plan and latency of every shape, i.e. the
+   justification of each index kept.
+
+Usage:
+    $ python3 index_advisor.py                      # against ALX_prodev
+    $ python3 index_advisor.py --sqlite users.db --dry-run
+"""
+
+import argparse
+import sqlite3
+import statistics
+import time
+
+import seed
+import pagination
+import pipeline
+import row_formats
+import mysql.connector
+
+
+class QueryShape:
+    """
+    One query the repository runs against 'user_data'.
+
+    Attributes:
+        name (str): A short label for the report.
+        source (str): Where the query comes from.
+        build (callable): connection -> `(sql, params)`.
+        filters (tuple): `(column, kind)` pairs, kind being "eq" or "range".
+        order_by (tuple): The ORDER BY columns.
+        columns (tuple): The columns the query reads.
+    """
+
+    def __init__(self, name, source, build, filters=(), order_by=(),
+                 columns=row_formats.FIELDS):
+        self.name = name
+        self.source = source
+        self.build = build
+        self.filters = tuple(filters)
+        self.order_by = tuple(order_by)
+        self.columns = tuple(columns)
+
+    def __repr__(self):
+        return f"QueryShape({self.name!r})"
+
+
+def _sample(connection, column, rank=0.5):
+    """
+    Returns the value of `column` in the row at relative position `rank`
+    of the primary key order, to use as a realistic query parameter.
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT COUNT(*) FROM user_data")
+        count = cursor.fetchone()[0]
+        mark = seed.placeholder(connection)
+        cursor.execute(f"SELECT {column} FROM user_data ORDER BY user_id "
+                       f"LIMIT 1 OFFSET {mark}", (int(count * rank),))
+        row = cursor.fetchone()
+        return row[0] if row else None
+    finally:
+        cursor.close()
+
+
+def _median_rank(connection):
+    """Returns the OFFSET of the median age probe of 4-stream_ages.py."""
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT COUNT(age) FROM user_data")
+        return max(cursor.fetchone()[0] // 2 - 1, 0)
+    finally:
+        cursor.close()
+
+
+SHAPES = [
+    QueryShape(
+        "batch page, age > 25", "1-batch_processing.py batch_processing",
+        lambda c: pagination.keyset_query(seed.placeholder(c), 100, _sample(c, "user_id"),
+                                          (pipeline.where("age", ">", 25),)),
+        filters=(("age", "range"), ("user_id", "range")), order_by=("user_id",)),
+    QueryShape(
+        "users over 40", "python-context-async-perations-0x02 3-concurrent.py",
+        lambda c: (f"SELECT {pagination.COLUMNS} FROM user_data "
+                   f"WHERE age > {seed.placeholder(c)}", (40,)),
+        filters=(("age", "range"),)),
+    QueryShape(
+        "lookup by email", "user lookups by email address",
+        lambda c: (f"SELECT {pagination.COLUMNS} FROM user_data "
+                   f"WHERE email = {seed.placeholder(c)}", (_sample(c, "email"),)),
+        filters=(("email", "eq"),)),
+    QueryShape(
+        "stream ages", "4-stream_ages.py stream_user_ages",
+        lambda c: ("SELECT age FROM user_data", ()),
+        columns=("age",)),
+    QueryShape(
+        "age aggregates", "4-stream_ages.py aggregate_ages",
+        lambda c: ("SELECT COUNT(age), SUM(age), SUM(age * age), MIN(age), MAX(age) "
+                   "FROM user_data", ()),
+        columns=("age",)),
+    QueryShape(
+        "age percentile", "4-stream_ages.py aggregate_ages(percentiles=...)",
+        lambda c: (f"SELECT age FROM user_data ORDER BY age LIMIT 1 "
+                   f"OFFSET {seed.placeholder(c)}", (_median_rank(c),)),
+        order_by=("age",), columns=("age",)),
+]
+
+
+class Plan:
+    """
+    The parts of a query plan the advisor cares about.
+
+    Attributes:
+        access (str): "scan" (whole table), "index scan" (whole index) or
+                      "search" (index lookup or range).
+        indexes (set[str]): The indexes used.
+        covering (bool): The rows are read from the index alone.
+        sort (bool): The result has to be sorted after reading it.
+        detail (str): The raw plan, for the report.
+    """
+
+    def __init__(self, access, indexes=(), covering=False, sort=False, detail=""):
+        self.access = access
+        self.indexes = set(indexes)
+        self.covering = covering
+        self.sort = sort
+        self.detail = detail
+
+    def __repr__(self):
+        flags = [self.access] + sorted(self.indexes)
+        if self.covering:
+            flags.append("covering")
+        if self.sort:
+            flags.append("sort")
+        return " ".join(flags)
+
+
+def explain(connection, query, params):
+    """
+    Runs EXPLAIN (EXPLAIN QUERY PLAN on SQLite) on a query.
+
+    Returns:
+        Plan: The summarized plan.
+    """
+    cursor = connection.cursor()
+    try:
+        if isinstance(connection, sqlite3.Connection):
+            cursor.execute(f"EXPLAIN QUERY PLAN {query}", params)
+            details = [row[-1] for row in cursor.fetchall()]
+            return _sqlite_plan(details)
+        cursor.execute(f"EXPLAIN {query}", params)
+        rows = [dict(zip(cursor.column_names, row)) for row in cursor.fetchall()]
+        return _mysql_plan(rows)
+    finally:
+        cursor.close()
+
+
+def _sqlite_plan(details):
+    """Summarizes the detail lines of SQLite's EXPLAIN QUERY PLAN."""
+    access = "scan"
+    indexes = set()
+    covering = False
+    for detail in details:
+        words = detail.split()
+        if "INDEX" in words:
+            indexes.add(words[words.index("INDEX") + 1])
+            covering = covering or "COVERING" in words
+        if detail.startswith("SEARCH"):
+            access = "search"
+        elif detail.startswith("SCAN") and "INDEX" in words:
+            access = "index scan"
+    sort = any("TEMP B-TREE" in detail for detail in details)
+    return Plan(access, indexes, covering, sort, "; ".join(details))
+
+
+def _mysql_plan(rows):
+    """Summarizes the rows of MySQL's EXPLAIN."""
+    row = rows[0]
+    kind = row.get("type")
+    extra = row.get("Extra") or ""
+    access = {"ALL": "scan", "index": "index scan"}.get(kind, "search")
+    indexes = {row["key"]} if row.get("key") else set()
+    detail = f"type={kind} key={row.get('key')} rows={row.get('rows')} {extra}".strip()
+    return Plan(access, indexes, "Using index" in extra, "Using filesort" in extra, detail)
+
+
+def existing_indexes(connection):
+    """
+    Returns the column lists of the indexes on 'user_data', primary key
+    included, as a set of tuples.
+    """
+    cursor = connection.cursor()
+    try:
+        if isinstance(connection, sqlite3.Connection):
+            cursor.execute("PRAGMA index_list(user_data)")
+            names = [row[1] for row in cursor.fetchall()]
+            indexes = set()
+            for name in names:
+                cursor.execute(f"PRAGMA index_info({name})")
+                indexes.add(tuple(row[2] for row in sorted(cursor.fetchall())))
+            return indexes
+        cursor.execute("SHOW INDEX FROM user_data")
+        columns = {}
+        for row in cursor.fetchall():
+            row = dict(zip(cursor.column_names, row))
+            columns.setdefault(row["Key_name"], []).append(
+                (row["Seq_in_index"], row["Column_name"]))
+        return {tuple(name for _, name in sorted(parts)) for parts in columns.values()}
+    finally:
+        cursor.close()
+
+
+def propose(shape, plan):
+    """
+    Proposes the columns of an index for one shape, or returns None when
+    its plan already searches an index without sorting.
+
+    The key is the equality columns, then the ORDER BY columns (so rows
+    come out of the index already sorted) or, without an ORDER BY, the
+    range columns. Shapes reading one or two columns get them appended,
+    which makes the index covering.
+    """
+    if plan.access == "search" and not plan.sort:
+        return None
+    if plan.access == "index scan" and plan.covering and not plan.sort:
+        return None
+    key = [column for column, kind in shape.filters if kind == "eq"]
+    tail = shape.order_by or [column for column, kind in shape.filters if kind == "range"]
+    key += [column for column in tail if column not in key]
+    if len(shape.columns) <= 2:
+        key += [column for column in shape.columns if column not in key]
+    return tuple(key) or None
+
+
+def _covered(columns, indexes):
+    """True if some index in `indexes` starts with `columns`."""
+    return any(index[:len(columns)] == columns for index in indexes)
+
+
+def proposals(connection, plans):
+    """
+    Turns the per-shape proposals into index migrations.
+
+    Proposals already served by an existing index (the primary key
+    included), or by another proposal they are a prefix of, are dropped.
+
+    Args:
+        connection: A mysql.connector or sqlite3 connection.
+        plans (dict): `{QueryShape: Plan}`.
+    Returns:
+        list[seed.Migration]: One index migration per distinct proposal.
+    """
+    existing = existing_indexes(connection)
+    wanted = {}
+    for shape, plan in plans.items():
+        columns = propose(shape, plan)
+        if columns and not _covered(columns, existing):
+            wanted.setdefault(columns, []).append(shape.name)
+    for columns in list(wanted):
+        longer = [other for other in wanted if other != columns and other[:len(columns)] == columns]
+        if longer:
+            wanted[longer[0]].extend(wanted.pop(columns))
+    return [seed.index_migration("idx_user_data_" + "_".join(columns), columns,
+                                 "For: " + ", ".join(names))
+            for columns, names in wanted.items()]
+
+
+def measure(connection, query, params, runs=5):
+    """
+    Returns the median seconds taken to run a query and fetch all of its
+    rows, over `runs` runs after one warm-up run.
+    """
+    cursor = connection.cursor()
+    try:
+        timings = []
+        for _ in range(runs + 1):
+            start = time.perf_counter()
+            cursor.execute(query, params)
+            cursor.fetchall()
+            timings.append(time.perf_counter() - start)
+        return statistics.median(timings[1:])
+    finally:
+        cursor.close()
+
+
+class ShapeReport:
+    """
+    The before/after plan and latency of one query shape.
+    """
+
+    def __init__(self, shape, plan, latency):
+        self.shape = shape
+        self.plan_before = plan
+        self.before = latency
+        self.plan_after = plan
+        self.after = latency
+
+    @property
+    def speedup(self):
+        """before / after latency."""
+        return self.before / self.after if self.after else float("inf")
+
+
+class AdvisorReport:
+    """
+    The result of `advise`.
+
+    Attributes:
+        shapes (list[ShapeReport]): One entry per replayed shape.
+        proposed (list[seed.Migration]): Every index proposed.
+        kept (list[seed.Migration]): The indexes applied and kept.
+        reverted (list[seed.Migration]): The indexes applied, then reverted
+                                         because no shape got faster.
+    """
+
+    def __init__(self, shapes, proposed):
+        self.shapes = shapes
+        self.proposed = proposed
+        self.kept = []
+        self.reverted = []
+
+    def users_of(self, migration):
+        """The shape reports whose final plan uses `migration`'s index."""
+        return [report for report in self.shapes
+                if migration.name in report.plan_after.indexes]
+
+    def print(self):
+        """Prints the report."""
+        print(f"{'query':<22} {'before':>10} {'after':>10} {'speedup':>8}  plan before -> after")
+        for report in self.shapes:
+            print(f"{report.shape.name:<22} {report.before * 1000:>8.2f}ms "
+                  f"{report.after * 1000:>8.2f}ms {report.speedup:>7.1f}x  "
+                  f"{report.plan_before!r} -> {report.plan_after!r}")
+        for migration in self.kept:
+            users = self.users_of(migration)
+            faster = ", ".join(f"{r.shape.name} {r.speedup:.1f}x" for r in users if r.speedup >= 1)
+            print(f"kept     {migration.name} ({', '.join(migration.columns)}): {faster}")
+            slower = ", ".join(f"{r.shape.name} {r.speedup:.1f}x" for r in users if r.speedup < 1)
+            if slower:
+                print(f"         warning: the planner also picks it where it is slower: {slower}")
+        for migration in self.reverted:
+            print(f"reverted {migration.name} ({', '.join(migration.columns)}): "
+                  f"no query got faster ({migration.description})")
+        if not self.proposed:
+            print("No index proposed: every query already uses a suitable index.")
+
+
+def _replay(connection, shapes, runs):
+    """Returns `{shape: (sql, params, plan, latency)}` for every shape."""
+    results = {}
+    for shape in shapes:
+        query, params = shape.build(connection)
+        results[shape] = (query, params, explain(connection, query, params),
+                          measure(connection, query, params, runs))
+    return results
+
+
+def advise(connection, shapes=None, runs=5, apply=True, min_speedup=1.2):
+    """
+    Replays the query shapes, proposes indexes and, with `apply`, applies
+    them through `seed.migrate`, keeping only those that made at least one
+    shape `min_speedup` times faster.
+
+    Args:
+        connection: A mysql.connector or sqlite3 connection.
+        shapes (list[QueryShape] | None): Defaults to SHAPES.
+        runs (int): Timed runs per query (the median is reported).
+        apply (bool): Apply and evaluate the proposals (False only
+                      explains and proposes).
+        min_speedup (float): The speedup an index must bring to be kept.
+    Returns:
+        AdvisorReport: Plans, latencies and the fate of every proposal.
+    """
+    shapes = SHAPES if shapes is None else shapes
+    before = _replay(connection, shapes, runs)
+    reports = [ShapeReport(shape, plan, latency)
+               for shape, (_, _, plan, latency) in before.items()]
+    report = AdvisorReport(reports, proposals(
+        connection, {shape: result[2] for shape, result in before.items()}))
+    if not apply or not report.proposed:
+        return report
+
+    applied = set(seed.migrate(connection, report.proposed) or ())
+    while True:
+        after = _replay(connection, shapes, runs)
+        for shape_report in reports:
+            _, _, shape_report.plan_after, shape_report.after = after[shape_report.shape]
+        useless = [migration for migration in report.proposed
+                   if migration.name in applied and migration not in report.reverted
+                   and not any(r.speedup >= min_speedup for r in report.users_of(migration))]
+        if not useless:
+            break
+        for migration in useless:
+            seed.revert(connection, migration)
+            report.reverted.append(migration)
+    report.kept = [migration for migration in report.proposed
+                   if migration.name in applied and migration not in report.reverted]
+    return report
+
+
+def main(argv=None):
+    """
+    Runs the advisor from the command line and prints its report.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--sqlite", metavar="PATH",
+                        help="Advise on a SQLite database instead of ALX_prodev.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--min-speedup", type=float, default=1.2)
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Only explain and propose; do not change the schema.")
+    args = parser.parse_args(argv)
+
+    connection = sqlite3.connect(args.sqlite) if args.sqlite else seed.connect_to_prodev()
+    if not connection:
+        return
+    try:
+        advise(connection, runs=args.runs, apply=not args.dry_run,
+               min_speedup=args.min_speedup).print()
+    except (mysql.connector.Error, sqlite3.Error) as err:
+        print(f"Database error while advising: {err}")
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
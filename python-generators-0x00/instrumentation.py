@@ -0,0 +1,386 @@
+#!/usr/bin/python3
+"""
+instrumentation.py
+
+Per-call timings, row counts and byte counts for the data-layer functions
+(`stream_users`, `paginate_users`, `lazy_pagination`, `insert_data`,
+`bulk_insert_data`, ...), grouped by function name:
+
+    instrumentation.enable()
+    for user in stream_users():
+        ...
+    instrumentation.snapshot()["stream_users"]["seconds"]["fetch"]
+    print(instrumentation.prometheus_text())
+
+Each instrumented call records the seconds spent in four phases:
+
+- connect: opening the database connection;
+- execute: running statements (`cursor.execute` / `executemany`);
+- fetch: reading result rows off the cursor;
+- yield: for generators, the time the consumer held each item before
+  asking for the next one.
+
+Rows read, rows written and an estimate of the payload bytes read and
+sent are counted alongside.
+
+Instrumentation is off by default (or on with the environment variable
+USER_DATA_INSTRUMENTATION=1). While it is off, `call()` returns a shared
+no-op object whose methods hand back the connection, cursor or iterator
+unchanged, so a call costs a few attribute lookups and rows cost nothing.
+While it is on, cursors are wrapped to time every statement and fetch;
+rows are counted exactly and their bytes estimated from a sample.
+`benchmark.py instrumentation` measures both.
+"""
+
+import os
+import threading
+import time
+
+from array import array
+
+# Phases timed for every call, in the order they are reported.
+PHASES = ("connect", "execute", "fetch", "yield")
+
+# Read bytes are estimated from every SAMPLE_EVERY-th row, scaled up.
+SAMPLE_EVERY = 32
+
+_enabled = os.getenv("USER_DATA_INSTRUMENTATION", "") not in ("", "0")
+_lock = threading.Lock()
+_registry = {}
+
+
+def enable():
+    """Starts recording calls."""
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """Stops recording calls. Recorded numbers are kept until `reset`."""
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    """Returns True while calls are being recorded."""
+    return _enabled
+
+
+def reset():
+    """Forgets every recorded call."""
+    with _lock:
+        _registry.clear()
+
+
+def payload_size(value):
+    """
+    Estimates the bytes of a row, page or parameter tuple: the length of
+    every string and bytes value plus 8 bytes per number.
+    """
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(map(payload_size, value.values()))
+    if isinstance(value, (list, tuple)):
+        return sum(map(payload_size, value))
+    if isinstance(value, array):
+        return len(value) * value.itemsize
+    if value is None:
+        return 0
+    columns = getattr(value, "columns", None)
+    if callable(columns):  # row_formats.ColumnarBatch
+        return sum(payload_size(column) for column in columns().values())
+    slots = getattr(value, "__slots__", None)
+    if slots:  # row_formats.UserRecord
+        return sum(payload_size(getattr(value, name)) for name in slots)
+    return 8
+
+
+def rows_size(rows):
+    """
+    Estimates the payload bytes of a list of rows from every SAMPLE_EVERY-th
+    row, so that counting costs a fraction of reading the rows.
+    """
+    sample = rows[::SAMPLE_EVERY]
+    if not sample:
+        return 0
+    return payload_size(sample) * len(rows) // len(sample)
+
+
+class FunctionStats:
+    """
+    The totals recorded for one function name.
+
+    Attributes:
+        calls (int): Finished calls.
+        errors (int): Calls that ended with a database or other error.
+        rows (int): Rows read from cursors.
+        rows_written (int): Rows affected by statements without results.
+        bytes_read (int): Estimated payload bytes of the rows read.
+        bytes_sent (int): Estimated payload bytes of statement parameters.
+        seconds (dict): Seconds per phase (see PHASES).
+        total_seconds (float): Wall-clock seconds of the calls.
+        max_seconds (float): The slowest call.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.rows_written = 0
+        self.bytes_read = 0
+        self.bytes_sent = 0
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def as_dict(self):
+        """Returns the totals as a plain dict."""
+        return {"calls": self.calls, "errors": self.errors, "rows": self.rows,
+                "rows_written": self.rows_written, "bytes_read": self.bytes_read,
+                "bytes_sent": self.bytes_sent, "seconds": dict(self.seconds),
+                "total_seconds": self.total_seconds, "max_seconds": self.max_seconds}
+
+
+class InstrumentedCursor:
+    """
+    A cursor wrapper that times `execute`, `executemany` and every fetch
+    (including iteration) into a Call, and counts rows and bytes. Other
+    attributes are passed through to the wrapped cursor.
+    """
+
+    __slots__ = ("_cursor", "_call")
+
+    def __init__(self, cursor, call):
+        self._cursor = cursor
+        self._call = call
+
+    def _written(self):
+        if self._cursor.description is None and self._cursor.rowcount > 0:
+            self._call.rows_written += self._cursor.rowcount
+
+    def execute(self, *args, **kwargs):
+        start = time.perf_counter()
+        result = self._cursor.execute(*args, **kwargs)
+        call = self._call
+        call.seconds["execute"] += time.perf_counter() - start
+        if len(args) > 1:
+            call.bytes_sent += payload_size(args[1])
+        self._written()
+        return self if result is self._cursor else result
+
+    def executemany(self, query, seq_params, *args, **kwargs):
+        if not isinstance(seq_params, (list, tuple)):
+            seq_params = list(seq_params)
+        start = time.perf_counter()
+        result = self._cursor.executemany(query, seq_params, *args, **kwargs)
+        call = self._call
+        call.seconds["execute"] += time.perf_counter() - start
+        call.bytes_sent += payload_size(seq_params)
+        self._written()
+        return self if result is self._cursor else result
+
+    def _fetched(self, start, rows):
+        call = self._call
+        call.seconds["fetch"] += time.perf_counter() - start
+        if isinstance(rows, list):
+            call.rows += len(rows)
+            call.bytes_read += rows_size(rows)
+        return rows
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._fetched(start, [] if row is None else [row])
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        start = time.perf_counter()
+        return self._fetched(start, self._cursor.fetchmany(*args, **kwargs))
+
+    def fetchall(self):
+        start = time.perf_counter()
+        return self._fetched(start, self._cursor.fetchall())
+
+    def __iter__(self):
+        # Rows are not timed one by one: the fetch time is the time spent
+        # iterating minus the consumer's time recorded by `Call.items`.
+        call = self._call
+        seconds = call.seconds
+        start = time.perf_counter()
+        consumer = seconds["yield"]
+        count = 0
+        sampled = 0
+        try:
+            for row in self._cursor:
+                if not count % SAMPLE_EVERY:
+                    sampled += payload_size(row)
+                count += 1
+                yield row
+        finally:
+            seconds["fetch"] += (time.perf_counter() - start) - (seconds["yield"] - consumer)
+            call.rows += count
+            if count:
+                call.bytes_read += sampled * count // ((count - 1) // SAMPLE_EVERY + 1)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class Call:
+    """
+    One instrumented call of a data-layer function, created by `call()`.
+    Its numbers are added to the function's FunctionStats by `finish`.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+        self.rows = 0
+        self.rows_written = 0
+        self.bytes_read = 0
+        self.bytes_sent = 0
+        self.failed = False
+        self.finished = False
+
+    def connect(self, factory, *args, **kwargs):
+        """Opens a connection with `factory` and times the connect phase."""
+        start = time.perf_counter()
+        try:
+            return factory(*args, **kwargs)
+        finally:
+            self.seconds["connect"] += time.perf_counter() - start
+
+    def cursor(self, cursor):
+        """Returns `cursor` wrapped to record into this call."""
+        return InstrumentedCursor(cursor, self)
+
+    def items(self, iterable):
+        """
+        Generator passing the items of `iterable` through, timing how long
+        the consumer holds each one (the yield phase). Wrap the outermost
+        iterator a generator yields from, so the fetch time of iterated
+        cursors excludes the consumer's time.
+        """
+        seconds = self.seconds
+        for item in iterable:
+            start = time.perf_counter()
+            yield item
+            seconds["yield"] += time.perf_counter() - start
+
+    def error(self, err=None):
+        """Marks the call as failed."""
+        self.failed = True
+
+    def finish(self):
+        """Adds the call to its function's totals (once)."""
+        if self.finished:
+            return
+        self.finished = True
+        elapsed = time.perf_counter() - self.started
+        with _lock:
+            stats = _registry.get(self.name)
+            if stats is None:
+                stats = _registry[self.name] = FunctionStats()
+            stats.calls += 1
+            stats.errors += self.failed
+            stats.rows += self.rows
+            stats.rows_written += self.rows_written
+            stats.bytes_read += self.bytes_read
+            stats.bytes_sent += self.bytes_sent
+            for phase, seconds in self.seconds.items():
+                stats.seconds[phase] += seconds
+            stats.total_seconds += elapsed
+            stats.max_seconds = max(stats.max_seconds, elapsed)
+
+
+class _NullCall:
+    """The call returned while instrumentation is disabled: does nothing."""
+
+    __slots__ = ()
+
+    def connect(self, factory, *args, **kwargs):
+        return factory(*args, **kwargs)
+
+    def cursor(self, cursor):
+        return cursor
+
+    def items(self, iterable):
+        return iterable
+
+    def error(self, err=None):
+        pass
+
+    def finish(self):
+        pass
+
+
+NULL_CALL = _NullCall()
+
+
+def call(name):
+    """
+    Starts recording one call of the function `name`.
+
+    Returns:
+        Call: A recorder to route the connection, cursors and yielded items
+              through, and to `finish` when the call ends. While
+              instrumentation is disabled, the shared NULL_CALL.
+    """
+    if not _enabled:
+        return NULL_CALL
+    return Call(name)
+
+
+def snapshot():
+    """
+    Returns the recorded totals.
+
+    Returns:
+        dict: `{function name: FunctionStats.as_dict()}`.
+    """
+    with _lock:
+        return {name: stats.as_dict() for name, stats in _registry.items()}
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text(prefix="user_data"):
+    """
+    Renders the recorded totals in the Prometheus text exposition format,
+    one series per function (and phase).
+
+    Returns:
+        str: The exposition, ending with a newline.
+    """
+    counters = (
+        ("calls_total", "Instrumented calls.", "calls"),
+        ("errors_total", "Calls that ended with an error.", "errors"),
+        ("rows_read_total", "Rows read from cursors.", "rows"),
+        ("rows_written_total", "Rows affected by write statements.", "rows_written"),
+        ("bytes_read_total", "Estimated payload bytes read.", "bytes_read"),
+        ("bytes_sent_total", "Estimated payload bytes of statement parameters.",
+         "bytes_sent"),
+    )
+    stats = snapshot()
+    lines = []
+    for suffix, help_text, key in counters:
+        lines += [f"# HELP {prefix}_{suffix} {help_text}",
+                  f"# TYPE {prefix}_{suffix} counter"]
+        lines += [f'{prefix}_{suffix}{{function="{_escape(name)}"}} {values[key]}'
+                  for name, values in sorted(stats.items())]
+    lines += [f"# HELP {prefix}_phase_seconds_total Seconds spent per call phase.",
+              f"# TYPE {prefix}_phase_seconds_total counter"]
+    for name, values in sorted(stats.items()):
+        lines += [f'{prefix}_phase_seconds_total{{function="{_escape(name)}",'
+                  f'phase="{phase}"}} {values["seconds"][phase]:.6f}' for phase in PHASES]
+    lines += [f"# HELP {prefix}_call_seconds Wall-clock seconds per call.",
+              f"# TYPE {prefix}_call_seconds summary"]
+    for name, values in sorted(stats.items()):
+        label = f'{{function="{_escape(name)}"}}'
+        lines += [f"{prefix}_call_seconds_sum{label} {values['total_seconds']:.6f}",
+                  f"{prefix}_call_seconds_count{label} {values['calls']}"]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,426 @@
+#!/usr/bin/python3
+"""
+pagination.py
+
+Shared paging engine for the generators that walk the 'user_data' table
+(`stream_users_in_batches` in 1-batch_processing.py and `lazy_pagination`
+in 2-lazy_paginate.py).
+
+Two modes are supported:
+- "offset": the original `LIMIT n OFFSET k` query. The database has to
+  walk past `k` rows before returning the page, so each page costs
+  O(offset) and a full scan costs O(rows^2 / page_size).
+- "keyset": seeks on the `user_id` primary key
+  (`WHERE user_id > last_seen ORDER BY user_id LIMIT n`). Every page is an
+  index range scan starting right after the previous page, so each page
+  costs O(page_size) no matter how deep into the table it is.
+
+Keyset scans can be resumed with an opaque cursor token (see
+`encode_cursor`, `decode_cursor` and `cursor_for`), e.g. after a crash
+or from another process.
+
+`PaginationStats` records how many pages and rows a scan produced and how
+long was spent connecting versus querying.
+
+Pages can be produced in any of the row formats from row_formats.py, and
+filtered in the database with predicates from pipeline.py (`where=`).
+
+`prefetch` reads pages ahead on a background thread so that database
+latency overlaps with the consumer's processing time.
+"""
+
+import base64
+import json
+import queue
+import threading
+import time
+
+import seed
+import row_formats
+import instrumentation
+
+OFFSET = "offset"
+KEYSET = "keyset"
+MODES = (OFFSET, KEYSET)
+
+COLUMNS = "user_id, name, email, age"
+
+
+class PaginationStats:
+    """
+    Counters filled in by a paging scan.
+
+    Attributes:
+        connects (int): Number of database connections opened.
+        connect_time (float): Seconds spent opening connections.
+        pages (int): Number of non-empty pages fetched.
+        rows (int): Total number of rows fetched.
+        query_time (float): Seconds spent executing page queries and
+                            fetching their rows.
+    """
+
+    def __init__(self):
+        self.connects = 0
+        self.connect_time = 0.0
+        self.pages = 0
+        self.rows = 0
+        self.query_time = 0.0
+
+    def connect(self, factory):
+        """
+        Opens a connection with `factory()` and records the time it took.
+
+        Args:
+            factory (callable): A zero-argument connection factory such as
+                                `seed.connect_to_prodev`.
+        Returns:
+            The connection returned by `factory` (which may be None).
+        """
+        start = time.perf_counter()
+        connection = factory()
+        self.connect_time += time.perf_counter() - start
+        if connection:
+            self.connects += 1
+        return connection
+
+    def __repr__(self):
+        return (f"PaginationStats(pages={self.pages}, rows={self.rows}, "
+                f"connects={self.connects}, "
+                f"connect_time={self.connect_time:.4f}s, "
+                f"query_time={self.query_time:.4f}s)")
+
+
+def encode_cursor(last_user_id):
+    """
+    Encodes the last `user_id` seen by a keyset scan into a resume token.
+
+    Args:
+        last_user_id (str): The `user_id` of the last row already consumed.
+    Returns:
+        str: A URL-safe token that can be passed back as `cursor_token`.
+    """
+    payload = json.dumps({"after": last_user_id}).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii")
+
+
+def decode_cursor(token):
+    """
+    Decodes a resume token produced by `encode_cursor`.
+
+    Args:
+        token (str | None): The token to decode. None means "from the start".
+    Returns:
+        str | None: The `user_id` to resume after, or None.
+    Raises:
+        ValueError: If the token is malformed or does not hold a `user_id`.
+    """
+    if token is None:
+        return None
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+        after = payload["after"]
+    except (ValueError, TypeError, KeyError, AttributeError) as err:
+        raise ValueError(f"Invalid pagination cursor: {token!r}") from err
+    if not isinstance(after, str):
+        raise ValueError(f"Invalid pagination cursor: {token!r}")
+    return after
+
+
+def cursor_for(page):
+    """
+    Returns the token that resumes a keyset scan right after `page`.
+
+    Args:
+        page: A page yielded by one of the paging generators, in any row
+              format.
+    Returns:
+        str | None: The resume token, or None for an empty page.
+    """
+    if not page:
+        return None
+    return encode_cursor(row_formats.last_user_id(page))
+
+
+def _where_sql(where, mark, extra=()):
+    """
+    Builds a WHERE clause from pushed-down predicates (objects with a
+    `sql(mark)` method returning `(fragment, params)`, see pipeline.py) plus
+    `extra` `(fragment, params)` pairs.
+
+    Returns:
+        tuple[str, tuple]: The clause (empty if there are no conditions) and
+                           its parameters.
+    """
+    fragments = []
+    params = []
+    for fragment, values in [predicate.sql(mark) for predicate in where] + list(extra):
+        fragments.append(fragment)
+        params.extend(values)
+    if not fragments:
+        return "", ()
+    return " WHERE " + " AND ".join(fragments), tuple(params)
+
+
+def offset_query(mark, page_size, offset, where=()):
+    """
+    Builds the `LIMIT ... OFFSET ...` page query.
+
+    Args:
+        mark (str): The driver's parameter marker (see `seed.placeholder`).
+        page_size (int): The maximum number of rows to return.
+        offset (int): The number of (matching) rows to skip.
+        where (iterable): Predicates to push down into the WHERE clause.
+    Returns:
+        tuple[str, tuple]: The SQL text and its parameters.
+    """
+    clause, params = _where_sql(where, mark)
+    return (f"SELECT {COLUMNS} FROM user_data{clause} LIMIT {mark} OFFSET {mark}",
+            params + (page_size, offset))
+
+
+def keyset_query(mark, page_size, after=None, where=()):
+    """
+    Builds the keyset page query seeking after the `user_id` `after`.
+
+    Args:
+        mark (str): The driver's parameter marker (see `seed.placeholder`).
+        page_size (int): The maximum number of rows to return.
+        after (str | None): Return rows with `user_id` strictly greater than
+                            this value. None starts from the first row.
+        where (iterable): Predicates to push down into the WHERE clause.
+    Returns:
+        tuple[str, tuple]: The SQL text and its parameters.
+    """
+    seek = [] if after is None else [(f"user_id > {mark}", (after,))]
+    clause, params = _where_sql(where, mark, seek)
+    return (f"SELECT {COLUMNS} FROM user_data{clause} ORDER BY user_id LIMIT {mark}",
+            params + (page_size,))
+
+
+def fetch_offset_page(connection, page_size, offset, row_format=row_formats.DICT,
+                      where=(), call=instrumentation.NULL_CALL):
+    """
+    Fetches one page using `LIMIT ... OFFSET ...`.
+
+    Args:
+        connection: An open mysql.connector (or sqlite3) connection.
+        page_size (int): The maximum number of rows to return.
+        offset (int): The number of (matching) rows to skip.
+        row_format (str): One of row_formats.FORMATS.
+        where (iterable): Predicates to push down into the WHERE clause.
+        call (instrumentation.Call): Records the query's timings and rows.
+    Returns:
+        The rows of the page in `row_format` (a list of dicts by default).
+    """
+    query, params = offset_query(seed.placeholder(connection), page_size, offset, where)
+    cursor = call.cursor(row_formats.make_cursor(connection, row_format))
+    try:
+        cursor.execute(query, params)
+        return row_formats.shape(cursor.fetchall(), row_format)
+    finally:
+        cursor.close()
+
+
+def fetch_keyset_page(connection, page_size, after=None, row_format=row_formats.DICT,
+                      where=(), call=instrumentation.NULL_CALL):
+    """
+    Fetches one page by seeking on the `user_id` primary key.
+
+    Args:
+        connection: An open mysql.connector (or sqlite3) connection.
+        page_size (int): The maximum number of rows to return.
+        after (str | None): Return rows with `user_id` strictly greater than
+                            this value. None starts from the first row.
+        row_format (str): One of row_formats.FORMATS.
+        where (iterable): Predicates to push down into the WHERE clause.
+        call (instrumentation.Call): Records the query's timings and rows.
+    Returns:
+        The rows of the page ordered by `user_id`, in `row_format`.
+    """
+    query, params = keyset_query(seed.placeholder(connection), page_size, after, where)
+    cursor = call.cursor(row_formats.make_cursor(connection, row_format))
+    try:
+        cursor.execute(query, params)
+        return row_formats.shape(cursor.fetchall(), row_format)
+    finally:
+        cursor.close()
+
+
+def check_scan(page_size, mode, cursor_token, row_format):
+    """
+    Validates the arguments of a paging scan.
+
+    Raises:
+        ValueError: On an unknown mode or row format, a non-positive page
+                    size, or a cursor token used with offset mode.
+    """
+    row_formats.check_format(row_format)
+    if mode not in MODES:
+        raise ValueError(f"Unknown pagination mode: {mode!r}")
+    if page_size <= 0:
+        raise ValueError("page_size must be a positive integer")
+    if mode == OFFSET and cursor_token is not None:
+        raise ValueError("cursor_token is only supported in keyset mode")
+
+
+def iter_pages(connection, page_size, mode=KEYSET, cursor_token=None, stats=None,
+               row_format=row_formats.DICT, where=(), call=instrumentation.NULL_CALL):
+    """
+    Generator that walks the whole 'user_data' table page by page over an
+    already open connection.
+
+    Args:
+        connection: An open mysql.connector (or sqlite3) connection.
+        page_size (int): The number of rows per page.
+        mode (str): "keyset" (default) or "offset".
+        cursor_token (str | None): Resume token from `cursor_for`. Only
+                                   valid in keyset mode.
+        stats (PaginationStats | None): Counters to update with the number
+                                        of pages, rows and query time.
+        row_format (str): One of row_formats.FORMATS.
+        where (iterable): Predicates to push down into the WHERE clause, so
+                          rows that do not match never leave the database.
+        call (instrumentation.Call): Records the timings and rows of every
+                                     page query.
+    Yields:
+        Non-empty pages of user rows in `row_format`.
+    Raises:
+        ValueError: On an unknown mode or row format, a non-positive page
+                    size, or a cursor token used with offset mode.
+    """
+    check_scan(page_size, mode, cursor_token, row_format)
+    where = tuple(where)
+    after = decode_cursor(cursor_token)
+    offset = 0
+    while True:
+        start = time.perf_counter()
+        if mode == KEYSET:
+            page = fetch_keyset_page(connection, page_size, after, row_format, where, call)
+        else:
+            page = fetch_offset_page(connection, page_size, offset, row_format, where, call)
+        if stats is not None:
+            stats.query_time += time.perf_counter() - start
+        if not page:
+            break
+        if stats is not None:
+            stats.pages += 1
+            stats.rows += len(page)
+        yield page
+        if len(page) < page_size:
+            break
+        after = row_formats.last_user_id(page)
+        offset += page_size
+
+
+class _Failure:
+    """Carries an exception raised by a reader thread to the consumer."""
+
+    __slots__ = ("error",)
+
+    def __init__(self, error):
+        self.error = error
+
+
+_DONE = object()
+
+
+def start_reader(pages, items, stop, name="page-prefetch"):
+    """
+    Starts a daemon thread that iterates `pages` and puts every item into
+    the bounded queue `items`, followed by an end marker (or the exception
+    that ended the iteration). Read the queue back with `drain_queue`.
+
+    When the queue is full the thread waits for room (backpressure). Once
+    `stop` is set it stops producing and calls `pages.close()` (if it has
+    one) on its own thread.
+
+    Args:
+        pages (iterable): The items to produce, e.g. a paging generator.
+        items (queue.Queue): The bounded queue to fill. Several readers may
+                             share one queue.
+        stop (threading.Event): Set by the consumer to cancel the reader.
+        name (str): The thread name.
+    Returns:
+        threading.Thread: The started thread.
+    """
+    def put(item):
+        # Wait for room in the queue, giving up if the consumer went away.
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.05)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        outcome = _DONE
+        iterator = iter(pages)
+        try:
+            for page in iterator:
+                if not put(page):
+                    return
+        except BaseException as err:  # Propagated to the consumer.
+            outcome = _Failure(err)
+        finally:
+            close = getattr(iterator, "close", None)
+            if close:
+                close()
+        put(outcome)
+
+    reader = threading.Thread(target=produce, name=name, daemon=True)
+    reader.start()
+    return reader
+
+
+def drain_queue(items, readers=1):
+    """
+    Generator yielding the items put into `items` by `readers` reader
+    threads (see `start_reader`) until all of them have finished. An
+    exception raised in a reader is re-raised here.
+    """
+    while readers:
+        item = items.get()
+        if item is _DONE:
+            readers -= 1
+            continue
+        if isinstance(item, _Failure):
+            raise item.error
+        yield item
+
+
+def prefetch(pages, depth):
+    """
+    Generator that reads `pages` ahead on a background thread.
+
+    A producer thread iterates `pages` and keeps up to `depth` items in a
+    bounded queue; when the queue is full it waits (backpressure), so at
+    most `depth + 1` pages are ever held in memory. While the consumer
+    works on page N the producer is already fetching pages N+1..N+depth,
+    so a scan takes roughly max(database time, consumer time) instead of
+    their sum.
+
+    `pages` is only ever touched by the producer thread: if it is a
+    generator that opens and closes its own connection, the connection
+    lives entirely on that thread. An exception raised while producing is
+    re-raised in the consumer after the pages before it. When the consumer
+    stops early (break, `.close()` or garbage collection) the producer is
+    told to stop, `pages.close()` is called on its thread and the thread is
+    joined before this generator returns.
+
+    Args:
+        pages (iterable): The pages to read ahead, e.g. a paging generator.
+        depth (int): The maximum number of pages waiting in the queue.
+    Yields:
+        The items of `pages`, in order.
+    """
+    if depth <= 0:
+        raise ValueError("depth must be a positive integer")
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    reader = start_reader(pages, items, stop)
+    try:
+        yield from drain_queue(items)
+    finally:
+        stop.set()
+        reader.join()
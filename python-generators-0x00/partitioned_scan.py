@@ -0,0 +1,242 @@
+#!/usr/bin/python3
+"""
+partitioned_scan.py
+
+Parallel range-partitioned scans over the 'user_data' table.
+
+A full scan over one connection is limited by what a single session can
+pull. Here the `user_id` key space is split into N contiguous ranges whose
+boundaries are sampled from the primary key index at equally spaced ranks,
+so every range holds about the same number of rows. Each range is scanned
+with keyset pagination over its own connection, by a thread or a process.
+
+Functions:
+- plan_partitions(connection, count): sample the range boundaries.
+- partitioned_scan(count): one stream of batches from all ranges, either
+  ordered by `user_id` or in arrival order.
+- map_reduce(count, mapper, reducer): fold every range to a partial
+  result in parallel (threads or processes) and merge the partials.
+"""
+
+import concurrent.futures
+import functools
+import queue
+import threading
+
+import seed
+import pagination
+import pipeline
+import row_formats
+
+
+class Partition:
+    """
+    The `user_id` range `low < user_id <= high` of a partitioned scan.
+    None means unbounded on that side.
+    """
+
+    __slots__ = ("low", "high")
+
+    def __init__(self, low=None, high=None):
+        self.low = low
+        self.high = high
+
+    def where(self):
+        """Returns the pushed-down predicate for the upper bound, if any."""
+        if self.high is None:
+            return ()
+        return (pipeline.where("user_id", "<=", self.high),)
+
+    def cursor_token(self):
+        """Returns the keyset resume token that starts after `low`."""
+        if self.low is None:
+            return None
+        return pagination.encode_cursor(self.low)
+
+    def __eq__(self, other):
+        return (isinstance(other, Partition)
+                and (self.low, self.high) == (other.low, other.high))
+
+    def __repr__(self):
+        return f"Partition(low={self.low!r}, high={self.high!r})"
+
+
+def plan_partitions(connection, count):
+    """
+    Splits the `user_id` key space into up to `count` ranges of about the
+    same number of rows.
+
+    The boundaries are the keys at ranks n/count, 2n/count, ... of the
+    primary key index, each read with one index-only
+    `ORDER BY user_id LIMIT 1 OFFSET k` probe, so no rows are transferred
+    besides the boundaries themselves.
+
+    Args:
+        connection: An open mysql.connector (or sqlite3) connection.
+        count (int): The desired number of partitions.
+    Returns:
+        list[Partition]: Contiguous ranges covering the whole key space.
+    """
+    if count <= 0:
+        raise ValueError("count must be a positive integer")
+    mark = seed.placeholder(connection)
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT COUNT(*) FROM user_data")
+        rows = cursor.fetchone()[0]
+        # More partitions than rows would give empty ranges and negative ranks.
+        count = min(count, rows)
+        boundaries = []
+        for i in range(1, count):
+            cursor.execute(
+                f"SELECT user_id FROM user_data ORDER BY user_id LIMIT 1 OFFSET {mark}",
+                (max(rows * i // count - 1, 0),),
+            )
+            key = cursor.fetchone()[0]
+            if not boundaries or key > boundaries[-1]:
+                boundaries.append(key)
+    finally:
+        cursor.close()
+    edges = [None] + boundaries + [None]
+    return [Partition(low, high) for low, high in zip(edges, edges[1:])]
+
+
+def scan_partition(connection, partition, batch_size, row_format=row_formats.COLUMNAR):
+    """
+    Generator scanning one partition with keyset pagination.
+
+    Yields:
+        The batches of the partition, ordered by `user_id`.
+    """
+    return pagination.iter_pages(connection, batch_size, pagination.KEYSET,
+                                 partition.cursor_token(), row_format=row_format,
+                                 where=partition.where())
+
+
+def _partition_batches(connect, partition, batch_size, row_format):
+    """
+    Generator scanning one partition over a connection it opens with
+    `connect()` and closes when done.
+    """
+    connection = connect()
+    if not connection:
+        raise ConnectionError(f"Failed to connect to the database for {partition!r}")
+    try:
+        yield from scan_partition(connection, partition, batch_size, row_format)
+    finally:
+        connection.close()
+
+
+def _plan(connect, partitions):
+    """
+    Returns `partitions` if it is already a list of Partition objects,
+    otherwise plans that many partitions over a short-lived connection.
+    """
+    if not isinstance(partitions, int):
+        return list(partitions)
+    connection = connect()
+    if not connection:
+        raise ConnectionError("Failed to connect to the database to plan partitions")
+    try:
+        return plan_partitions(connection, partitions)
+    finally:
+        connection.close()
+
+
+def partitioned_scan(partitions, batch_size=1000, row_format=row_formats.COLUMNAR,
+                     ordered=False, depth=2, connect=seed.connect_to_prodev):
+    """
+    Generator scanning all partitions concurrently, one thread and one
+    connection per partition.
+
+    Each partition reader keeps at most `depth` batches queued, so memory
+    stays bounded. With `ordered=True` batches are yielded partition by
+    partition, i.e. in global `user_id` order, while later partitions are
+    already being read ahead; otherwise they are yielded as they arrive.
+    Stopping early cancels and joins every reader.
+
+    Args:
+        partitions (int | list[Partition]): How many partitions to plan, or
+                                            an explicit plan.
+        batch_size (int): Rows fetched per query.
+        row_format (str): One of row_formats.FORMATS (columnar by default).
+        ordered (bool): Yield in `user_id` order instead of arrival order.
+        depth (int): Batches buffered per partition.
+        connect (callable): Zero-argument connection factory, called on
+                            each reader thread.
+    Yields:
+        The batches of every partition.
+    """
+    plan = _plan(connect, partitions)
+    stop = threading.Event()
+    shared = None if ordered else queue.Queue(maxsize=depth * len(plan))
+    queues = []
+    readers = []
+    try:
+        for index, partition in enumerate(plan):
+            items = queue.Queue(maxsize=depth) if ordered else shared
+            queues.append(items)
+            readers.append(pagination.start_reader(
+                _partition_batches(connect, partition, batch_size, row_format),
+                items, stop, name=f"partition-{index}"))
+        if ordered:
+            for items in queues:
+                yield from pagination.drain_queue(items)
+        else:
+            yield from pagination.drain_queue(shared, len(readers))
+    finally:
+        stop.set()
+        for reader in readers:
+            reader.join()
+
+
+def _fold_partition(connect, partition, batch_size, row_format, mapper, reducer):
+    """
+    Worker of `map_reduce`: maps every batch of one partition and folds the
+    results with `reducer`.
+    """
+    result = None
+    for batch in _partition_batches(connect, partition, batch_size, row_format):
+        value = mapper(batch)
+        result = value if result is None else reducer(result, value)
+    return result
+
+
+def map_reduce(partitions, mapper, reducer, batch_size=1000,
+               row_format=row_formats.COLUMNAR, processes=False, workers=None,
+               connect=seed.connect_to_prodev):
+    """
+    Runs a map/reduce job over all partitions in parallel.
+
+    Every worker scans one partition over its own connection, applies
+    `mapper` to each batch and folds the results with `reducer`; the
+    per-partition results are then folded with `reducer` as well. The
+    reducer must therefore be associative, as the `merge` methods of
+    aggregates.py are. With `processes=True` the work runs in a process
+    pool, which scales CPU-heavy mappers across cores; `mapper`, `reducer`
+    and `connect` must then be picklable (module-level functions).
+
+    Args:
+        partitions (int | list[Partition]): How many partitions to plan, or
+                                            an explicit plan.
+        mapper (callable): batch -> partial result.
+        reducer (callable): (partial, partial) -> partial.
+        batch_size (int): Rows fetched per query.
+        row_format (str): One of row_formats.FORMATS (columnar by default).
+        processes (bool): Use processes instead of threads.
+        workers (int | None): Pool size. Defaults to one per partition.
+        connect (callable): Zero-argument connection factory.
+    Returns:
+        The reduced result, or None for an empty table.
+    """
+    plan = _plan(connect, partitions)
+    executor_class = (concurrent.futures.ProcessPoolExecutor if processes
+                      else concurrent.futures.ThreadPoolExecutor)
+    fold = functools.partial(_fold_partition, connect, batch_size=batch_size,
+                             row_format=row_format, mapper=mapper, reducer=reducer)
+    result = None
+    with executor_class(max_workers=workers or len(plan)) as executor:
+        for value in executor.map(fold, plan):
+            if value is not None:
+                result = value if result is None else reducer(result, value)
+    return result
@@ -0,0 +1,227 @@
+#!/usr/bin/python3
+"""
+pipeline.py
+
+Composable filter/map/project pipelines over columnar 'user_data' batches.
+
+A pipeline is built from stages and runs over `row_formats.ColumnarBatch`
+objects, so every stage works on a whole batch at once instead of looping
+over rows in Python:
+
+    adults = Pipeline().filter(where("age", ">", 25)).project("name", "age")
+    for batch in adults.scan(1000):
+        ...
+
+Predicates created with `where` are evaluated with NumPy when it is
+installed (the `array('i')` age column is viewed without copying) and with
+C-level `map`/`itertools.compress` otherwise. Leading `where` filters are
+also pushed down into the SQL WHERE clause by `Pipeline.scan`, so rows
+that do not match never leave the database.
+"""
+
+import itertools
+import operator
+from array import array
+
+import seed
+import pagination
+import row_formats
+
+try:
+    import numpy
+except ImportError:  # NumPy is optional; fall back to pure Python.
+    numpy = None
+
+OPERATORS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "=": operator.eq,
+    "!=": operator.ne,
+}
+
+
+class Predicate:
+    """
+    A `column <op> value` comparison that can run in SQL or on a batch.
+    """
+
+    def __init__(self, column, op, value):
+        if column not in row_formats.FIELDS:
+            raise ValueError(f"Unknown column: {column!r}")
+        if op not in OPERATORS:
+            raise ValueError(f"Unsupported operator: {op!r}")
+        self.column = column
+        self.op = op
+        self.value = value
+
+    def sql(self, mark):
+        """
+        Returns the predicate as a `(fragment, params)` pair for a WHERE
+        clause using the parameter marker `mark`.
+        """
+        return f"{self.column} {self.op} {mark}", (self.value,)
+
+    def mask(self, batch):
+        """
+        Evaluates the predicate over a whole ColumnarBatch.
+
+        Returns:
+            A NumPy boolean array when NumPy is available and the column is
+            numeric, otherwise a list of bools.
+        """
+        values = getattr(batch, self.column)
+        if values is None:
+            raise ValueError(f"Column {self.column!r} was projected away")
+        if numpy is not None and isinstance(values, (array, memoryview)):
+            values = numpy.frombuffer(values, dtype=numpy.dtype(_typecode(values)))
+            return OPERATORS[self.op](values, self.value)
+        return list(map(OPERATORS[self.op], values, itertools.repeat(self.value)))
+
+    def __repr__(self):
+        return f"where({self.column!r}, {self.op!r}, {self.value!r})"
+
+
+def where(column, op, value):
+    """
+    Creates a Predicate, e.g. `where("age", ">", 25)`.
+    """
+    return Predicate(column, op, value)
+
+
+def _typecode(column):
+    """
+    Returns the item type of an `array` or a memoryview (e.g. a column of
+    a column_cache.ColumnCache).
+    """
+    return column.typecode if isinstance(column, array) else column.format
+
+
+def select(batch, mask):
+    """
+    Returns a new ColumnarBatch holding the rows of `batch` where `mask` is
+    true. Numeric columns come back as arrays (`array('i')`, also for
+    memory-mapped memoryview columns), the others as lists.
+    """
+    if numpy is not None and isinstance(mask, numpy.ndarray):
+        flags = mask.tolist()
+    else:
+        flags = mask
+    columns = {}
+    for field, column in batch.columns().items():
+        if isinstance(column, (array, memoryview)):
+            typecode = _typecode(column)
+            if numpy is not None and isinstance(mask, numpy.ndarray):
+                view = numpy.frombuffer(column, dtype=numpy.dtype(typecode))
+                kept = array(typecode, view[mask].tobytes())
+            else:
+                kept = array(typecode, itertools.compress(column, flags))
+        else:
+            kept = list(itertools.compress(column, flags))
+        columns[field] = kept
+    return row_formats.ColumnarBatch.from_columns(columns)
+
+
+class Pipeline:
+    """
+    An immutable sequence of batch stages. Every builder method returns a
+    new Pipeline, so partial pipelines can be shared and extended.
+
+    Stages:
+    - filter(predicate): keep rows matching a `where(...)` Predicate, or a
+      callable taking a batch and returning a boolean mask.
+    - map(func): replace each batch with `func(batch)`.
+    - project(*columns): keep only the named columns.
+    """
+
+    def __init__(self, stages=()):
+        self.stages = tuple(stages)
+
+    def filter(self, predicate):
+        """Returns a pipeline with a filter stage appended."""
+        return Pipeline(self.stages + (("filter", predicate),))
+
+    def map(self, func):
+        """Returns a pipeline with a map stage appended."""
+        return Pipeline(self.stages + (("map", func),))
+
+    def project(self, *columns):
+        """Returns a pipeline with a projection stage appended."""
+        unknown = set(columns) - set(row_formats.FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown columns: {sorted(unknown)}")
+        return Pipeline(self.stages + (("project", columns),))
+
+    def pushdown(self):
+        """
+        Returns the leading `where` filters, which can be evaluated by the
+        database instead. Filters after a map or project stage, and
+        callable filters, always run in Python.
+        """
+        pushed = []
+        for kind, argument in self.stages:
+            if kind != "filter" or not isinstance(argument, Predicate):
+                break
+            pushed.append(argument)
+        return tuple(pushed)
+
+    def apply(self, batch, skip=0):
+        """
+        Runs the stages (after the first `skip`) over one ColumnarBatch.
+        """
+        for kind, argument in self.stages[skip:]:
+            if kind == "filter":
+                mask = (argument.mask(batch) if isinstance(argument, Predicate)
+                        else argument(batch))
+                batch = select(batch, mask)
+            elif kind == "map":
+                batch = argument(batch)
+            else:
+                batch = row_formats.ColumnarBatch.from_columns(
+                    {field: getattr(batch, field) for field in argument})
+        return batch
+
+    def run(self, batches, skip=0):
+        """
+        Generator applying the pipeline to every batch and yielding the
+        non-empty results.
+        """
+        for batch in batches:
+            batch = self.apply(batch, skip)
+            if len(batch):
+                yield batch
+
+    def scan(self, batch_size, connection=None, mode=pagination.KEYSET, pushdown=True):
+        """
+        Generator running the pipeline over the whole 'user_data' table.
+
+        Leading `where` filters are added to the SQL WHERE clause (unless
+        `pushdown` is False) and skipped in Python; the remaining stages run
+        over columnar batches of up to `batch_size` rows.
+
+        Args:
+            batch_size (int): Rows fetched per query.
+            connection: An optional open connection. When omitted one is
+                        opened with `seed.connect_to_prodev()` and closed
+                        when the generator finishes.
+            mode (str): "keyset" (default) or "offset" pagination.
+            pushdown (bool): Push leading predicates into SQL.
+        Yields:
+            ColumnarBatch: Non-empty result batches.
+        """
+        pushed = self.pushdown() if pushdown else ()
+        owns_connection = connection is None
+        try:
+            if owns_connection:
+                connection = seed.connect_to_prodev()
+            if not connection:
+                print("Failed to connect to the database. Cannot run pipeline.")
+                return
+            batches = pagination.iter_pages(connection, batch_size, mode,
+                                            row_format=row_formats.COLUMNAR,
+                                            where=pushed)
+            yield from self.run(batches, skip=len(pushed))
+        finally:
+            if owns_connection and connection:
+                connection.close()
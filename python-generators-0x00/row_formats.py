@@ -0,0 +1,221 @@
+#!/usr/bin/python3
+"""
+row_formats.py
+
+Row formats for the 'user_data' generators.
+
+`cursor(dictionary=True)` allocates a fresh dict (and its hash table) per
+row. When millions of rows are scanned that per-row allocation dominates,
+so the generators can hand rows out in lighter formats instead:
+
+- "dict":     `{'user_id': ..., 'name': ..., 'email': ..., 'age': ...}`
+              (the default, unchanged behaviour).
+- "tuple":    `(user_id, name, email, age)` exactly as the driver returns it.
+- "record":   a `UserRecord`, a `__slots__` object with attribute access
+              that also unpacks and indexes like a namedtuple.
+- "columnar": a `ColumnarBatch` per batch/page, with one list per string
+              column and the ages packed in an `array('i')`.
+"""
+
+import sqlite3
+from array import array
+
+import seed
+
+DICT = "dict"
+TUPLE = "tuple"
+RECORD = "record"
+COLUMNAR = "columnar"
+FORMATS = (DICT, TUPLE, RECORD, COLUMNAR)
+
+FIELDS = ("user_id", "name", "email", "age")
+
+
+class UserRecord:
+    """
+    A single 'user_data' row with fixed attributes and no per-instance dict.
+
+    Behaves like a namedtuple: fields are available as attributes, by index,
+    and by unpacking (`user_id, name, email, age = record`).
+    """
+
+    __slots__ = FIELDS
+
+    def __init__(self, user_id, name, email, age):
+        self.user_id = user_id
+        self.name = name
+        self.email = email
+        self.age = age
+
+    @classmethod
+    def _make(cls, row):
+        """Builds a record from a `(user_id, name, email, age)` sequence."""
+        return cls(*row)
+
+    def _asdict(self):
+        """Returns the row as a dict, like the "dict" format."""
+        return {field: getattr(self, field) for field in FIELDS}
+
+    def __iter__(self):
+        return iter((self.user_id, self.name, self.email, self.age))
+
+    def __getitem__(self, index):
+        return (self.user_id, self.name, self.email, self.age)[index]
+
+    def __len__(self):
+        return len(FIELDS)
+
+    def __eq__(self, other):
+        if isinstance(other, UserRecord):
+            return tuple(self) == tuple(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return (f"UserRecord(user_id={self.user_id!r}, name={self.name!r}, "
+                f"email={self.email!r}, age={self.age!r})")
+
+
+class ColumnarBatch:
+    """
+    A batch of 'user_data' rows stored column by column.
+
+    Columns dropped by a projection (see pipeline.py) are None.
+
+    Attributes:
+        user_id (list[str]): The user ids.
+        name (list[str]): The names.
+        email (list[str]): The email addresses.
+        age (array.array): The ages as a compact array of C ints.
+    """
+
+    __slots__ = FIELDS
+
+    def __init__(self, user_id=None, name=None, email=None, age=None):
+        self.user_id = user_id if user_id is not None else []
+        self.name = name if name is not None else []
+        self.email = email if email is not None else []
+        self.age = age if age is not None else array('i')
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Builds a batch from `(user_id, name, email, age)` tuples.
+        """
+        if not rows:
+            return cls()
+        user_id, name, email, age = zip(*rows)
+        return cls(list(user_id), list(name), list(email), array('i', age))
+
+    @classmethod
+    def from_columns(cls, columns):
+        """
+        Builds a (possibly projected) batch from a `{field: column}` dict.
+        Missing fields are left as None.
+        """
+        batch = cls.__new__(cls)
+        for field in FIELDS:
+            setattr(batch, field, columns.get(field))
+        return batch
+
+    def columns(self):
+        """
+        Returns the present columns as a `{field: column}` dict.
+        """
+        return {field: getattr(self, field) for field in FIELDS
+                if getattr(self, field) is not None}
+
+    def rows(self):
+        """
+        Returns an iterator of row tuples of the present columns, i.e.
+        `(user_id, name, email, age)` for an unprojected batch.
+        """
+        return zip(*self.columns().values())
+
+    def __len__(self):
+        for field in FIELDS:
+            column = getattr(self, field)
+            if column is not None:
+                return len(column)
+        return 0
+
+    def __repr__(self):
+        return f"ColumnarBatch(rows={len(self)}, columns={list(self.columns())})"
+
+
+def check_format(row_format):
+    """
+    Raises ValueError if `row_format` is not one of FORMATS.
+    """
+    if row_format not in FORMATS:
+        raise ValueError(f"Unknown row format: {row_format!r}")
+
+
+def make_cursor(connection, row_format=DICT, buffered=None):
+    """
+    Creates the cursor to fetch rows for `row_format` with.
+
+    The "dict" format uses a dictionary cursor (`seed.dict_cursor`); every
+    other format fetches plain tuples and converts them with `shape`.
+
+    Args:
+        connection: A mysql.connector or sqlite3 connection.
+        row_format (str): One of FORMATS.
+        buffered (bool | None): Passed on to mysql.connector; None keeps the
+                                connection's default.
+    """
+    if row_format == DICT:
+        return seed.dict_cursor(connection, buffered=buffered)
+    if buffered is None or isinstance(connection, sqlite3.Connection):
+        return connection.cursor()
+    return connection.cursor(buffered=buffered)
+
+
+def converter(row_format):
+    """
+    Returns the function turning one fetched row into `row_format`, or None
+    when rows are already in that format. Not defined for "columnar",
+    which works on whole batches (see `shape`).
+    """
+    if row_format == RECORD:
+        return UserRecord._make
+    return None
+
+
+def shape(rows, row_format):
+    """
+    Converts a list of fetched rows into a batch in `row_format`.
+
+    Args:
+        rows (list): Rows fetched with `make_cursor(connection, row_format)`.
+        row_format (str): One of FORMATS.
+    Returns:
+        list | ColumnarBatch: The batch.
+    """
+    if row_format == COLUMNAR:
+        return ColumnarBatch.from_rows(rows)
+    if row_format == RECORD:
+        return [UserRecord(*row) for row in rows]
+    return rows
+
+
+def from_tuples(rows, row_format):
+    """
+    Converts `(user_id, name, email, age)` tuples into a batch in
+    `row_format`, including "dict" (for drivers without a dictionary
+    cursor, such as the async ones).
+    """
+    if row_format == DICT:
+        return [dict(zip(FIELDS, row)) for row in rows]
+    return shape(list(rows), row_format)
+
+
+def last_user_id(batch):
+    """
+    Returns the `user_id` of the last row of a batch in any row format.
+    """
+    if isinstance(batch, ColumnarBatch):
+        return batch.user_id[-1]
+    row = batch[-1]
+    if isinstance(row, dict):
+        return row["user_id"]
+    return row[0]
@@ -12,8 +12,17 @@ If not found, default values for local development are used.
 """
 
 import mysql.connector
+import collections
 import csv
+import itertools
+import mmap
+import multiprocessing
 import os
+import sqlite3
+import tempfile
+import time
+import bloom
+import instrumentation
 import sys # For exiting if critical environment variables are missing
 
 # --- Database Configuration ---
@@ -77,10 +86,13 @@ def create_database(connection):
     finally:
         cursor.close()
 
-def connect_to_prodev():
+def connect_to_prodev(allow_local_infile=False):
     """
     Connects to the 'ALX_prodev' database in MySQL.
 
+    Args:
+        allow_local_infile (bool): Allow `LOAD DATA LOCAL INFILE` on this
+                                   connection (used by `bulk_insert_data`).
     Returns:
         mysql.connector.connection.MySQLConnection: The connection object if successful,
                                                     None otherwise.
@@ -90,7 +102,8 @@ def connect_to_prodev():
             host=DB_HOST,
             user=DB_USER,
             password=DB_PASSWORD,
-            database='ALX_prodev'
+            database='ALX_prodev',
+            allow_local_infile=allow_local_infile
         )
         print("Successfully connected to 'ALX_prodev' database.")
         return connection
@@ -100,6 +113,61 @@ def connect_to_prodev():
             print("Database 'ALX_prodev' does not exist. Please create it first.")
         return None
 
+def placeholder(connection):
+    """
+    Returns the query parameter marker understood by the given connection.
+
+    mysql.connector uses the 'format' style (%s) while sqlite3, which the
+    benchmarks and tests use as a local stand-in for MySQL, uses 'qmark' (?).
+
+    Args:
+        connection: A mysql.connector or sqlite3 connection.
+    Returns:
+        str: '?' for sqlite3 connections, '%s' otherwise.
+    """
+    if isinstance(connection, sqlite3.Connection):
+        return "?"
+    return "%s"
+
+def dict_cursor(connection, buffered=None):
+    """
+    Creates a cursor whose rows are returned as dictionaries.
+
+    For mysql.connector this is simply `cursor(dictionary=True)`. sqlite3
+    has no such flag, so a row factory building the same dictionaries is
+    installed on the cursor instead.
+
+    Args:
+        connection: A mysql.connector or sqlite3 connection.
+        buffered (bool | None): For mysql.connector, whether the whole result
+                                set is read into client memory on execute
+                                (True) or streamed from the server as rows are
+                                fetched (False). None keeps the connection's
+                                default. sqlite3 cursors always step through
+                                results lazily, so it is ignored there.
+    Returns:
+        A cursor yielding rows as dictionaries keyed by column name.
+    """
+    if isinstance(connection, sqlite3.Connection):
+        cursor = connection.cursor()
+        cursor.row_factory = lambda cur, row: {
+            column[0]: value for column, value in zip(cur.description, row)
+        }
+        return cursor
+    if buffered is None:
+        return connection.cursor(dictionary=True)
+    return connection.cursor(dictionary=True, buffered=buffered)
+
+def insert_ignore(connection):
+    """
+    Returns the "insert unless the primary key already exists" statement
+    prefix for the given connection: `INSERT IGNORE` for MySQL and
+    `INSERT OR IGNORE` for sqlite3.
+    """
+    if isinstance(connection, sqlite3.Connection):
+        return "INSERT OR IGNORE"
+    return "INSERT IGNORE"
+
 def create_table(connection):
     """
     Creates the 'user_data' table in the 'ALX_prodev' database if it does not exist.
@@ -109,6 +177,9 @@ def create_table(connection):
     - name (VARCHAR(255), NOT NULL)
     - email (VARCHAR(255), NOT NULL)
     - age (INT, NOT NULL) - Using INT as age is typically a whole number.
+    - updated_at (TIMESTAMP(6), NOT NULL) - Set by the database on every insert
+      and update, and indexed together with user_id, so incremental scans
+      (see incremental.py) can find the rows changed since a checkpoint.
 
     Args:
         connection (mysql.connector.connection.MySQLConnection): An active connection
@@ -121,26 +192,275 @@ def create_table(connection):
         return False
 
     cursor = connection.cursor()
-    table_creation_query = """
-    CREATE TABLE IF NOT EXISTS user_data (
-        user_id VARCHAR(36) PRIMARY KEY,
-        name VARCHAR(255) NOT NULL,
-        email VARCHAR(255) NOT NULL,
-        age INT NOT NULL
-    )
-    """
+    if isinstance(connection, sqlite3.Connection):
+        # SQLite has no ON UPDATE clause; a trigger maintains updated_at instead.
+        statements = [f"""
+        CREATE TABLE IF NOT EXISTS user_data (
+            user_id VARCHAR(36) PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            email VARCHAR(255) NOT NULL,
+            age INT NOT NULL,
+            updated_at TEXT NOT NULL DEFAULT ({SQLITE_NOW})
+        )
+        """] + _sqlite_change_tracking()
+    else:
+        statements = ["""
+        CREATE TABLE IF NOT EXISTS user_data (
+            user_id VARCHAR(36) PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            email VARCHAR(255) NOT NULL,
+            age INT NOT NULL,
+            updated_at TIMESTAMP(6) NOT NULL
+                DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
+            INDEX idx_user_data_updated_at (updated_at, user_id)
+        )
+        """]
     # Note: PRIMARY KEY automatically creates an index.
     try:
-        cursor.execute(table_creation_query)
+        for statement in statements:
+            cursor.execute(statement)
         connection.commit() # Commit the table creation
         print("Table 'user_data' created successfully or already exists.")
         return True
-    except mysql.connector.Error as err:
+    except (mysql.connector.Error, sqlite3.Error) as err:
         print(f"Error creating table 'user_data': {err}")
         return False
     finally:
         cursor.close()
 
+# SQLite expression for the current time with millisecond precision, in the
+# same 'YYYY-MM-DD HH:MM:SS.fff' layout MySQL uses for TIMESTAMP(6).
+SQLITE_NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+def _sqlite_change_tracking(on_insert=False):
+    """
+    Returns the SQLite statements that index `updated_at` and keep it
+    current on updates (and, with `on_insert`, on inserts too, for tables
+    whose column was added later with a constant default).
+    """
+    touch = f"UPDATE user_data SET updated_at = {SQLITE_NOW} WHERE user_id = NEW.user_id;"
+    statements = [
+        "CREATE INDEX IF NOT EXISTS idx_user_data_updated_at ON user_data (updated_at, user_id)",
+        f"""
+        CREATE TRIGGER IF NOT EXISTS user_data_touch_update
+        AFTER UPDATE OF user_id, name, email, age ON user_data
+        BEGIN {touch} END
+        """,
+    ]
+    if on_insert:
+        statements.append(f"""
+        CREATE TRIGGER IF NOT EXISTS user_data_touch_insert
+        AFTER INSERT ON user_data
+        BEGIN {touch} END
+        """)
+    return statements
+
+def enable_change_tracking(connection):
+    """
+    Adds the `updated_at` column and its index to a 'user_data' table
+    created before the column was part of the schema. Existing rows get
+    the time of the migration. Does nothing if the column already exists.
+
+    Args:
+        connection: A mysql.connector or sqlite3 connection.
+    Returns:
+        bool: True if the table tracks changes afterwards, False otherwise.
+    """
+    cursor = connection.cursor()
+    try:
+        if isinstance(connection, sqlite3.Connection):
+            cursor.execute("PRAGMA table_info(user_data)")
+            if any(column[1] == "updated_at" for column in cursor.fetchall()):
+                return True
+            # ALTER TABLE only accepts a constant default in SQLite.
+            statements = [
+                "ALTER TABLE user_data ADD COLUMN updated_at TEXT NOT NULL "
+                "DEFAULT '1970-01-01 00:00:00.000'",
+                f"UPDATE user_data SET updated_at = {SQLITE_NOW}",
+            ] + _sqlite_change_tracking(on_insert=True)
+        else:
+            cursor.execute("SHOW COLUMNS FROM user_data LIKE 'updated_at'")
+            if cursor.fetchall():
+                return True
+            statements = [
+                "ALTER TABLE user_data ADD COLUMN updated_at TIMESTAMP(6) NOT NULL "
+                "DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6), "
+                "ADD INDEX idx_user_data_updated_at (updated_at, user_id)",
+            ]
+        for statement in statements:
+            cursor.execute(statement)
+        connection.commit()
+        print("Change tracking enabled on 'user_data'.")
+        return True
+    except (mysql.connector.Error, sqlite3.Error) as err:
+        print(f"Error enabling change tracking on 'user_data': {err}")
+        return False
+    finally:
+        cursor.close()
+
+def current_timestamp(connection):
+    """
+    Returns the database's current time in the representation it uses for
+    `updated_at` (a datetime for MySQL, a string for SQLite).
+    """
+    cursor = connection.cursor()
+    try:
+        if isinstance(connection, sqlite3.Connection):
+            cursor.execute(f"SELECT {SQLITE_NOW}")
+        else:
+            cursor.execute("SELECT CURRENT_TIMESTAMP(6)")
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+class Migration:
+    """
+    A named schema change applied at most once by `migrate`.
+
+    Attributes:
+        name (str): Unique name, recorded in 'schema_migrations' once applied.
+        up (callable): connection -> list of SQL statements applying it.
+        down (callable): connection -> list of SQL statements reverting it.
+        description (str): Why the change exists.
+        columns (tuple): The indexed columns, for index migrations.
+    """
+
+    def __init__(self, name, up, down, description="", columns=()):
+        self.name = name
+        self.up = up
+        self.down = down
+        self.description = description
+        self.columns = tuple(columns)
+
+    def __repr__(self):
+        return f"Migration({self.name!r})"
+
+def _analyze_sql(connection):
+    """
+    Returns the statement refreshing the optimizer statistics of 'user_data',
+    which both planners need to choose well between a new index and a scan.
+    """
+    if isinstance(connection, sqlite3.Connection):
+        return "ANALYZE user_data"
+    return "ANALYZE TABLE user_data"
+
+def index_migration(name, columns, description=""):
+    """
+    Returns a Migration creating (and reverting: dropping) the secondary
+    index `name` on `user_data (columns)`.
+    """
+    column_list = ", ".join(columns)
+
+    def up(connection):
+        return [f"CREATE INDEX {name} ON user_data ({column_list})", _analyze_sql(connection)]
+
+    def down(connection):
+        if isinstance(connection, sqlite3.Connection):
+            return [f"DROP INDEX {name}"]
+        return [f"DROP INDEX {name} ON user_data"]
+
+    return Migration(name, up, down, description, columns)
+
+# Schema changes applied by `migrate`, in order. The indexes were chosen
+# with index_advisor.py, which reports the query latencies that justify them.
+MIGRATIONS = [
+    index_migration("idx_user_data_email", ("email",),
+                    "Lookups by email address."),
+    index_migration("idx_user_data_age", ("age",),
+                    "Covers age-only scans, the age aggregates and percentile probes."),
+]
+
+def _run_statements(connection, statements):
+    """
+    Executes `statements` in order on one cursor.
+    """
+    cursor = connection.cursor()
+    try:
+        for statement in statements:
+            cursor.execute(statement)
+            if getattr(cursor, 'with_rows', False):
+                cursor.fetchall() # ANALYZE TABLE returns a result set in MySQL.
+    finally:
+        cursor.close()
+
+def applied_migrations(connection):
+    """
+    Returns the names of the migrations already applied, creating the
+    'schema_migrations' bookkeeping table if needed.
+    """
+    _run_statements(connection, ["""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            name VARCHAR(255) PRIMARY KEY,
+            applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """])
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT name FROM schema_migrations")
+        return {row[0] for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+def migrate(connection, migrations=None):
+    """
+    Applies the migrations that have not been applied yet, in order, and
+    records each one in 'schema_migrations'.
+
+    Args:
+        connection: A mysql.connector or sqlite3 connection.
+        migrations (list[Migration] | None): Defaults to MIGRATIONS.
+    Returns:
+        list[str]: The names of the migrations applied by this call, or None
+                   if one of them failed (the ones before it stay applied).
+    """
+    if migrations is None:
+        migrations = MIGRATIONS
+    mark = placeholder(connection)
+    applied = []
+    try:
+        done = applied_migrations(connection)
+        for migration in migrations:
+            if migration.name in done:
+                continue
+            _run_statements(connection, migration.up(connection))
+            cursor = connection.cursor()
+            try:
+                cursor.execute(f"INSERT INTO schema_migrations (name) VALUES ({mark})",
+                               (migration.name,))
+            finally:
+                cursor.close()
+            connection.commit()
+            print(f"Applied migration '{migration.name}'.")
+            applied.append(migration.name)
+        return applied
+    except (mysql.connector.Error, sqlite3.Error) as err:
+        print(f"Error applying migrations: {err}")
+        return None
+
+def revert(connection, migration):
+    """
+    Reverts one applied migration and forgets it in 'schema_migrations'.
+
+    Returns:
+        bool: True if it was reverted, False otherwise.
+    """
+    try:
+        if migration.name not in applied_migrations(connection):
+            return False
+        _run_statements(connection, migration.down(connection))
+        cursor = connection.cursor()
+        try:
+            cursor.execute(f"DELETE FROM schema_migrations WHERE name = {placeholder(connection)}",
+                           (migration.name,))
+        finally:
+            cursor.close()
+        connection.commit()
+        print(f"Reverted migration '{migration.name}'.")
+        return True
+    except (mysql.connector.Error, sqlite3.Error) as err:
+        print(f"Error reverting migration '{migration.name}': {err}")
+        return False
+
 def insert_data(connection, data_file):
     """
     Inserts data from a CSV file into the 'user_data' table.
@@ -163,8 +483,9 @@ def insert_data(connection, data_file):
         return 0
 
     inserted_rows_count = 0
+    call = instrumentation.call("insert_data")
     try:
-        cursor = connection.cursor()
+        cursor = call.cursor(connection.cursor())
         with open(data_file, mode='r', encoding='utf-8') as file:
             csv_reader = csv.reader(file)
             header = next(csv_reader) # Skip header row
@@ -172,9 +493,10 @@ def insert_data(connection, data_file):
             # Prepare the INSERT IGNORE statement
             # INSERT IGNORE attempts to insert. If a duplicate key (PRIMARY KEY) is found,
             # it simply ignores the row without erroring.
-            insert_query = """
-            INSERT IGNORE INTO user_data (user_id, name, email, age)
-            VALUES (%s, %s, %s, %s)
+            mark = placeholder(connection)
+            insert_query = f"""
+            {insert_ignore(connection)} INTO user_data (user_id, name, email, age)
+            VALUES ({mark}, {mark}, {mark}, {mark})
             """
 
             for row in csv_reader:
@@ -200,14 +522,632 @@ def insert_data(connection, data_file):
         print(f"Data insertion complete. {inserted_rows_count} new rows inserted (duplicates ignored).")
         return inserted_rows_count
     except mysql.connector.Error as err:
+        call.error(err)
         print(f"Database error during data insertion: {err}")
         return 0
     except Exception as e:
+        call.error(e)
         print(f"An unexpected error occurred during data insertion: {e}")
         return 0
     finally:
         if 'cursor' in locals() and cursor:
             cursor.close()
+        call.finish()
+
+
+class LoadResult:
+    """
+    Counters reported by the bulk loaders.
+
+    Attributes:
+        inserted (int): Rows actually inserted into 'user_data'.
+        duplicates (int): Valid rows ignored because their user_id already
+                          existed (in the table or earlier in the file).
+        skipped (int): Malformed rows that were not sent to the database.
+        filtered (int): Duplicate rows dropped by the client-side dedup
+                        stage (`dedup_batches`) instead of being sent.
+        batches (int): Number of batches committed.
+        elapsed (float): Wall-clock seconds spent loading.
+        error (str | None): The database error that stopped the load, in
+                            which case the counters only cover the batches
+                            committed before it.
+        failed_shards (list): `(start, end)` byte ranges that
+                              `parallel_insert_data` did not fully load.
+    """
+
+    def __init__(self, inserted=0, duplicates=0, skipped=0, batches=0, elapsed=0.0,
+                 filtered=0):
+        self.inserted = inserted
+        self.duplicates = duplicates
+        self.skipped = skipped
+        self.filtered = filtered
+        self.batches = batches
+        self.elapsed = elapsed
+        self.error = None
+        self.failed_shards = []
+
+    @property
+    def ok(self):
+        """True if every batch was loaded."""
+        return self.error is None and not self.failed_shards
+
+    @property
+    def rows(self):
+        """Valid rows sent to the database (inserted + duplicates)."""
+        return self.inserted + self.duplicates
+
+    @property
+    def rows_per_second(self):
+        """Valid rows processed per second of wall-clock time."""
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def merge(self, other):
+        """
+        Adds the counters of another LoadResult into this one.
+
+        Returns:
+            LoadResult: self, to allow chaining.
+        """
+        self.inserted += other.inserted
+        self.duplicates += other.duplicates
+        self.skipped += other.skipped
+        self.filtered += other.filtered
+        self.batches += other.batches
+        self.error = self.error or other.error
+        self.failed_shards.extend(other.failed_shards)
+        return self
+
+    def __repr__(self):
+        error = f", error={self.error!r}" if self.error else ""
+        return (f"LoadResult(inserted={self.inserted}, duplicates={self.duplicates}, "
+                f"skipped={self.skipped}, filtered={self.filtered}, "
+                f"batches={self.batches}, "
+                f"elapsed={self.elapsed:.2f}s{error})")
+
+# Bytes of CSV decoded and parsed at a time by `mmap_csv_batches`.
+CSV_CHUNK_SIZE = 4 << 20
+
+REJECTS_HEADER = ['line', 'reason', 'user_id', 'name', 'email', 'age']
+
+def _reject_reason(row):
+    """
+    Returns why a parsed CSV row cannot be inserted, or None if it can.
+    """
+    if len(row) != 4:
+        return f"expected 4 columns, got {len(row)}"
+    try:
+        int(row[3])
+    except ValueError:
+        return f"invalid age: {row[3]!r}"
+    return None
+
+def parse_csv_chunk(text, first_line, result, rejects=None):
+    """
+    Parses and validates a chunk of CSV text in bulk.
+
+    Chunks without quotes (the usual case for the seed CSV) are split with
+    `str.split`; others go through the C csv parser. The whole chunk is
+    then unpacked and converted in one comprehension inside a single
+    try/except. Only when that fails is the chunk walked row by row to
+    separate the bad rows, which are counted in `result.skipped` and
+    written to `rejects` (if given) with their line number and the reason.
+
+    Every row tuple created counts towards the cyclic garbage collector's
+    next run, so a one-shot loading process may pause it around the load
+    (see `benchmark.py insert --no-gc`); library code leaves it alone.
+
+    Args:
+        text (str): Decoded CSV lines, each ending with a newline.
+        first_line (int): The 1-based line number of the first line.
+        result (LoadResult): Counters to update with rejected rows.
+        rejects: An optional csv writer receiving
+                 `[line, reason, *fields]` for every rejected row.
+    Returns:
+        tuple: `(rows, line_count)`, the valid `(user_id, name, email, age)`
+               tuples and the number of lines in the chunk.
+    """
+    lines = text.split('\n')
+    if lines[-1] == '':
+        lines.pop()
+    quoted = '"' in text
+    # int() ignores the '\r' that CRLF line endings leave on the age.
+    rows = (csv.reader(lines) if quoted
+            else map(str.split, lines, itertools.repeat(',')))
+    try:
+        return [(user_id, name, email, int(age))
+                for user_id, name, email, age in rows], len(lines)
+    except ValueError:
+        pass
+    rows = (csv.reader(lines) if quoted
+            else (line.rstrip('\r').split(',') for line in lines))
+    valid = []
+    for line, row in enumerate(rows, first_line):
+        reason = _reject_reason(row)
+        if reason is None:
+            valid.append((row[0], row[1], row[2], int(row[3])))
+            continue
+        result.skipped += 1
+        if rejects is not None:
+            rejects.writerow([line, reason] + row)
+    return valid, len(lines)
+
+def mmap_csv_batches(data_file, batch_size, result, rejects=None, start=None, end=None,
+                     chunk_size=CSV_CHUNK_SIZE):
+    """
+    Generator reading a seed CSV file through a read-only memory map and
+    yielding ready-to-insert batches.
+
+    The mapped bytes are cut into chunks of about `chunk_size` bytes that end
+    on a newline; each chunk is decoded with one call and validated in bulk
+    by `parse_csv_chunk`, so no Python-level loop or try/except runs per
+    row unless the chunk holds bad rows. Like `csv_shards`, this relies on rows not containing embedded
+    newlines, which holds for the seed CSV.
+
+    Args:
+        data_file (str): The path to the CSV file.
+        batch_size (int): The number of rows per yielded batch.
+        result (LoadResult): Counters to update with rejected rows.
+        rejects: An optional csv writer for rejected rows (see
+                 `parse_csv_chunk`).
+        start (int | None): Byte offset to start at, as produced by
+                            `csv_shards`. None skips the header row.
+        end (int | None): Byte offset to stop at. None reads to the end.
+        chunk_size (int): Approximate bytes parsed at a time.
+    Yields:
+        list[tuple]: Batches of `(user_id, name, email, age)` tuples.
+    """
+    if os.path.getsize(data_file) == 0:
+        return
+    with open(data_file, 'rb') as file, \
+            mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        stop = len(data) if end is None else end
+        if start is None:
+            position = data.find(b'\n') + 1 or stop # Skip header row
+            line = 2
+        else:
+            position = start
+            # Only needed to number rejected rows.
+            line = data[:start].count(b'\n') + 1 if rejects is not None else 1
+        pending = []
+        while position < stop:
+            cut = min(position + chunk_size, stop)
+            if cut < stop:
+                newline = data.rfind(b'\n', position, cut)
+                if newline == -1:
+                    newline = data.find(b'\n', cut, stop)
+                cut = stop if newline == -1 else newline + 1
+            rows, count = parse_csv_chunk(data[position:cut].decode('utf-8'), line,
+                                          result, rejects)
+            position = cut
+            line += count
+            pending.extend(rows)
+            full = len(pending) - len(pending) % batch_size
+            for i in range(0, full, batch_size):
+                yield pending[i:i + batch_size]
+            pending = pending[full:]
+        if pending:
+            yield pending
+
+def local_infile_enabled(connection):
+    """
+    Checks whether the MySQL server accepts `LOAD DATA LOCAL INFILE`.
+
+    Args:
+        connection: An active connection to the 'ALX_prodev' database.
+    Returns:
+        bool: True if the server has `local_infile` enabled. Always False
+              for sqlite3 connections.
+    """
+    if isinstance(connection, sqlite3.Connection):
+        return False
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SHOW GLOBAL VARIABLES LIKE 'local_infile'")
+        row = cursor.fetchone()
+        return bool(row) and str(row[1]).upper() in ("ON", "1")
+    except mysql.connector.Error:
+        return False
+    finally:
+        cursor.close()
+
+def _load_batch_infile(cursor, batch):
+    """
+    Loads one batch with `LOAD DATA LOCAL INFILE ... IGNORE` through a
+    temporary CSV file and returns the number of rows inserted.
+    """
+    with tempfile.NamedTemporaryFile('w', newline='', encoding='utf-8',
+                                     suffix='.csv', delete=False) as tmp:
+        csv.writer(tmp).writerows(batch)
+    try:
+        cursor.execute(
+            "LOAD DATA LOCAL INFILE %s IGNORE INTO TABLE user_data "
+            "CHARACTER SET utf8mb4 "
+            "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '' "
+            "LINES TERMINATED BY '\\r\\n' (user_id, name, email, age)",
+            (tmp.name,)
+        )
+        return cursor.rowcount
+    finally:
+        os.remove(tmp.name)
+
+def load_batches(connection, batches, result, use_load_data=False,
+                 call=instrumentation.NULL_CALL):
+    """
+    Inserts batches of validated rows, committing once per batch.
+
+    Each batch is sent as one multi-row `INSERT IGNORE` or, with
+    `use_load_data`, as a `LOAD DATA LOCAL INFILE ... IGNORE` (falling back
+    to multi-row inserts if the server refuses it). Inserted and duplicate
+    counts are added to `result`. A database error rolls back the current
+    batch and stops the load; it is recorded in `result.error`, and the
+    counters then cover the batches committed before it.
+
+    Args:
+        connection: An active connection to the 'ALX_prodev' database.
+        batches: An iterable of lists of `(user_id, name, email, age)` tuples.
+        result (LoadResult): Counters to update.
+        use_load_data (bool): Try LOAD DATA LOCAL INFILE first.
+        call (instrumentation.Call): Records the timings and rows written.
+    Returns:
+        LoadResult: `result`.
+    """
+    mark = placeholder(connection)
+    insert_query = (f"{insert_ignore(connection)} INTO user_data "
+                    f"(user_id, name, email, age) VALUES ({mark}, {mark}, {mark}, {mark})")
+    cursor = call.cursor(connection.cursor())
+    try:
+        for batch in batches:
+            inserted = None
+            if use_load_data:
+                try:
+                    inserted = _load_batch_infile(cursor, batch)
+                except mysql.connector.Error as err:
+                    print(f"LOAD DATA unavailable ({err}); using multi-row inserts.")
+                    connection.rollback()
+                    use_load_data = False
+            if inserted is None:
+                cursor.executemany(insert_query, batch)
+                inserted = cursor.rowcount
+            connection.commit()
+            result.inserted += inserted
+            result.duplicates += len(batch) - inserted
+            result.batches += 1
+    except (mysql.connector.Error, sqlite3.Error) as err:
+        connection.rollback()
+        result.error = str(err)
+        print(f"Database error during bulk insertion: {err}")
+    finally:
+        cursor.close()
+    return result
+
+def count_csv_rows(data_file):
+    """
+    Returns the number of data rows of a CSV file (its lines minus the
+    header), counted in 1 MiB blocks without parsing.
+    """
+    lines = 0
+    last = b'\n'
+    with open(data_file, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            lines += block.count(b'\n')
+            last = block[-1:]
+    if last != b'\n':
+        lines += 1
+    return max(lines - 1, 0)
+
+def load_key_filter(connection, expected_new=0, error_rate=0.01, batch_size=10000):
+    """
+    Builds a Bloom filter of the `user_id`s already in 'user_data'.
+
+    The filter is sized for the current row count plus `expected_new` keys
+    and filled by streaming the primary key `batch_size` rows at a time,
+    so only the filter itself (about 1.2 bytes per key at 1%) stays in memory.
+
+    Args:
+        connection: An active connection to the 'ALX_prodev' database.
+        expected_new (int): How many new keys the filter should also have
+                            room for, e.g. the rows of the file to load.
+        error_rate (float): The target false-positive rate.
+        batch_size (int): Keys fetched at a time.
+    Returns:
+        bloom.BloomFilter: The filled filter, or None on a database error.
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT COUNT(*) FROM user_data")
+        (existing,) = cursor.fetchone()
+        key_filter = bloom.BloomFilter(int(existing) + expected_new, error_rate)
+        cursor.execute("SELECT user_id FROM user_data")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            key_filter.add_many([user_id for (user_id,) in rows])
+        return key_filter
+    except (mysql.connector.Error, sqlite3.Error) as err:
+        print(f"Database error while loading existing keys: {err}")
+        return None
+    finally:
+        cursor.close()
+
+# Keys per `IN (...)` list when confirming possible duplicates (below
+# SQLite's historical limit of 999 bound parameters).
+KEY_LOOKUP_SIZE = 900
+
+# Keys of the current file remembered by `dedup_batches` so that repeats
+# are not looked up again; older keys fall back to `existing_keys`.
+KNOWN_KEYS = 100000
+
+def existing_keys(connection, keys):
+    """
+    Returns the subset of `keys` present in 'user_data', looked up with
+    one `WHERE user_id IN (...)` query per KEY_LOOKUP_SIZE keys.
+    """
+    found = set()
+    mark = placeholder(connection)
+    cursor = connection.cursor()
+    try:
+        for i in range(0, len(keys), KEY_LOOKUP_SIZE):
+            chunk = keys[i:i + KEY_LOOKUP_SIZE]
+            cursor.execute(f"SELECT user_id FROM user_data WHERE user_id IN "
+                           f"({', '.join([mark] * len(chunk))})", chunk)
+            found.update(user_id for (user_id,) in cursor.fetchall())
+    finally:
+        cursor.close()
+    return found
+
+def dedup_batches(batches, key_filter, result, connection=None, known_keys=KNOWN_KEYS):
+    """
+    Generator dropping duplicate `user_id`s from batches of rows before
+    they are sent to the database.
+
+    Repeated keys within a batch are dropped first; the remaining keys are
+    then checked against `key_filter` (see `load_key_filter`) and added to
+    it in one `add_many` call, so duplicates of rows already in the table
+    and of rows in earlier batches are caught as well.
+    A Bloom filter never misses a key it holds, but may report an unseen
+    key as present at its false-positive rate. With a `connection`, those
+    possible duplicates are confirmed with one key lookup per batch
+    (`existing_keys`), so no new row is ever lost; without one they are
+    dropped, trading `error_rate` of the new rows for zero extra queries.
+    To keep repeats within the file out of those lookups, the verifying
+    stage also remembers the last `known_keys` keys it has passed or
+    confirmed (least recently seen first out); only filter hits outside
+    them are looked up, so memory stays bounded however many distinct
+    keys the file holds.
+
+    The lookup sees earlier batches only once they are committed, which
+    `load_batches` does before it asks for the next batch.
+
+    Args:
+        batches: An iterable of lists of `(user_id, name, email, age)` tuples.
+        key_filter (bloom.BloomFilter): The keys already loaded.
+        result (LoadResult): Counters to update with the filtered rows.
+        connection: An optional active connection used to confirm
+                    possible duplicates.
+        known_keys (int): The number of recent keys kept to skip lookups.
+    Yields:
+        list[tuple]: The non-empty batches without duplicates.
+    """
+    known = collections.OrderedDict() if connection is not None else None
+    for batch in batches:
+        rows = {}
+        for row in batch:
+            rows.setdefault(row[0], row)
+        keys = list(rows)
+        present = key_filter.add_many(keys)
+        candidates = [key for key, hit in zip(keys, present) if hit]
+        if known is not None:
+            unsure = [key for key in candidates if key not in known]
+            if unsure:
+                found = existing_keys(connection, unsure)
+                candidates = [key for key in candidates if key in known or key in found]
+            for key in keys:
+                known[key] = None
+                known.move_to_end(key)
+            while len(known) > known_keys:
+                known.popitem(last=False)
+        for key in candidates:
+            del rows[key]
+        result.filtered += len(batch) - len(rows)
+        if rows:
+            yield list(rows.values())
+
+def bulk_insert_data(connection, data_file, batch_size=5000, use_load_data=None,
+                     rejects_file=None, dedup=None, error_rate=0.01, verify=True):
+    """
+    Bulk-loads a CSV file into the 'user_data' table.
+
+    The CSV is parsed through a memory map (`mmap_csv_batches`) and
+    streamed in batches of `batch_size` validated rows. Each batch
+    is sent as one multi-row `INSERT IGNORE` (`executemany`, which
+    mysql.connector rewrites into a single statement) or, when the server
+    allows it, with `LOAD DATA LOCAL INFILE ... IGNORE`, and is committed
+    once. Because every valid row of a batch is either inserted or ignored
+    as a duplicate, the affected row count of the batch gives exact
+    inserted and duplicate counts.
+
+    Args:
+        connection: An active connection to the 'ALX_prodev' database. Use
+                    `connect_to_prodev(allow_local_infile=True)` to allow
+                    LOAD DATA.
+        data_file (str): The path to the CSV file containing user data.
+        batch_size (int): The number of rows per batch and transaction.
+        use_load_data (bool | None): Force LOAD DATA on (True) or off (False).
+                                     None uses it when the server allows it.
+                                     If LOAD DATA fails, the loader falls
+                                     back to multi-row inserts.
+        rejects_file (str | None): A CSV file receiving every rejected row
+                                   with its line number and the reason.
+                                   None only counts them.
+        dedup (bool | bloom.BloomFilter | None): Drop duplicate user_ids on
+                                   the client (`dedup_batches`) instead of
+                                   sending them. True builds a filter of
+                                   the table's keys with `load_key_filter`;
+                                   a filter is used (and updated) as is.
+        error_rate (float): The false-positive rate of the filter built
+                            with `dedup=True`.
+        verify (bool): Confirm the filter's possible duplicates against
+                       the table instead of dropping them.
+    Returns:
+        LoadResult: The inserted, duplicate, skipped and filtered row counts.
+                    `result.ok` is False if a database error stopped the
+                    load part way (see `load_batches`).
+    """
+    result = LoadResult()
+    if not connection:
+        print("No active database connection to insert data.")
+        return result
+
+    if not os.path.exists(data_file):
+        print(f"Error: CSV file '{data_file}' not found.")
+        return result
+
+    if use_load_data is None:
+        use_load_data = local_infile_enabled(connection)
+
+    start = time.perf_counter()
+    rejects_handle = None
+    call = instrumentation.call("bulk_insert_data")
+    try:
+        rejects = None
+        if rejects_file:
+            rejects_handle = open(rejects_file, mode='w', encoding='utf-8', newline='')
+            rejects = csv.writer(rejects_handle)
+            rejects.writerow(REJECTS_HEADER)
+        batches = mmap_csv_batches(data_file, batch_size, result, rejects)
+        if dedup is True:
+            dedup = load_key_filter(connection, count_csv_rows(data_file), error_rate)
+        if dedup:
+            batches = dedup_batches(batches, dedup, result,
+                                    connection if verify else None)
+        load_batches(connection, batches, result, use_load_data, call)
+    finally:
+        if rejects_handle is not None:
+            rejects_handle.close()
+        result.elapsed = time.perf_counter() - start
+        call.finish()
+
+    status = "complete" if result.ok else f"FAILED ({result.error})"
+    print(f"Bulk insertion {status}. {result.inserted} new rows inserted, "
+          f"{result.duplicates} duplicates ignored, {result.filtered} duplicates "
+          f"filtered, {result.skipped} rows skipped.")
+    return result
+
+
+def csv_shards(data_file, count):
+    """
+    Splits a CSV file into `count` byte ranges aligned to line boundaries.
+
+    The header row is excluded from the first range. Every range starts at
+    the beginning of a line and ends right after a newline (or at the end
+    of the file), so each data row belongs to exactly one range. Rows must
+    not contain embedded newlines, which holds for the seed CSV.
+
+    Args:
+        data_file (str): The path to the CSV file.
+        count (int): The desired number of shards.
+    Returns:
+        list[tuple[int, int]]: Non-empty `(start, end)` byte offsets.
+    """
+    size = os.path.getsize(data_file)
+    with open(data_file, 'rb') as file:
+        file.readline() # Skip header row
+        boundaries = [file.tell()]
+        for i in range(1, count):
+            target = max(boundaries[0] + (size - boundaries[0]) * i // count,
+                         boundaries[-1])
+            file.seek(target)
+            if target > boundaries[0]:
+                # Move to the start of the next line.
+                file.seek(target - 1)
+                file.readline()
+            boundaries.append(min(file.tell(), size))
+        boundaries.append(size)
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:])
+            if end > start]
+
+def _load_shard(task):
+    """
+    Worker entry point of `parallel_insert_data`: loads one byte range of
+    the CSV over the worker's own connection.
+
+    Args:
+        task (tuple): `(connect, data_file, start, end, batch_size,
+                      use_load_data)`.
+    Returns:
+        LoadResult: The counters for the shard. If the shard could not be
+                    fully loaded, its byte range is in `failed_shards`.
+    """
+    connect, data_file, start, end, batch_size, use_load_data = task
+    result = LoadResult()
+    connection = connect()
+    if not connection:
+        print(f"Failed to connect to the database. Shard {start}-{end} not loaded.")
+        result.error = "failed to connect to the database"
+        result.failed_shards.append((start, end))
+        return result
+    try:
+        batches = mmap_csv_batches(data_file, batch_size, result, start=start, end=end)
+        load_batches(connection, batches, result, use_load_data)
+    finally:
+        connection.close()
+    if result.error:
+        result.failed_shards.append((start, end))
+    return result
+
+def parallel_insert_data(data_file, workers=None, batch_size=5000, shards_per_worker=4,
+                         connect=connect_to_prodev, use_load_data=False):
+    """
+    Loads a CSV file into 'user_data' with several processes.
+
+    The file is split into line-aligned byte ranges (`csv_shards`). Each
+    worker process parses its shard with its own database connection and
+    bulk-inserts it in batches (`load_batches`). Shards are handed out
+    `shards_per_worker` times more finely than the number of workers so
+    that progress is reported regularly and fast workers pick up more work.
+    The per-shard counters are merged into one LoadResult.
+
+    Args:
+        data_file (str): The path to the CSV file containing user data.
+        workers (int | None): Number of processes. Defaults to the CPU count.
+        batch_size (int): The number of rows per batch and transaction.
+        shards_per_worker (int): How many shards to create per worker.
+        connect (callable): A picklable zero-argument connection factory
+                            used by each worker. Defaults to
+                            `connect_to_prodev`.
+        use_load_data (bool): Use LOAD DATA LOCAL INFILE in the workers.
+    Returns:
+        LoadResult: The merged inserted, duplicate and skipped row counts.
+                    Shards that failed (a worker could not connect or hit a
+                    database error) are listed in `failed_shards`, and
+                    `result.ok` is then False. Loading is `INSERT IGNORE`,
+                    so they can be loaded again with `mmap_csv_batches`
+                    and `load_batches` over the same byte ranges.
+    """
+    result = LoadResult()
+    if not os.path.exists(data_file):
+        print(f"Error: CSV file '{data_file}' not found.")
+        return result
+
+    workers = workers or os.cpu_count() or 1
+    shards = csv_shards(data_file, workers * shards_per_worker)
+    tasks = [(connect, data_file, start, end, batch_size, use_load_data)
+             for start, end in shards]
+
+    start = time.perf_counter()
+    with multiprocessing.Pool(processes=min(workers, len(tasks) or 1)) as pool:
+        for done, shard_result in enumerate(pool.imap_unordered(_load_shard, tasks), 1):
+            result.merge(shard_result)
+            print(f"Shard {done}/{len(tasks)} loaded: {result.inserted} inserted, "
+                  f"{result.duplicates} duplicates so far.")
+    result.elapsed = time.perf_counter() - start
+
+    status = "complete" if result.ok else \
+        f"FAILED ({len(result.failed_shards)} of {len(tasks)} shards: {result.error})"
+    print(f"Parallel insertion {status}. {result.inserted} new rows inserted, "
+          f"{result.duplicates} duplicates ignored, {result.skipped} rows skipped.")
+    return result
 
 
 # This section is for demonstration and testing purposes if you run seed.py directly.
@@ -224,7 +1164,8 @@ if __name__ == "__main__":
 
             conn_prodev = connect_to_prodev()
             if conn_prodev:
-                if create_table(conn_prodev):
+                if create_table(conn_prodev) and enable_change_tracking(conn_prodev):
+                    migrate(conn_prodev)
                     # Create a dummy CSV for testing if not present
                     if not os.path.exists('user_data.csv'):
                         print("Creating dummy 'user_data.csv' for testing...")
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""Tests for the mergeable streaming aggregators in aggregates.py."""
+import functools
+import os
+import random
+import sqlite3
+import tempfile
+import unittest
+from array import array
+
+import aggregates
+import row_formats
+from users_fixture import make_users_db
+
+stream_ages = __import__("4-stream_ages")
+
+
+def split(values: list, parts: int) -> list:
+    """Splits `values` into `parts` interleaved partitions."""
+    return [values[i::parts] for i in range(parts)]
+
+
+class TestMergeableAggregators(unittest.TestCase):
+    """Tests that merged partial states match a single pass."""
+
+    def setUp(self) -> None:
+        """Builds a skewed sample of ages."""
+        rng = random.Random(42)
+        self.values = [min(int(rng.expovariate(1 / 20)), 119) for _ in range(50000)]
+
+    def merged(self, make) -> tuple:
+        """Returns the single-pass and merged-partials aggregators."""
+        whole = make().update(self.values)
+        parts = [make().update(part) for part in split(self.values, 4)]
+        merged = parts[0]
+        for part in parts[1:]:
+            merged.merge(part)
+        return whole, merged
+
+    def test_exact_aggregators_merge_exactly(self) -> None:
+        """Tests RunningStats, Histogram and HyperLogLog merges."""
+        whole, merged = self.merged(aggregates.RunningStats)
+        self.assertEqual(whole.count, merged.count)
+        self.assertEqual(whole.total, merged.total)
+        self.assertAlmostEqual(whole.variance, merged.variance)
+
+        whole, merged = self.merged(lambda: aggregates.Histogram(0, 100, 20))
+        self.assertEqual(whole.value, merged.value)
+        self.assertEqual(whole.overflow, sum(v >= 100 for v in self.values))
+        self.assertEqual(merged.count, len(self.values))
+
+        whole, merged = self.merged(aggregates.HyperLogLog)
+        self.assertEqual(whole.registers, merged.registers)
+        self.assertAlmostEqual(whole.value, len(set(self.values)), delta=2)
+
+        with self.assertRaises(ValueError):
+            aggregates.Histogram(0, 100, 20).merge(aggregates.Histogram(0, 100, 10))
+
+    def test_numpy_paths_match_python(self) -> None:
+        """Tests that buffer updates give the same results as iterables."""
+        ages = array("i", self.values)
+        histogram = aggregates.Histogram(0, 100, 20).update(memoryview(ages))
+        self.assertEqual(histogram.value,
+                         aggregates.Histogram(0, 100, 20).update(self.values).value)
+        stats = aggregates.RunningStats().update(ages)
+        self.assertEqual(stats.count, len(self.values))
+        self.assertAlmostEqual(stats.mean, sum(self.values) / len(self.values))
+
+    def test_top_k_finds_heavy_hitters(self) -> None:
+        """Tests TopK counts stay within the Misra-Gries error bound."""
+        whole, merged = self.merged(lambda: aggregates.TopK(5, capacity=20))
+        exact = sorted(((v, self.values.count(v)) for v in set(self.values)),
+                       key=lambda item: -item[1])[:5]
+        for summary in (whole, merged):
+            self.assertLessEqual(len(summary.counters), 20)
+            self.assertLessEqual(summary.error, len(self.values) / 21)
+            self.assertEqual([v for v, _ in summary.value], [v for v, _ in exact])
+            for (_, estimate), (_, count) in zip(summary.value, exact):
+                self.assertLessEqual(count - summary.error, estimate)
+                self.assertLessEqual(estimate, count)
+
+    def test_distinct_count_error(self) -> None:
+        """Tests the HyperLogLog estimate over many distinct values."""
+        parts = [aggregates.HyperLogLog().update(f"user{i}@example.com"
+                                                 for i in range(j, 200000, 4))
+                 for j in range(4)]
+        for part in parts[1:]:
+            parts[0].merge(part)
+        self.assertLess(abs(parts[0].value - 200000) / 200000, 0.05)
+        self.assertEqual(len(parts[0].registers), 4096)
+
+    def test_quantile_sketch_rank_error(self) -> None:
+        """Tests that merged sketches stay small and accurate."""
+        whole, merged = self.merged(aggregates.QuantileSketch)
+        ordered = sorted(self.values)
+        for sketch in (whole, merged):
+            self.assertEqual(sketch.count, len(self.values))
+            self.assertLess(sketch.size, 3 * sketch.k + 64)
+            for q in (0.1, 0.5, 0.9, 0.99):
+                estimate = sketch.quantile(q)
+                low = ordered.index(estimate) / len(ordered)
+                high = (len(ordered) - ordered[::-1].index(estimate)) / len(ordered)
+                self.assertLess(max(low - q, q - high, 0), 0.02)
+
+
+class TestAggregation(unittest.TestCase):
+    """Tests feeding aggregators from the user_data generators."""
+
+    def setUp(self) -> None:
+        """Builds a populated SQLite stand-in."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "users.db")
+        make_users_db(self.path, 7000)
+        self.ages = [18 + i % 70 for i in range(7000)]
+
+    def tearDown(self) -> None:
+        """Removes the stand-in."""
+        self.tmpdir.cleanup()
+
+    def make(self) -> aggregates.Aggregation:
+        """Returns an empty set of aggregators over the ages."""
+        return aggregates.Aggregation({
+            "stats": aggregates.RunningStats(),
+            "histogram": aggregates.Histogram(0, 100, 10),
+            "top": aggregates.TopK(3),
+            "distinct": aggregates.HyperLogLog(),
+        }, field="age")
+
+    def test_every_item_shape(self) -> None:
+        """Tests rows, pages, columnar batches and plain values."""
+        rows = [row_formats.UserRecord(f"{i}", "n", "e", age)
+                for i, age in enumerate(self.ages)]
+        sources = [
+            [row._asdict() for row in rows],
+            rows,
+            [rows[i:i + 1000] for i in range(0, len(rows), 1000)],
+            [row_formats.ColumnarBatch.from_rows(rows[i:i + 999])
+             for i in range(0, len(rows), 999)],
+        ]
+        expected = None
+        for source in sources:
+            value = self.make().consume(source).value
+            self.assertEqual(value["stats"]["count"], 7000)
+            self.assertAlmostEqual(value["distinct"], 70, delta=2)
+            expected = expected or value
+            for name in ("histogram", "distinct"):
+                self.assertEqual(value[name], expected[name])
+            self.assertAlmostEqual(value["stats"]["variance"], expected["stats"]["variance"])
+        plain = aggregates.Aggregation({"stats": aggregates.RunningStats()})
+        stats = plain.consume(iter(self.ages)).value["stats"]
+        self.assertEqual(stats["sum"], expected["stats"]["sum"])
+        self.assertAlmostEqual(stats["mean"], expected["stats"]["mean"])
+
+    def test_empty_keeps_parameters_but_not_state(self) -> None:
+        """Tests that empty() resets every accumulator of a used Aggregation."""
+        used = self.make()
+        used.aggregators["quantiles"] = aggregates.QuantileSketch(k=50, quantiles=(0.25,))
+        used.consume(iter([{"age": age} for age in self.ages]))
+        fresh = used.empty()
+        self.assertEqual(used["stats"].count, 7000)
+        self.assertEqual((fresh.field, fresh.chunk_size), (used.field, used.chunk_size))
+        self.assertEqual(fresh["stats"].count, 0)
+        self.assertEqual(sum(fresh["histogram"].counts), 0)
+        self.assertEqual((fresh["histogram"].low, fresh["histogram"].high,
+                          fresh["histogram"].bins), (0, 100, 10))
+        self.assertEqual((fresh["top"].k, fresh["top"].counters), (3, {}))
+        self.assertEqual(fresh["distinct"].value, 0)
+        self.assertEqual((fresh["quantiles"].k, fresh["quantiles"].quantiles,
+                          fresh["quantiles"].count), (50, (0.25,), 0))
+        median = aggregates.P2Quantile(0.5)
+        for age in self.ages:
+            median.add(age)
+        self.assertEqual((median.empty().p, median.empty().count), (0.5, 0))
+
+    def test_parallel_age_summary(self) -> None:
+        """Tests that a partitioned scan merges into the single-pass result."""
+        connect = functools.partial(sqlite3.connect, self.path)
+        summary = stream_ages.parallel_age_summary(self.make(), partitions=3,
+                                                   connect=connect)
+        single = self.make().consume(stream_ages.stream_user_ages(connect()))
+        self.assertEqual(summary["stats"].count, 7000)
+        self.assertEqual(summary["histogram"].value, single["histogram"].value)
+        self.assertEqual(summary["distinct"].registers, single["distinct"].registers)
+        self.assertAlmostEqual(summary["stats"].mean, sum(self.ages) / 7000)
+        # A used Aggregation only gives the shape of the partials.
+        again = stream_ages.parallel_age_summary(summary, partitions=3, connect=connect)
+        self.assertEqual(again["stats"].count, 7000)
+
+
+if __name__ == "__main__":
+    unittest.main()
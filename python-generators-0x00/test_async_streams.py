@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""Tests for the async generators in async_streams.py."""
+import asyncio
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import aiosqlite
+
+import pagination
+import row_formats
+import async_streams
+from users_fixture import make_users_db
+
+ROWS = 2500
+
+
+class TestAsyncStreams(unittest.IsolatedAsyncioTestCase):
+    """Tests the async generators against their blocking counterparts."""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        """Builds the SQLite stand-in once for all tests."""
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.db_path = os.path.join(cls.tmpdir.name, "users.db")
+        make_users_db(cls.db_path, ROWS)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        """Removes the SQLite stand-in."""
+        cls.tmpdir.cleanup()
+
+    async def asyncSetUp(self) -> None:
+        """Opens an aiosqlite connection and a blocking one to compare with."""
+        self.connection = await aiosqlite.connect(self.db_path)
+        self.sync_connection = sqlite3.connect(self.db_path)
+
+    async def asyncTearDown(self) -> None:
+        """Closes both connections."""
+        await self.connection.close()
+        self.sync_connection.close()
+
+    async def test_stream_users_async(self) -> None:
+        """Tests that rows match the blocking dict rows."""
+        rows = [row async for row in async_streams.stream_users_async(
+            fetch_size=100, connection=self.connection)]
+        expected = list(__import__('0-stream_users').stream_users(
+            connection=self.sync_connection))
+        self.assertEqual(rows, expected)
+
+    async def test_batches_match_blocking_pages(self) -> None:
+        """Tests that every row format pages exactly like the blocking engine."""
+        for row_format in row_formats.FORMATS:
+            batches = [batch async for batch in async_streams.stream_users_in_batches_async(
+                1000, connection=self.connection, row_format=row_format)]
+            expected = list(pagination.iter_pages(
+                self.sync_connection, 1000, row_format=row_format))
+            self.assertEqual([len(b) for b in batches], [1000, 1000, 500])
+            self.assertEqual([row_formats.last_user_id(b) for b in batches],
+                             [row_formats.last_user_id(b) for b in expected])
+
+    async def test_lazy_pagination_resumes_from_cursor(self) -> None:
+        """Tests keyset resume tokens and stats in the async paginator."""
+        first = None
+        async for page in async_streams.lazy_pagination_async(
+                1000, connection=self.connection):
+            first = page
+            break
+        stats = pagination.PaginationStats()
+        rest = [page async for page in async_streams.lazy_pagination_async(
+            1000, cursor_token=pagination.cursor_for(first),
+            connection=self.connection, stats=stats)]
+        self.assertEqual(stats.rows, ROWS - 1000)
+        self.assertGreater(rest[0][0]["user_id"], first[-1]["user_id"])
+
+    async def test_concurrency_is_bounded(self) -> None:
+        """Tests that gather_bounded never runs more than `limit` scans."""
+        running = 0
+        peak = 0
+
+        async def scan() -> int:
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            async with aiosqlite.connect(self.db_path) as connection:
+                total = 0
+                async for age in async_streams.stream_user_ages_async(
+                        connection=connection):
+                    total += age
+                    if total % 97 == 0:
+                        await asyncio.sleep(0)
+            running -= 1
+            return total
+
+        totals = await async_streams.gather_bounded([scan() for _ in range(6)], 2)
+        self.assertEqual(len(set(totals)), 1)
+        self.assertLessEqual(peak, 2)
+
+
+    async def test_failed_connect_releases_the_limiter(self) -> None:
+        """Tests that a connect that raises or is cancelled frees its slot."""
+        limiter = asyncio.Semaphore(1)
+        connect = async_streams.connect_to_prodev_async
+        self.addCleanup(setattr, async_streams, "connect_to_prodev_async", connect)
+
+        async def refuse():
+            raise OSError("connection refused")
+        async_streams.connect_to_prodev_async = refuse
+        with self.assertRaises(OSError):
+            async for _ in async_streams.stream_user_ages_async(limiter=limiter):
+                pass
+        self.assertFalse(limiter.locked())
+
+        async def hang():
+            await asyncio.sleep(60)
+        async_streams.connect_to_prodev_async = hang
+
+        async def scan():
+            async for _ in async_streams.stream_user_ages_async(limiter=limiter):
+                pass
+        task = asyncio.ensure_future(scan())
+        await asyncio.sleep(0.01)
+        self.assertTrue(limiter.locked())
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertFalse(limiter.locked())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""Tests for the bounded producer/consumer pipeline in batch_pipeline.py."""
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+import batch_pipeline
+from users_fixture import make_users_db
+
+batch_processing = __import__("1-batch_processing")
+
+ROWS = 2000
+
+
+def double_age(user: dict) -> int:
+    """A per-user function that can be pickled for worker processes."""
+    return user["age"] * 2
+
+
+class TestRunPipeline(unittest.TestCase):
+    """Tests results, counters, backpressure and error handling."""
+
+    def setUp(self) -> None:
+        """Builds a populated SQLite stand-in."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "users.db")
+        make_users_db(self.path, ROWS)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+
+    def tearDown(self) -> None:
+        """Closes the connection and removes the stand-in."""
+        self.connection.close()
+        self.tmpdir.cleanup()
+
+    def test_every_batch_is_processed_once(self) -> None:
+        """Tests results and per-stage counters with threads and processes."""
+        expected = sorted((18 + i % 70) * 2 for i in range(ROWS))
+        for processes in (False, True):
+            results = []
+            stats = batch_processing.parallel_batch_processing(
+                batch_pipeline.map_rows(double_age), 128, sink=results.extend,
+                workers=3, processes=processes, connection=self.connection)
+            self.assertEqual(sorted(results), expected)
+            for stage in stats.stages:
+                self.assertEqual((stage.batches, stage.rows), (16, ROWS))
+            self.assertGreater(stats.fetch.rows_per_second, 0)
+
+    def test_io_bound_work_overlaps(self) -> None:
+        """Tests that slow processing runs on the workers in parallel."""
+        def enrich(batch: list) -> list:
+            time.sleep(0.02)
+            return batch
+        batches = [[i] for i in range(20)]
+        start = time.perf_counter()
+        stats = batch_pipeline.run_pipeline(batches, enrich, workers=5)
+        self.assertLess(time.perf_counter() - start, 20 * 0.02 / 2)
+        self.assertGreaterEqual(stats.workers.busy_time, 20 * 0.02)
+
+    def test_slow_sink_holds_back_the_fetch_stage(self) -> None:
+        """Tests that bounded queues cap the batches in flight."""
+        fetched = []
+        sunk = []
+        in_flight = []
+
+        def source():
+            for i in range(60):
+                fetched.append(i)
+                in_flight.append(len(fetched) - len(sunk))
+                yield [i]
+
+        def sink(result: list) -> None:
+            time.sleep(0.002)
+            sunk.append(result)
+
+        stats = batch_pipeline.run_pipeline(source(), lambda batch: batch, sink,
+                                            workers=2, queue_size=3)
+        self.assertEqual(len(sunk), 60)
+        self.assertLessEqual(max(in_flight), 2 * 3 + 2 + 2)
+        self.assertGreater(stats.fetch.wait_time, 0)
+
+    def test_errors_stop_every_stage(self) -> None:
+        """Tests that a failing batch is re-raised and the source is closed."""
+        closed = threading.Event()
+
+        def source():
+            try:
+                for i in range(1000):
+                    yield [i]
+            finally:
+                closed.set()
+
+        def process(batch: list) -> list:
+            if batch[0] == 10:
+                raise RuntimeError("enrichment failed")
+            return batch
+
+        with self.assertRaisesRegex(RuntimeError, "enrichment failed"):
+            batch_pipeline.run_pipeline(source(), process, workers=3)
+        self.assertTrue(closed.is_set())
+        self.assertFalse(any(thread.name.startswith("pipeline-")
+                             for thread in threading.enumerate()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""Tests for the memory-mapped columnar cache in column_cache.py."""
+import json
+import mmap
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+import unittest
+
+import pagination
+import pipeline
+import row_formats
+import column_cache
+from users_fixture import fill_users
+
+ROWS = 3000
+
+
+class TestColumnCache(unittest.TestCase):
+    """Tests exporting, reading and invalidating the column cache."""
+
+    def setUp(self) -> None:
+        """Builds a populated SQLite stand-in and a cache path."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "user_data.cache")
+        self.connection = sqlite3.connect(os.path.join(self.tmpdir.name, "users.db"))
+        fill_users(self.connection, ROWS, name="Üser {}")
+
+    def tearDown(self) -> None:
+        """Closes the connection and removes the stand-in."""
+        self.connection.close()
+        self.tmpdir.cleanup()
+
+    def test_round_trip_matches_the_table(self) -> None:
+        """Tests that cached batches hold exactly the rows of the table."""
+        with column_cache.open_cache(self.path, self.connection) as cache:
+            cached = [row for batch in cache.batches(700) for row in batch.rows()]
+            expected = [row for batch in pagination.iter_pages(
+                self.connection, 1000, row_format=row_formats.TUPLE) for row in batch]
+            self.assertEqual(cached, expected)
+            self.assertEqual(cache.column("name")[-1], f"Üser {ROWS - 1}")
+
+    def test_columns_are_zero_copy_views_of_the_map(self) -> None:
+        """Tests that columns and batches are backed by the memory map."""
+        with column_cache.open_cache(self.path, self.connection) as cache:
+            ages = cache.column("age")
+            self.assertIsInstance(ages.obj, mmap.mmap)
+            batch = next(cache.batches(100, columns=("age",)))
+            self.assertIsInstance(batch.age.obj, mmap.mmap)
+            self.assertIsNone(batch.name)
+            del ages, batch
+
+    def test_age_stats_and_pipeline_filters(self) -> None:
+        """Tests aggregations and pipeline stages over cached batches."""
+        ages = [18 + i % 70 for i in range(ROWS)]
+        with column_cache.open_cache(self.path, self.connection) as cache:
+            stats = cache.age_stats()
+            self.assertEqual((stats.count, stats.total, stats.min, stats.max),
+                             (ROWS, sum(ages), min(ages), max(ages)))
+            self.assertAlmostEqual(stats.variance, statistics.pvariance(ages))
+            adults = pipeline.Pipeline().filter(pipeline.where("age", ">", 80))
+            kept = sum(len(batch) for batch in adults.run(cache.batches(1000)))
+            self.assertEqual(kept, sum(age > 80 for age in ages))
+
+    def test_table_changes_invalidate_the_cache(self) -> None:
+        """Tests that inserts, updates and deletes force a re-export."""
+        column_cache.open_cache(self.path, self.connection).close()
+        exported = os.stat(self.path).st_mtime_ns
+        column_cache.open_cache(self.path, self.connection).close()
+        self.assertEqual(os.stat(self.path).st_mtime_ns, exported)
+
+        changes = [
+            "UPDATE user_data SET age = 99 WHERE user_id = '000000000000000000000000000000000042'",
+            "INSERT INTO user_data (user_id, name, email, age) VALUES ('x', 'X', 'x@example.com', 40)",
+            "DELETE FROM user_data WHERE user_id = '000000000000000000000000000000000007'",
+        ]
+        for change in changes:
+            time.sleep(0.005)
+            self.connection.execute(change)
+            self.connection.commit()
+            cache = column_cache.ColumnCache(self.path)
+            self.assertFalse(cache.is_fresh(self.connection))
+            cache.close()
+            with column_cache.open_cache(self.path, self.connection) as cache:
+                self.assertTrue(cache.is_fresh(self.connection))
+                count = self.connection.execute("SELECT COUNT(*) FROM user_data").fetchone()[0]
+                self.assertEqual(cache.rows, count)
+
+    def test_rejects_files_that_are_not_caches(self) -> None:
+        """Tests that foreign files are detected and replaced on open."""
+        with open(self.path, "wb") as file:
+            file.write(b"not a cache at all, just some bytes")
+        with self.assertRaises(ValueError):
+            column_cache.ColumnCache(self.path)
+        with column_cache.open_cache(self.path, self.connection) as cache:
+            self.assertEqual(cache.rows, ROWS)
+
+    def rewrite_metadata(self, edit) -> None:
+        """Replaces the metadata of the cache file with `edit(metadata)`."""
+        with open(self.path, "rb") as file:
+            data = file.read()
+        offset, length, magic = column_cache.TRAILER.unpack_from(
+            data, len(data) - column_cache.TRAILER.size)
+        metadata = edit(json.loads(data[offset:offset + length]))
+        encoded = json.dumps(metadata).encode("utf-8")
+        with open(self.path, "wb") as file:
+            file.write(data[:offset] + encoded
+                       + column_cache.TRAILER.pack(offset, len(encoded), magic))
+
+    def mappings(self) -> int:
+        """Returns how many times the cache file is mapped into this process."""
+        with open("/proc/self/maps") as maps:
+            return sum(self.path in line for line in maps)
+
+    @unittest.skipUnless(os.path.exists("/proc/self/maps"), "needs /proc/self/maps")
+    def test_corrupt_metadata_is_rejected_and_rebuilt(self) -> None:
+        """Tests that bad metadata raises ValueError, unmaps the file and is rebuilt."""
+        edits = [
+            lambda metadata: {k: v for k, v in metadata.items() if k != "sections"},
+            lambda metadata: {k: v for k, v in metadata.items() if k != "rows"},
+            lambda metadata: dict(metadata, age_typecode="Z"),
+            lambda metadata: dict(metadata, rows="many"),
+            lambda metadata: dict(metadata, sections={"age": [0, 8]}),
+            lambda metadata: dict(metadata, sections=[1, 2]),
+            lambda metadata: [metadata],
+        ]
+        for edit in edits:
+            self.assertEqual(column_cache.export_cache(self.path, self.connection), ROWS)
+            self.rewrite_metadata(edit)
+            with self.assertRaises(ValueError):
+                column_cache.ColumnCache(self.path)
+            self.assertEqual(self.mappings(), 0)
+            with column_cache.open_cache(self.path, self.connection) as cache:
+                self.assertEqual(cache.rows, ROWS)
+                self.assertTrue(cache.is_fresh(self.connection))
+
+    def test_failed_export_leaves_no_temporary_file(self) -> None:
+        """Tests that an export that cannot write its file cleans up after itself."""
+        os.mkdir(self.path)  # the final rename onto a directory fails
+        self.assertIsNone(column_cache.export_cache(self.path, self.connection))
+        self.assertFalse(os.path.exists(f"{self.path}.tmp"))
+
+
+if __name__ == "__main__":
+    unittest.main()
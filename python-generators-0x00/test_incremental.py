@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""Tests for the incremental change stream in incremental.py."""
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+import seed
+import pagination
+import incremental
+from users_fixture import fill_users
+
+ROWS = 5000
+
+
+class TestStreamChangedUsers(unittest.TestCase):
+    """Tests that repeated runs only read the rows changed in between."""
+
+    def setUp(self) -> None:
+        """Builds a populated SQLite stand-in and a checkpoint path."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.checkpoint = os.path.join(self.tmpdir.name, "users.checkpoint")
+        self.connection = sqlite3.connect(os.path.join(self.tmpdir.name, "users.db"))
+        fill_users(self.connection, ROWS)
+        self.tick()
+
+    def tearDown(self) -> None:
+        """Closes the connection and removes the stand-in."""
+        self.connection.close()
+        self.tmpdir.cleanup()
+
+    def tick(self) -> None:
+        """Waits past the millisecond resolution of SQLite's timestamps."""
+        time.sleep(0.005)
+
+    def run_job(self, batch_size: int = 1000) -> tuple:
+        """Runs one incremental pass and returns its rows and stats."""
+        stats = pagination.PaginationStats()
+        rows = list(incremental.stream_changed_users(
+            self.checkpoint, batch_size, connection=self.connection, stats=stats))
+        self.tick()
+        return rows, stats
+
+    def test_runs_touch_only_the_delta(self) -> None:
+        """Tests that after the first full run only new changes are read."""
+        rows, stats = self.run_job()
+        self.assertEqual(len(rows), ROWS)
+        self.assertEqual(stats.rows, ROWS)
+
+        rows, stats = self.run_job()
+        self.assertEqual(rows, [])
+        self.assertEqual(stats.rows, 0)
+
+        updated = [f"{i:036d}" for i in (4321, 7, 2500)]
+        self.connection.executemany(
+            "UPDATE user_data SET age = age + 1 WHERE user_id = ?",
+            ((user_id,) for user_id in updated))
+        self.connection.execute(
+            "INSERT INTO user_data (user_id, name, email, age) "
+            "VALUES ('new-user', 'New User', 'new@example.com', 30)")
+        self.connection.commit()
+
+        rows, stats = self.run_job(batch_size=2)
+        self.assertCountEqual([row["user_id"] for row in rows], updated + ["new-user"])
+        self.assertEqual(stats.rows, 4)
+        ages = {row["user_id"]: row["age"] for row in rows}
+        self.assertEqual(ages[updated[0]], 18 + 4321 % 70 + 1)
+
+        rows, stats = self.run_job()
+        self.assertEqual(stats.rows, 0)
+
+    def test_query_seeks_on_the_updated_at_index(self) -> None:
+        """Tests that the delta query is an index range scan, not a table scan."""
+        checkpoint = incremental.Checkpoint("2026-01-01 00:00:00.000", "x")
+        query, params = incremental.changes_query("?", 1000, checkpoint)
+        plan = self.connection.execute(
+            f"EXPLAIN QUERY PLAN {query}", ("9999",) + params).fetchall()
+        detail = " ".join(row[-1] for row in plan)
+        self.assertIn("idx_user_data_updated_at", detail)
+        self.assertNotIn("TEMP B-TREE", detail)
+
+    def test_stopping_early_redelivers_the_unfinished_batch(self) -> None:
+        """Tests that the checkpoint only moves past fully consumed batches."""
+        stream = incremental.stream_changed_users(
+            self.checkpoint, 1000, connection=self.connection)
+        first = [next(stream) for _ in range(1500)]
+        stream.close()
+        rows, _ = self.run_job()
+        self.assertEqual(rows[0], first[1000])
+        self.assertEqual(len(rows), ROWS - 1000)
+
+    def test_enable_change_tracking_migrates_old_tables(self) -> None:
+        """Tests that a table without updated_at can be migrated in place."""
+        connection = sqlite3.connect(":memory:")
+        connection.execute(
+            "CREATE TABLE user_data (user_id VARCHAR(36) PRIMARY KEY, "
+            "name VARCHAR(255) NOT NULL, email VARCHAR(255) NOT NULL, age INT NOT NULL)")
+        connection.execute("INSERT INTO user_data VALUES ('a', 'A', 'a@example.com', 20)")
+        self.assertTrue(seed.enable_change_tracking(connection))
+        self.assertTrue(seed.enable_change_tracking(connection))
+        self.tick()
+        checkpoint = os.path.join(self.tmpdir.name, "migrated.checkpoint")
+        self.assertEqual(len(list(incremental.stream_changed_users(
+            checkpoint, connection=connection))), 1)
+        self.tick()
+        connection.execute(
+            "INSERT INTO user_data (user_id, name, email, age) "
+            "VALUES ('b', 'B', 'b@example.com', 21)")
+        self.tick()
+        rows = list(incremental.stream_changed_users(checkpoint, connection=connection))
+        self.assertEqual([row["user_id"] for row in rows], ["b"])
+        connection.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Tests for index_advisor.py and the migrations in seed.py."""
+import sqlite3
+import unittest
+
+import seed
+import index_advisor
+from users_fixture import fill_users
+
+ROWS = 20000
+
+
+class TestIndexAdvisor(unittest.TestCase):
+    """Tests proposals, migrations and the before/after report."""
+
+    def setUp(self) -> None:
+        """Builds an in-memory SQLite stand-in with only the seed schema."""
+        self.connection = sqlite3.connect(":memory:")
+        fill_users(self.connection, ROWS)
+
+    def tearDown(self) -> None:
+        """Closes the stand-in."""
+        self.connection.close()
+
+    def test_dry_run_proposes_age_and_email_indexes(self) -> None:
+        """Tests that scans are detected and merged into two proposals."""
+        report = index_advisor.advise(self.connection, runs=1, apply=False)
+        proposed = {m.name: m.columns for m in report.proposed}
+        self.assertEqual(proposed, {"idx_user_data_age": ("age",),
+                                    "idx_user_data_email": ("email",)})
+        self.assertEqual(seed.applied_migrations(self.connection), set())
+        plans = {r.shape.name: r.plan_before for r in report.shapes}
+        self.assertEqual(plans["lookup by email"].access, "scan")
+        self.assertTrue(plans["age percentile"].sort)
+        self.assertEqual(plans["batch page, age > 25"].access, "search")
+
+    def test_apply_keeps_indexes_that_pay_off(self) -> None:
+        """Tests the migration step and the before/after latencies."""
+        report = index_advisor.advise(self.connection, runs=3)
+        self.assertIn("idx_user_data_email", [m.name for m in report.kept])
+        self.assertIn("idx_user_data_email",
+                      seed.applied_migrations(self.connection))
+        email = next(r for r in report.shapes if r.shape.name == "lookup by email")
+        self.assertEqual(email.plan_after.access, "search")
+        self.assertGreater(email.speedup, 10)
+        again = index_advisor.advise(self.connection, runs=1, apply=False)
+        self.assertEqual(again.proposed, [])
+
+    def test_migrate_is_idempotent_and_revertible(self) -> None:
+        """Tests seed.migrate, seed.revert and the bookkeeping table."""
+        self.assertEqual(seed.migrate(self.connection),
+                         [m.name for m in seed.MIGRATIONS])
+        self.assertEqual(seed.migrate(self.connection), [])
+        indexes = index_advisor.existing_indexes(self.connection)
+        self.assertIn(("email",), indexes)
+        self.assertTrue(seed.revert(self.connection, seed.MIGRATIONS[0]))
+        self.assertNotIn(("email",), index_advisor.existing_indexes(self.connection))
+        self.assertFalse(seed.revert(self.connection, seed.MIGRATIONS[0]))
+        self.assertEqual(seed.migrate(self.connection), ["idx_user_data_email"])
+
+
+if __name__ == "__main__":
+    unittest.main()
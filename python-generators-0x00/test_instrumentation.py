@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Tests for the per-call instrumentation in instrumentation.py."""
+import csv
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import seed
+import instrumentation
+from users_fixture import fill_users
+
+stream_users_module = __import__("0-stream_users")
+lazy_paginate = __import__("2-lazy_paginate")
+
+ROWS = 1000
+
+
+class TestInstrumentation(unittest.TestCase):
+    """Tests what the data-layer functions record, enabled and disabled."""
+
+    def setUp(self) -> None:
+        """Builds a populated SQLite stand-in and clears recorded calls."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.connection = sqlite3.connect(os.path.join(self.tmpdir.name, "users.db"))
+        fill_users(self.connection, ROWS)
+        instrumentation.reset()
+
+    def tearDown(self) -> None:
+        """Turns instrumentation off again and removes the stand-in."""
+        instrumentation.disable()
+        instrumentation.reset()
+        self.connection.close()
+        self.tmpdir.cleanup()
+
+    def test_disabled_records_nothing(self) -> None:
+        """Tests that a disabled call is the shared no-op object."""
+        instrumentation.disable()
+        self.assertIs(instrumentation.call("stream_users"), instrumentation.NULL_CALL)
+        rows = list(stream_users_module.stream_users(connection=self.connection))
+        self.assertEqual(len(rows), ROWS)
+        self.assertEqual(instrumentation.snapshot(), {})
+
+    def test_stream_users_records_rows_and_phases(self) -> None:
+        """Tests row counts, byte estimates and phase timings of a scan."""
+        instrumentation.enable()
+        for _ in range(2):
+            for _ in stream_users_module.stream_users(connection=self.connection):
+                pass
+        stats = instrumentation.snapshot()["stream_users"]
+        self.assertEqual((stats["calls"], stats["errors"], stats["rows"]), (2, 0, 2 * ROWS))
+        exact = 2 * sum(instrumentation.payload_size(row) for row in
+                        self.connection.execute(
+                            "SELECT user_id, name, email, age FROM user_data"))
+        self.assertLess(abs(stats["bytes_read"] - exact) / exact, 0.05)
+        for phase in ("execute", "fetch", "yield"):
+            self.assertGreater(stats["seconds"][phase], 0)
+        self.assertLessEqual(sum(stats["seconds"].values()), stats["total_seconds"])
+        self.assertGreaterEqual(stats["max_seconds"], stats["total_seconds"] / 2)
+
+    def test_lazy_pagination_records_pages(self) -> None:
+        """Tests that page fetches are counted under lazy_pagination."""
+        instrumentation.enable()
+        pages = list(lazy_paginate.lazy_pagination(300, connection=self.connection))
+        self.assertEqual(sum(map(len, pages)), ROWS)
+        stats = instrumentation.snapshot()["lazy_pagination"]
+        self.assertEqual((stats["calls"], stats["rows"]), (1, ROWS))
+        self.assertGreater(stats["seconds"]["execute"], 0)
+        self.assertGreater(stats["bytes_sent"], 0)
+
+    def test_bulk_insert_records_rows_written(self) -> None:
+        """Tests that writes are counted under bulk_insert_data."""
+        path = os.path.join(self.tmpdir.name, "users.csv")
+        with open(path, "w", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file)
+            writer.writerow(["user_id", "name", "email", "age"])
+            writer.writerows([f"new-{i}", f"New {i}", f"new{i}@example.com", 30]
+                             for i in range(250))
+        instrumentation.enable()
+        result = seed.bulk_insert_data(self.connection, path, batch_size=100,
+                                       use_load_data=False)
+        self.assertEqual(result.inserted, 250)
+        stats = instrumentation.snapshot()["bulk_insert_data"]
+        self.assertEqual((stats["calls"], stats["rows_written"]), (1, 250))
+        self.assertGreater(stats["bytes_sent"], 250 * 8)
+
+    def test_prometheus_text(self) -> None:
+        """Tests the exposition format and that reset forgets every call."""
+        instrumentation.enable()
+        list(stream_users_module.stream_users(connection=self.connection))
+        text = instrumentation.prometheus_text()
+        self.assertTrue(text.endswith("\n"))
+        self.assertIn("# TYPE user_data_calls_total counter", text)
+        self.assertIn('user_data_calls_total{function="stream_users"} 1', text)
+        self.assertIn(f'user_data_rows_read_total{{function="stream_users"}} {ROWS}', text)
+        self.assertIn('user_data_phase_seconds_total{function="stream_users",phase="fetch"}',
+                      text)
+        self.assertIn('user_data_call_seconds_count{function="stream_users"} 1', text)
+        instrumentation.reset()
+        self.assertNotIn("stream_users", instrumentation.prometheus_text())
+
+
+if __name__ == "__main__":
+    unittest.main()
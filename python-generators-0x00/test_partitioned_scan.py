@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""Tests for the range-partitioned scans in partitioned_scan.py."""
+import functools
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import partitioned_scan
+import row_formats
+from users_fixture import make_users_db
+
+ROWS = 1000
+
+
+def count_rows(batch) -> int:
+    """A mapper that can be pickled for worker processes."""
+    return len(batch.user_id)
+
+
+def add(left: int, right: int) -> int:
+    """A reducer that can be pickled for worker processes."""
+    return left + right
+
+
+class TestPartitionedScan(unittest.TestCase):
+    """Tests the partition plan, both scan orders and map_reduce."""
+
+    def setUp(self) -> None:
+        """Builds a populated SQLite stand-in."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "users.db")
+        make_users_db(self.path, ROWS)
+        self.connect = functools.partial(sqlite3.connect, self.path,
+                                         check_same_thread=False)
+        self.user_ids = [f"{i:036d}" for i in range(ROWS)]
+
+    def tearDown(self) -> None:
+        """Removes the stand-in."""
+        self.tmpdir.cleanup()
+
+    def plan(self, count: int) -> list:
+        """Plans `count` partitions over a short-lived connection."""
+        connection = self.connect()
+        try:
+            return partitioned_scan.plan_partitions(connection, count)
+        finally:
+            connection.close()
+
+    def test_plan_covers_the_key_space_in_even_ranges(self) -> None:
+        """Tests that the ranges are contiguous, unbounded at both ends and even."""
+        plan = self.plan(4)
+        self.assertEqual(len(plan), 4)
+        self.assertIsNone(plan[0].low)
+        self.assertIsNone(plan[-1].high)
+        for left, right in zip(plan, plan[1:]):
+            self.assertEqual(left.high, right.low)
+        self.assertEqual(plan[0].high, self.user_ids[ROWS // 4 - 1])
+
+    def test_more_partitions_than_rows(self) -> None:
+        """Tests that no negative offset is probed and every row is covered."""
+        connection = sqlite3.connect(self.path)
+        connection.execute("DELETE FROM user_data WHERE age > 20")
+        connection.commit()
+        remaining = [row[0] for row in connection.execute(
+            "SELECT user_id FROM user_data ORDER BY user_id LIMIT 3")]
+        connection.execute("DELETE FROM user_data WHERE user_id > ?", (remaining[-1],))
+        connection.commit()
+        connection.close()
+        plan = self.plan(10)
+        self.assertEqual(len(plan), 3)
+        self.assertEqual([partition.high for partition in plan], remaining[:2] + [None])
+        batches = partitioned_scan.partitioned_scan(plan, batch_size=2, ordered=True,
+                                                    connect=self.connect)
+        self.assertEqual([user_id for batch in batches for user_id in batch.user_id],
+                         remaining)
+
+    def test_empty_table_has_one_unbounded_partition(self) -> None:
+        """Tests the plan of an empty table."""
+        connection = sqlite3.connect(self.path)
+        connection.execute("DELETE FROM user_data")
+        connection.commit()
+        connection.close()
+        self.assertEqual(self.plan(4), [partitioned_scan.Partition()])
+
+    def test_ordered_scan_yields_user_id_order(self) -> None:
+        """Tests that an ordered scan merges the partitions in key order."""
+        batches = partitioned_scan.partitioned_scan(4, batch_size=64, ordered=True,
+                                                    connect=self.connect)
+        user_ids = [user_id for batch in batches for user_id in batch.user_id]
+        self.assertEqual(user_ids, self.user_ids)
+
+    def test_unordered_scan_yields_every_row_once(self) -> None:
+        """Tests that arrival order loses and repeats nothing."""
+        batches = partitioned_scan.partitioned_scan(4, batch_size=64, depth=1,
+                                                    row_format=row_formats.TUPLE,
+                                                    connect=self.connect)
+        user_ids = [row[0] for batch in batches for row in batch]
+        self.assertEqual(sorted(user_ids), self.user_ids)
+
+    def test_stopping_early_joins_the_readers(self) -> None:
+        """Tests that closing the generator part way does not hang."""
+        batches = partitioned_scan.partitioned_scan(4, batch_size=16, depth=1,
+                                                    connect=self.connect)
+        self.assertEqual(len(next(batches).user_id), 16)
+        batches.close()
+
+    def test_map_reduce_with_threads_and_processes(self) -> None:
+        """Tests that every partition is folded into the result once."""
+        for processes in (False, True):
+            total = partitioned_scan.map_reduce(4, count_rows, add, batch_size=100,
+                                                processes=processes, connect=self.connect)
+            self.assertEqual(total, ROWS)
+
+
+if __name__ == "__main__":
+    unittest.main()
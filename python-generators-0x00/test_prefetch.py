@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""Tests for the read-ahead reader in pagination.prefetch."""
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+import pagination
+from users_fixture import make_users_db
+
+lazy_paginate = __import__('2-lazy_paginate')
+
+
+class Source:
+    """A page generator that records what the reader thread did with it."""
+
+    def __init__(self, pages: int, fail_after=None) -> None:
+        """Yields `pages` one-item pages, raising before page `fail_after`."""
+        self.pages = pages
+        self.fail_after = fail_after
+        self.produced = 0
+        self.closed_on = None
+
+    def __iter__(self):
+        """Counts the pages produced and the thread that closes the generator."""
+        try:
+            for page in range(self.pages):
+                if page == self.fail_after:
+                    raise RuntimeError("page query failed")
+                self.produced += 1
+                yield [page]
+        finally:
+            self.closed_on = threading.current_thread()
+
+
+def readers_alive() -> list:
+    """Returns the prefetch threads still running."""
+    return [thread for thread in threading.enumerate() if thread.name == "page-prefetch"]
+
+
+class TestPrefetch(unittest.TestCase):
+    """Tests backpressure, early close and error propagation."""
+
+    def test_slow_consumer_holds_at_most_depth_pages(self) -> None:
+        """Tests that the reader waits once `depth` pages are queued."""
+        source = Source(50)
+        pages = pagination.prefetch(source, 3)
+        consumed = []
+        for page in pages:
+            consumed.extend(page)
+            time.sleep(0.01)
+            # `depth` pages queued, plus one the reader holds while it waits.
+            self.assertLessEqual(source.produced - len(consumed), 3 + 1)
+            if len(consumed) == 5:
+                time.sleep(0.1)
+                self.assertEqual(source.produced - len(consumed), 3 + 1)
+        self.assertEqual(consumed, list(range(50)))
+        self.assertEqual(readers_alive(), [])
+
+    def test_early_close_stops_and_joins_the_reader(self) -> None:
+        """Tests that closing the consumer closes the pages on the reader thread."""
+        source = Source(1000)
+        pages = pagination.prefetch(source, 2)
+        self.assertEqual(next(pages), [0])
+        time.sleep(0.05)
+        pages.close()
+        self.assertEqual(readers_alive(), [])
+        self.assertIsNotNone(source.closed_on)
+        self.assertIsNot(source.closed_on, threading.current_thread())
+        self.assertLess(source.produced, 10)
+
+    def test_reader_error_is_raised_in_the_consumer(self) -> None:
+        """Tests that the pages before the error arrive and the error follows."""
+        source = Source(10, fail_after=4)
+        consumed = []
+        with self.assertRaisesRegex(RuntimeError, "page query failed"):
+            for page in pagination.prefetch(source, 2):
+                consumed.extend(page)
+        self.assertEqual(consumed, [0, 1, 2, 3])
+        self.assertEqual(readers_alive(), [])
+
+    def test_depth_must_be_positive(self) -> None:
+        """Tests the depth check."""
+        with self.assertRaises(ValueError):
+            next(pagination.prefetch(Source(1), 0))
+
+    def test_lazy_pagination_prefetch_matches_plain_paging(self) -> None:
+        """Tests lazy_pagination(prefetch=K) on a SQLite stand-in."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "users.db")
+            make_users_db(path, 1234)
+            connection = sqlite3.connect(path, check_same_thread=False)
+            try:
+                plain = list(lazy_paginate.lazy_pagination(100, connection=connection))
+                ahead = list(lazy_paginate.lazy_pagination(
+                    100, connection=connection, prefetch=3))
+            finally:
+                connection.close()
+        self.assertEqual(ahead, plain)
+        self.assertEqual(sum(len(page) for page in ahead), 1234)
+
+
+if __name__ == "__main__":
+    unittest.main()
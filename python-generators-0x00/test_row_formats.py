@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""Tests for the row formats in row_formats.py."""
+import os
+import sqlite3
+import tempfile
+import unittest
+from array import array
+
+import pagination
+import row_formats
+from users_fixture import make_users_db, user_rows
+
+lazy_paginate = __import__('2-lazy_paginate')
+
+ROWS = 250
+
+
+class TestRowFormats(unittest.TestCase):
+    """Tests the conversions between row formats."""
+
+    def setUp(self) -> None:
+        """Builds a few `(user_id, name, email, age)` tuples."""
+        self.rows = list(user_rows(5))
+
+    def test_conversions(self) -> None:
+        """Tests from_tuples and shape for every format."""
+        dicts = row_formats.from_tuples(self.rows, row_formats.DICT)
+        self.assertEqual(dicts[1], {"user_id": f"{1:036d}", "name": "User 1",
+                                    "email": "user1@example.com", "age": 19})
+        self.assertEqual(row_formats.from_tuples(self.rows, row_formats.TUPLE), self.rows)
+        records = row_formats.shape(self.rows, row_formats.RECORD)
+        self.assertEqual([tuple(record) for record in records], self.rows)
+        self.assertEqual([record._asdict() for record in records], dicts)
+        columnar = row_formats.from_tuples(iter(self.rows), row_formats.COLUMNAR)
+        self.assertEqual(list(columnar.rows()), self.rows)
+        self.assertEqual(len(columnar), 5)
+        for batch in (dicts, self.rows, records, columnar):
+            self.assertEqual(row_formats.last_user_id(batch), f"{4:036d}")
+        with self.assertRaises(ValueError):
+            row_formats.check_format("json")
+
+    def test_user_record_behaves_like_a_namedtuple(self) -> None:
+        """Tests attributes, indexing, unpacking and equality of UserRecord."""
+        record = row_formats.converter(row_formats.RECORD)(self.rows[2])
+        user_id, name, email, age = record
+        self.assertEqual((record.user_id, record.name, record.age),
+                         (user_id, name, age))
+        self.assertEqual((record[3], record[-1], len(record)), (20, 20, 4))
+        self.assertEqual(record, row_formats.UserRecord(*self.rows[2]))
+        self.assertNotEqual(record, row_formats.UserRecord(*self.rows[3]))
+        self.assertFalse(hasattr(record, "__dict__"))
+        self.assertIsNone(row_formats.converter(row_formats.TUPLE))
+
+    def test_columnar_batch_keeps_ages_packed(self) -> None:
+        """Tests that ages stay an array('i') and projections drop columns."""
+        batch = row_formats.ColumnarBatch.from_rows(self.rows)
+        self.assertIsInstance(batch.age, array)
+        self.assertEqual(batch.age.typecode, "i")
+        self.assertEqual(batch.age.tolist(), [18, 19, 20, 21, 22])
+        empty = row_formats.ColumnarBatch.from_rows([])
+        self.assertEqual((len(empty), empty.age.typecode), (0, "i"))
+        projected = row_formats.ColumnarBatch.from_columns(
+            {"user_id": batch.user_id, "age": batch.age})
+        self.assertIsNone(projected.name)
+        self.assertIs(projected.age, batch.age)
+        self.assertEqual(list(projected.columns()), ["user_id", "age"])
+        self.assertEqual(next(projected.rows()), (f"{0:036d}", 18))
+
+
+class TestLazyPaginationRowFormats(unittest.TestCase):
+    """Tests that lazy_pagination returns pages in the requested format."""
+
+    def setUp(self) -> None:
+        """Builds a populated SQLite stand-in."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmpdir.name, "users.db")
+        make_users_db(path, ROWS)
+        self.connection = sqlite3.connect(path)
+
+    def tearDown(self) -> None:
+        """Closes the connection and removes the stand-in."""
+        self.connection.close()
+        self.tmpdir.cleanup()
+
+    def pages(self, row_format: str, **options) -> list:
+        """Returns every page of a lazy_pagination scan in `row_format`."""
+        return list(lazy_paginate.lazy_pagination(
+            100, connection=self.connection, row_format=row_format, **options))
+
+    def test_every_format_holds_the_same_rows(self) -> None:
+        """Tests the page types and that all formats agree on the rows."""
+        expected = list(user_rows(ROWS))
+        dicts = self.pages(row_formats.DICT)
+        self.assertEqual([tuple(row.values()) for page in dicts for row in page], expected)
+        tuples = self.pages(row_formats.TUPLE)
+        self.assertIsInstance(tuples[0][0], tuple)
+        self.assertEqual([row for page in tuples for row in page], expected)
+        records = self.pages(row_formats.RECORD)
+        self.assertIsInstance(records[0][0], row_formats.UserRecord)
+        self.assertEqual([tuple(row) for page in records for row in page], expected)
+        columnar = self.pages(row_formats.COLUMNAR, mode=pagination.OFFSET)
+        self.assertEqual([len(page) for page in columnar], [100, 100, 50])
+        for page in columnar:
+            self.assertIsInstance(page, row_formats.ColumnarBatch)
+            self.assertEqual(page.age.typecode, "i")
+        self.assertEqual([row for page in columnar for row in page.rows()], expected)
+
+    def test_resuming_a_columnar_scan(self) -> None:
+        """Tests cursor_for on a columnar page."""
+        first = self.pages(row_formats.COLUMNAR)[0]
+        rest = self.pages(row_formats.COLUMNAR, cursor_token=pagination.cursor_for(first))
+        self.assertEqual(rest[0].user_id[0], f"{100:036d}")
+        self.assertEqual(sum(len(page) for page in rest), ROWS - 100)
+
+    def test_unknown_format_is_rejected(self) -> None:
+        """Tests that an unknown row format raises ValueError."""
+        with self.assertRaises(ValueError):
+            self.pages("json")
+
+
+if __name__ == "__main__":
+    unittest.main()
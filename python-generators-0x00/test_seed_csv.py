@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""Tests for the memory-mapped CSV front end of seed.bulk_insert_data.
+
+A SQLite database stands in for the 'ALX_prodev' MySQL database.
+"""
+import csv
+import os
+import sqlite3
+import tempfile
+import tracemalloc
+import unittest
+
+import bloom
+import seed
+
+ROWS = [
+    ["user_id", "name", "email", "age"],
+    ["u-1", "Ann", "ann@example.com", "30"],
+    ["u-2", "Bob, Jr.", "bob@example.com", "41"],
+    ["u-3", "Cy", "cy@example.com", "old"],
+    ["u-4", "Dee", "dee@example.com"],
+    ["u-5", "Eve", "eve@example.com", "25"],
+    ["u-1", "Ann again", "ann2@example.com", "31"],
+]
+
+
+class FailOnceConnect:
+    """A picklable connection factory whose first call, in any process, fails."""
+
+    def __init__(self, database: str, marker: str) -> None:
+        self.database = database
+        self.marker = marker
+
+    def __call__(self):
+        try:
+            os.close(os.open(self.marker, os.O_CREAT | os.O_EXCL))
+        except FileExistsError:
+            return sqlite3.connect(self.database, timeout=60)
+        return None
+
+
+class TestMmapCsvBatches(unittest.TestCase):
+    """Tests parsing, validation, rejects and loading of seed CSV files."""
+
+    def setUp(self) -> None:
+        """Creates a scratch directory."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        """Removes the scratch directory."""
+        self.tmpdir.cleanup()
+
+    def write(self, name: str, rows: list, lineterminator: str = "\r\n") -> str:
+        """Writes `rows` as a CSV file and returns its path."""
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, "w", newline="", encoding="utf-8") as file:
+            csv.writer(file, lineterminator=lineterminator).writerows(rows)
+        return path
+
+    def test_bulk_insert_sends_bad_rows_to_rejects_file(self) -> None:
+        """Tests counts, inserted rows and the rejects file."""
+        path = self.write("users.csv", ROWS)
+        rejects_file = os.path.join(self.tmpdir.name, "rejects.csv")
+        connection = sqlite3.connect(":memory:")
+        seed.create_table(connection)
+        result = seed.bulk_insert_data(connection, path, batch_size=2,
+                                       use_load_data=False, rejects_file=rejects_file)
+        self.assertEqual((result.inserted, result.duplicates, result.skipped), (3, 1, 2))
+        names = [row[0] for row in connection.execute(
+            "SELECT name FROM user_data ORDER BY user_id")]
+        self.assertEqual(names, ["Ann", "Bob, Jr.", "Eve"])
+        connection.close()
+        with open(rejects_file, newline="", encoding="utf-8") as file:
+            rejected = list(csv.reader(file))
+        self.assertEqual(rejected, [
+            seed.REJECTS_HEADER,
+            ["4", "invalid age: 'old'", "u-3", "Cy", "cy@example.com", "old"],
+            ["5", "expected 4 columns, got 3", "u-4", "Dee", "dee@example.com"],
+        ])
+
+    def test_database_error_stops_the_load_and_is_reported(self) -> None:
+        """Tests that a failed batch is recorded instead of reported complete."""
+        path = self.write("users.csv", ROWS)
+        connection = sqlite3.connect(":memory:")
+        seed.create_table(connection)
+        connection.execute(
+            "CREATE TRIGGER refuse BEFORE INSERT ON user_data WHEN NEW.user_id = 'u-5' "
+            "BEGIN SELECT RAISE(ABORT, 'refused'); END")
+        result = seed.bulk_insert_data(connection, path, batch_size=2, use_load_data=False)
+        self.assertFalse(result.ok)
+        self.assertIn("refused", result.error)
+        self.assertEqual((result.inserted, result.batches), (2, 1))
+        count, = connection.execute("SELECT COUNT(*) FROM user_data").fetchone()
+        self.assertEqual(count, 2)
+        connection.close()
+
+        merged = seed.LoadResult(inserted=1).merge(result)
+        self.assertEqual((merged.inserted, merged.ok), (3, False))
+
+    def test_chunking_and_line_endings_do_not_change_the_rows(self) -> None:
+        """Tests that small chunks, LF endings and quotes parse identically."""
+        users = [["user_id", "name", "email", "age"]] + [
+            [f"id-{i}", f"User {i}", f"user{i}@example.com", str(i % 90)]
+            for i in range(1000)]
+        expected = [(u, n, e, int(a)) for u, n, e, a in users[1:]]
+        plain = self.write("plain.csv", users, lineterminator="\n")
+        quoted = os.path.join(self.tmpdir.name, "quoted.csv")
+        with open(quoted, "w", newline="", encoding="utf-8") as file:
+            csv.writer(file, quoting=csv.QUOTE_ALL).writerows(users)
+        for path in (plain, quoted):
+            for chunk_size in (1, 97, 1 << 20):
+                result = seed.LoadResult()
+                batches = list(seed.mmap_csv_batches(path, 64, result,
+                                                     chunk_size=chunk_size))
+                self.assertEqual([row for batch in batches for row in batch], expected)
+                self.assertTrue(all(len(batch) == 64 for batch in batches[:-1]))
+                self.assertEqual(result.skipped, 0)
+
+    def test_shards_cover_every_row_once(self) -> None:
+        """Tests that parsing the csv_shards ranges reproduces the whole file."""
+        path = self.write("users.csv", ROWS)
+        rows = []
+        for start, end in seed.csv_shards(path, 3):
+            for batch in seed.mmap_csv_batches(path, 10, seed.LoadResult(),
+                                               start=start, end=end):
+                rows.extend(batch)
+        whole = list(seed.mmap_csv_batches(path, 10, seed.LoadResult()))[0]
+        self.assertEqual(rows, whole)
+
+    def test_parallel_insert_reports_failed_shards(self) -> None:
+        """Tests that a shard whose worker cannot connect is marked failed."""
+        users = [["user_id", "name", "email", "age"]] + [
+            [f"id-{i:04d}", f"User {i}", f"user{i}@example.com", str(i % 90)]
+            for i in range(400)]
+        path = self.write("users.csv", users)
+        database = os.path.join(self.tmpdir.name, "users.db")
+        connection = sqlite3.connect(database)
+        seed.create_table(connection)
+        connection.close()
+        connect = FailOnceConnect(database, os.path.join(self.tmpdir.name, "failed"))
+        result = seed.parallel_insert_data(path, workers=2, batch_size=50,
+                                           shards_per_worker=2, connect=connect)
+        self.assertFalse(result.ok)
+        self.assertEqual(len(result.failed_shards), 1)
+        self.assertLess(result.inserted, 400)
+
+        # The failed byte range can be loaded again on its own.
+        connection = sqlite3.connect(database)
+        start, end = result.failed_shards[0]
+        retry = seed.LoadResult()
+        seed.load_batches(connection, seed.mmap_csv_batches(
+            path, 50, retry, start=start, end=end), retry)
+        self.assertTrue(retry.ok)
+        self.assertEqual(result.inserted + retry.inserted, 400)
+        count, = connection.execute("SELECT COUNT(*) FROM user_data").fetchone()
+        self.assertEqual(count, 400)
+        connection.close()
+
+    def test_header_only_and_empty_files(self) -> None:
+        """Tests that files without data rows yield nothing."""
+        for rows in ([], [ROWS[0]]):
+            path = self.write("empty.csv", rows)
+            self.assertEqual(list(seed.mmap_csv_batches(path, 10, seed.LoadResult())), [])
+
+
+class TestDedupStage(unittest.TestCase):
+    """Tests the Bloom filter dedup stage in front of the inserts."""
+
+    def setUp(self) -> None:
+        """Builds a table holding half of the users and a CSV of all of them."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.connection = sqlite3.connect(":memory:")
+        seed.create_table(self.connection)
+        users = [(f"id-{i}", f"User {i}", f"user{i}@example.com", i % 90)
+                 for i in range(3000)]
+        self.connection.executemany(
+            "INSERT INTO user_data (user_id, name, email, age) VALUES (?, ?, ?, ?)",
+            users[::2])
+        self.connection.commit()
+        self.path = os.path.join(self.tmpdir.name, "users.csv")
+        with open(self.path, "w", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file)
+            writer.writerow(["user_id", "name", "email", "age"])
+            writer.writerows(users + users[:300])
+
+    def tearDown(self) -> None:
+        """Closes the connection and removes the scratch directory."""
+        self.connection.close()
+        self.tmpdir.cleanup()
+
+    def count(self) -> int:
+        """Returns the number of rows in user_data."""
+        return self.connection.execute("SELECT COUNT(*) FROM user_data").fetchone()[0]
+
+    def test_duplicates_never_reach_the_database(self) -> None:
+        """Tests that only new rows are sent, with exact counts."""
+        self.assertEqual(seed.count_csv_rows(self.path), 3300)
+        result = seed.bulk_insert_data(self.connection, self.path, batch_size=500,
+                                       use_load_data=False, dedup=True)
+        self.assertEqual((result.inserted, result.duplicates, result.filtered),
+                         (1500, 0, 1800))
+        self.assertEqual(self.count(), 3000)
+
+    def test_false_positives_are_confirmed_not_dropped(self) -> None:
+        """Tests that an overfull filter loses no rows when verifying."""
+        key_filter = bloom.BloomFilter(100, error_rate=0.2)
+        key_filter.update(user_id for (user_id,) in
+                          self.connection.execute("SELECT user_id FROM user_data"))
+        self.assertGreater(sum(f"new-{i}" in key_filter for i in range(1000)), 500)
+        result = seed.bulk_insert_data(self.connection, self.path, batch_size=500,
+                                       use_load_data=False, dedup=key_filter)
+        self.assertEqual((result.inserted, result.duplicates), (1500, 0))
+        self.assertEqual(self.count(), 3000)
+
+        unverified = seed.LoadResult()
+        batches = seed.dedup_batches([[(f"new-{i}", "n", "e", 1) for i in range(1000)]],
+                                     key_filter, unverified)
+        self.assertEqual(sum(len(batch) for batch in batches) + unverified.filtered, 1000)
+        self.assertGreater(unverified.filtered, 0)
+
+    def test_repeats_within_the_file_are_not_looked_up(self) -> None:
+        """Tests that only filter hits not yet seen in the file are verified."""
+        looked_up = []
+        lookup = seed.existing_keys
+
+        def recording(connection, keys):
+            looked_up.extend(keys)
+            return lookup(connection, keys)
+        seed.existing_keys = recording
+        try:
+            result = seed.bulk_insert_data(self.connection, self.path, batch_size=500,
+                                           use_load_data=False, dedup=True)
+        finally:
+            seed.existing_keys = lookup
+        self.assertEqual((result.inserted, result.filtered), (1500, 1800))
+        self.assertEqual(len(looked_up), len(set(looked_up)))
+        self.assertTrue(set(looked_up).isdisjoint(f"id-{i}" for i in range(1, 300, 2)))
+        self.assertLess(len(looked_up), 1500 + 100)
+
+    def test_known_keys_are_bounded(self) -> None:
+        """Tests that the remembered keys stay capped and forgotten repeats are looked up."""
+        def peak(distinct: int) -> int:
+            key_filter = bloom.BloomFilter(200000)
+            batches = ([(f"new-{i}", "n", "e", 1) for i in range(start, start + 500)]
+                       for start in range(0, distinct, 500))
+            tracemalloc.start()
+            try:
+                for _ in seed.dedup_batches(batches, key_filter, seed.LoadResult(),
+                                            self.connection, known_keys=1000):
+                    pass
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        peak(2000)  # warm up lazily allocated caches
+        small, large = peak(20000), peak(80000)
+        self.assertLess(large, small * 1.5)
+
+        # Keys repeated after they left the cache are confirmed in the table.
+        looked_up = []
+        lookup = seed.existing_keys
+
+        def recording(connection, keys):
+            looked_up.extend(keys)
+            return lookup(connection, keys)
+        batches = [[(f"id-{i}", "n", "e", 1) for i in range(start, start + 500)]
+                   for start in range(3000, 6000, 500)]
+        batches.append([(f"id-{i}", "n", "e", 1) for i in range(3000, 3500)])
+        result = seed.LoadResult()
+        seed.existing_keys = recording
+        try:
+            for batch in seed.dedup_batches(batches, bloom.BloomFilter(10000), result,
+                                            self.connection, known_keys=1000):
+                self.connection.executemany(
+                    "INSERT INTO user_data (user_id, name, email, age) VALUES (?, ?, ?, ?)",
+                    batch)
+        finally:
+            seed.existing_keys = lookup
+        self.assertEqual(result.filtered, 500)
+        self.assertLessEqual({f"id-{i}" for i in range(3000, 3500)}, set(looked_up))
+
+    def test_false_positive_rate(self) -> None:
+        """Tests the measured false-positive rate against the target."""
+        key_filter = bloom.BloomFilter(20000, error_rate=0.01)
+        key_filter.update(f"key-{i}" for i in range(0, 40000, 2))
+        self.assertTrue(all(f"key-{i}" in key_filter for i in range(0, 40000, 2)))
+        misses = sum(f"key-{i}" in key_filter for i in range(1, 40000, 2))
+        self.assertLess(misses / 20000, 0.02)
+        self.assertAlmostEqual(key_filter.false_positive_rate, 0.01, delta=0.002)
+
+    def test_batch_and_single_key_paths_agree(self) -> None:
+        """Tests that add_many sets the same bits as add, with or without NumPy."""
+        keys = [f"key-{i}" for i in range(5000)]
+        single = bloom.BloomFilter(5000)
+        for key in keys:
+            single.add(key)
+        batched = bloom.BloomFilter(5000)
+        self.assertFalse(any(batched.add_many(keys[:2500])))
+        self.assertTrue(all(batched.add_many(keys[:10])))
+        numpy = bloom.numpy
+        bloom.numpy = None
+        try:
+            self.assertEqual(batched.add_many(keys[2500:] + ["key-0"])[-1], True)
+        finally:
+            bloom.numpy = numpy
+        self.assertEqual(batched.bits, single.bits)
+
+
+    def test_count_matches_adding_keys_one_by_one(self) -> None:
+        """Tests `count` after add_many, with and without NumPy."""
+        numpy = bloom.numpy
+        for module in (numpy, None):
+            bloom.numpy = module
+            try:
+                key_filter = bloom.BloomFilter(1000)
+                key_filter.add("a")
+                key_filter.add("b")
+                self.assertEqual(key_filter.add_many(["a", "b", "c", "c"]),
+                                 [True, True, False, False])
+                self.assertEqual(key_filter.count, 3)
+                keys = [f"key-{i % 700}" for i in range(2000)]
+                single = bloom.BloomFilter(1000)
+                for key in keys:
+                    single.add(key)
+                batched = bloom.BloomFilter(1000)
+                batched.add_many(keys[:1500])
+                batched.add_many(keys[1500:])
+                self.assertEqual((batched.count, batched.bits), (single.count, single.bits))
+            finally:
+                bloom.numpy = numpy
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""Tests for the `stream_users` generator in 0-stream_users.py."""
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import pagination
+from users_fixture import make_users_db
+
+stream_users_module = __import__('0-stream_users')
+lazy_paginate = __import__('2-lazy_paginate')
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROWS = 1000000
+
+# Runs in a fresh interpreter so that the peak RSS it reports belongs to
+# the streaming alone and not to whatever pytest allocated before.
+MEASURE_SCRIPT = """
+import resource, sqlite3, sys
+sys.path.insert(0, sys.argv[1])
+stream_users = __import__('0-stream_users').stream_users
+connection = sqlite3.connect(sys.argv[2])
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+count = 0
+for row in stream_users(fetch_size=int(sys.argv[3]), connection=connection):
+    count += 1
+after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(count, after - before)
+"""
+
+
+class TestStreamUsers(unittest.TestCase):
+    """Tests the `stream_users` generator."""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        """Builds the SQLite stand-in once for all tests."""
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.db_path = os.path.join(cls.tmpdir.name, "users.db")
+        make_users_db(cls.db_path, ROWS)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        """Removes the SQLite stand-in."""
+        cls.tmpdir.cleanup()
+
+    def test_streaming_matches_default_cursor(self) -> None:
+        """Tests that fetchmany streaming yields the same dict rows."""
+        connection = sqlite3.connect(self.db_path)
+        try:
+            default = stream_users_module.stream_users(connection=connection)
+            chunked = stream_users_module.stream_users(
+                fetch_size=7, connection=connection)
+            for _ in range(50):
+                self.assertEqual(next(default), next(chunked))
+            default.close()
+            chunked.close()
+        finally:
+            connection.close()
+
+    def test_borrowed_connection_left_open(self) -> None:
+        """Tests that a caller's connection is not closed by the stream."""
+        connection = sqlite3.connect(self.db_path)
+        try:
+            rows = stream_users_module.stream_users(
+                fetch_size=100, connection=connection)
+            next(rows)
+            rows.close()
+            connection.execute("SELECT 1")
+        finally:
+            connection.close()
+
+    def test_peak_rss_bounded(self) -> None:
+        """Tests that streaming 1M rows keeps peak RSS flat."""
+        output = subprocess.run(
+            [sys.executable, "-c", MEASURE_SCRIPT, HERE, self.db_path, "1000"],
+            check=True, capture_output=True, text=True,
+        ).stdout.split()
+        count, growth_kb = int(output[-2]), int(output[-1])
+        self.assertEqual(count, ROWS)
+        # Holding 1M row dicts would need hundreds of MB.
+        self.assertLess(growth_kb, 32 * 1024)
+
+
+class TestKeysetPagination(unittest.TestCase):
+    """Tests keyset cursors and their parity with offset paging."""
+
+    def setUp(self) -> None:
+        """Creates a small SQLite stand-in."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmpdir.name, "users.db")
+        make_users_db(path, 1050)
+        self.connection = sqlite3.connect(path)
+
+    def tearDown(self) -> None:
+        """Closes the connection and removes the SQLite stand-in."""
+        self.connection.close()
+        self.tmpdir.cleanup()
+
+    def user_ids(self, pages) -> list:
+        """Returns the `user_id` of every row of `pages`, in order."""
+        return [row["user_id"] for page in pages for row in page]
+
+    def test_malformed_and_tampered_tokens_are_rejected(self) -> None:
+        """Tests that decode_cursor and both paging entry points raise ValueError."""
+        token = pagination.encode_cursor(f"{41:036d}")
+        self.assertEqual(pagination.decode_cursor(token), f"{41:036d}")
+        bad_tokens = [
+            "", "not a token!", token[:-4], token[1:],
+            pagination.encode_cursor(41),  # a user_id of the wrong type
+            "e30=",  # {}
+            "WzFd",  # [1]
+        ]
+        for bad in bad_tokens:
+            with self.assertRaises(ValueError, msg=bad):
+                pagination.decode_cursor(bad)
+            with self.assertRaises(ValueError, msg=bad):
+                next(pagination.iter_pages(self.connection, 100, cursor_token=bad))
+            with self.assertRaises(ValueError, msg=bad):
+                next(lazy_paginate.lazy_pagination(
+                    100, cursor_token=bad, connection=self.connection))
+        with self.assertRaises(ValueError):
+            next(pagination.iter_pages(self.connection, 100, mode=pagination.OFFSET,
+                                       cursor_token=token))
+
+    def test_resume_from_cursor_has_no_gaps_or_duplicates(self) -> None:
+        """Tests that resuming after every page rebuilds the full scan."""
+        full = self.user_ids(lazy_paginate.lazy_pagination(
+            100, connection=self.connection))
+        self.assertEqual(len(full), 1050)
+        resumed, token = [], None
+        while True:
+            pages = lazy_paginate.lazy_pagination(
+                100, cursor_token=token, connection=self.connection)
+            page = next(pages, None)
+            pages.close()
+            if page is None:
+                break
+            resumed.extend(row["user_id"] for row in page)
+            token = pagination.cursor_for(page)
+        self.assertEqual(resumed, full)
+        self.assertEqual(len(set(resumed)), len(resumed))
+
+    def test_keyset_matches_offset(self) -> None:
+        """Tests that both modes return the same rows in the same order."""
+        for page_size in (1, 7, 100, 1050, 5000):
+            keyset = list(pagination.iter_pages(self.connection, page_size))
+            offset = list(pagination.iter_pages(self.connection, page_size,
+                                                 mode=pagination.OFFSET))
+            self.assertEqual(keyset, offset, page_size)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""Test fixture: a SQLite 'user_data' table standing in for 'ALX_prodev'.
+
+Row `i` has the user_id `f"{i:036d}"`, so ids sort in insertion order,
+and the age `18 + i % 70`.
+"""
+import sqlite3
+
+import seed
+
+
+def user_rows(rows: int, name: str = "User {}"):
+    """Yields `rows` synthetic `(user_id, name, email, age)` tuples."""
+    return ((f"{i:036d}", name.format(i), f"user{i}@example.com", 18 + i % 70)
+            for i in range(rows))
+
+
+def fill_users(connection, rows: int, name: str = "User {}") -> None:
+    """Creates the 'user_data' table on `connection` and commits `rows` users."""
+    seed.create_table(connection)
+    connection.executemany(
+        "INSERT INTO user_data (user_id, name, email, age) VALUES (?, ?, ?, ?)",
+        user_rows(rows, name),
+    )
+    connection.commit()
+
+
+def make_users_db(path: str, rows: int, name: str = "User {}") -> None:
+    """Creates a SQLite database at `path` with `rows` synthetic users."""
+    connection = sqlite3.connect(path)
+    try:
+        fill_users(connection, rows, name)
+    finally:
+        connection.close()